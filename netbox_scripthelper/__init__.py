@@ -10,10 +10,26 @@ class ScriptHelperConfig(PluginConfig):
     author_email = 'avshalashov@yandex.ru'
     base_url = 'scripthelper'
     required_settings = []
-    default_settings = {}
+    default_settings = {
+        'cache_timeout': 0,
+        'coalesce_script_events': False,
+        'async_events': False,
+        'events_queue': 'default',
+        'compact_snapshots': False,
+        'instrumentation': False,
+        'metrics_hook': None,
+        'reservation_timeout': 60,
+        'permission_cache_timeout': 0,
+        'freespace_engine': 'python',
+        'freespace_index': False,
+    }
     django_apps = []
     min_version = '4.2.0'
     max_version = '4.3.99'
 
+    def ready(self):
+        super().ready()
+        from . import signals  # noqa: F401
+
 
 config = ScriptHelperConfig
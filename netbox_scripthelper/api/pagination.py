@@ -0,0 +1,60 @@
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from binascii import Error as Base64Error
+from itertools import islice
+
+from netaddr import AddrFormatError
+from rest_framework.exceptions import NotFound
+from rest_framework.utils.urls import replace_query_param
+
+CURSOR_QUERY_PARAM = 'cursor'
+
+
+def get_results_limit(request):
+    try:
+        return int(request.query_params.get('limit', None))
+    except TypeError:
+        return None
+
+
+def encode_cursor(value):
+    """
+    Returns an opaque token pointing to the last returned `value`.
+    """
+    return urlsafe_b64encode(str(value).encode()).decode().rstrip('=')
+
+
+def decode_cursor(request, parse=str):
+    """
+    Returns the last value of the previous page converted by `parse` or None
+    if the first page is requested.
+    """
+    token = request.query_params.get(CURSOR_QUERY_PARAM)
+    if not token:
+        return None
+    try:
+        value = urlsafe_b64decode(token + '=' * (-len(token) % 4)).decode()
+        return parse(value)
+    except (Base64Error, UnicodeDecodeError, ValueError, AddrFormatError):
+        raise NotFound('Invalid cursor')
+
+
+def paginate_results(request, objects, cursor=None):
+    """
+    Takes no more than `limit` items from the lazy iterable `objects`.
+    Returns the items and a link to the next page, if there is one.
+    `cursor` returns the cursor value of an item, the item itself by default.
+    """
+    limit = get_results_limit(request)
+    if limit is None:
+        return list(objects), None
+    if limit <= 0:
+        return [], None
+
+    # Fetch an extra item to find out whether the next page exists
+    results = list(islice(objects, limit + 1))
+    if len(results) <= limit:
+        return results, None
+    results = results[:limit]
+    last = results[-1] if cursor is None else cursor(results[-1])
+    url = request.build_absolute_uri()
+    return results, replace_query_param(url, CURSOR_QUERY_PARAM, encode_cursor(last))
@@ -0,0 +1,48 @@
+from itertools import islice
+
+from rest_framework.renderers import JSONRenderer
+from rest_framework.compat import LONG_SEPARATORS, SHORT_SEPARATORS
+
+# The number of records encoded at once while streaming a page
+CHUNK_SIZE = 1000
+
+
+def can_stream(request):
+    """
+    Returns True if the response to `request` is rendered by the plain JSON
+    renderer, so it can be written without the renderer.
+    """
+    renderer = getattr(request, 'accepted_renderer', None)
+    if type(renderer) is not JSONRenderer:
+        return False
+    return renderer.get_indent(request.accepted_media_type, {}) is None
+
+
+def iter_json_page(renderer, next_link, records, chunk_size=CHUNK_SIZE):
+    """
+    Yields the JSON of {"next": next_link, "results": records} in chunks of
+    `chunk_size` records. The output is byte-identical to what `renderer`
+    produces for the whole page at once.
+    """
+    separators = SHORT_SEPARATORS if renderer.compact else LONG_SEPARATORS
+    item_separator, key_separator = (s.encode() for s in separators)
+    encoder = renderer.encoder_class(
+        ensure_ascii=renderer.ensure_ascii,
+        allow_nan=not renderer.strict,
+        separators=separators
+    )
+
+    def encode(value):
+        ret = encoder.encode(value)
+        return ret.replace('\u2028', '\\u2028').replace('\u2029', '\\u2029').encode()
+
+    yield b''.join((
+        b'{', encode('next'), key_separator, encode(next_link), item_separator,
+        encode('results'), key_separator, b'['
+    ))
+    records = iter(records)
+    separator = b''
+    while chunk := list(islice(records, chunk_size)):
+        yield separator + item_separator.join(map(encode, chunk))
+        separator = item_separator
+    yield b']}'
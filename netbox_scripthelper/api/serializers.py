@@ -1,7 +1,36 @@
 from rest_framework import serializers
 
 
-class AvailableVLANSerializer(serializers.Serializer):
+class AvailableObjectListSerializer(serializers.ListSerializer):
+    """
+    Represents the objects of a response in a single pass with the function
+    the child serializer prepares once per response.
+    """
+
+    def to_representation(self, data):
+        return list(self.child.iter_representation(data))
+
+
+class AvailableObjectSerializer(serializers.Serializer):
+    """
+    Base representation of the objects listed by the plugin views.
+    """
+
+    class Meta:
+        list_serializer_class = AvailableObjectListSerializer
+
+    def get_representation(self):
+        """
+        Returns a function representing a single object. Anything depending
+        only on the context is evaluated here rather than for every object.
+        """
+        return self.to_representation
+
+    def iter_representation(self, instances):
+        return map(self.get_representation(), instances)
+
+
+class AvailableVLANSerializer(AvailableObjectSerializer):
     """
     Representation of a VLAN which does not exist in the database.
     """
@@ -13,7 +42,22 @@ class AvailableVLANSerializer(serializers.Serializer):
         }
 
 
-class AvailablePrefixSerializer(serializers.Serializer):
+class AvailableVLANRangeSerializer(AvailableObjectSerializer):
+    """
+    Representation of a range of consecutive VIDs which do not exist in the database.
+    """
+
+    def to_representation(self, instance):
+        return {
+            'id': str(instance),
+            'display': str(instance),
+            'first': instance.first,
+            'last': instance.last,
+            'size': instance.size,
+        }
+
+
+class AvailablePrefixSerializer(AvailableObjectSerializer):
     """
     Representation of a prefix which does not exist in the database.
     """
@@ -25,23 +69,28 @@ class AvailablePrefixSerializer(serializers.Serializer):
         }
 
 
-class AvailableIPSerializer(serializers.Serializer):
+class AvailableIPSerializer(AvailableObjectSerializer):
     """
     Representation of an IP address which does not exist in the database.
     """
-    def to_representation(self, instance):
+    def get_representation(self):
         with_mask = self.context['request'].query_params.get('with_mask', 'true').lower()
+        suffix = f"/{self.context['parent'].mask_length}" if with_mask == 'true' else ''
 
-        value = str(instance)
-        if with_mask == 'true':
-            value = f"{instance}/{self.context['parent'].mask_length}"
+        def represent(instance):
+            value = f'{instance}{suffix}'
+            return {
+                'id': value,
+                'display': value,
+            }
+
+        return represent
+
+    def to_representation(self, instance):
+        return self.get_representation()(instance)
 
-        return {
-            'id': value,
-            'display': value,
-        }
 
-class ChildIPSerializer(serializers.Serializer):
+class ChildIPSerializer(AvailableObjectSerializer):
     """
     Representation of an IP address which exists in the database.
     """
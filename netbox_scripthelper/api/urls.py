@@ -5,11 +5,31 @@ from . import views
 app_name = 'scripthelper'
 
 urlpatterns = [
+    path(
+        'bulk-available/',
+        views.BulkAvailableObjectsView.as_view(),
+        name='bulk-available'
+    ),
+    path(
+        'ip-ranges/<int:pk>/allocate/',
+        views.IPRangeAllocateView.as_view(),
+        name='iprange-allocate'
+    ),
     path(
         'ip-ranges/<int:pk>/available-ips/',
         views.IPRangeAvailableIPAddressesView.as_view(),
         name='iprange-available-ips'
     ),
+    path(
+        'ip-ranges/<int:pk>/available-summary/',
+        views.IPRangeAvailableSummaryView.as_view(),
+        name='iprange-available-summary'
+    ),
+    path(
+        'prefixes/<int:pk>/allocate/',
+        views.PrefixAllocateView.as_view(),
+        name='prefix-allocate'
+    ),
     path(
         'prefixes/<int:pk>/available-prefixes/',
         views.AvailablePrefixesView.as_view(),
@@ -20,14 +40,29 @@ urlpatterns = [
         views.PrefixAvailableIPAddressesView.as_view(),
         name='prefix-available-ips'
     ),
+    path(
+        'prefixes/<int:pk>/available-summary/',
+        views.PrefixAvailableSummaryView.as_view(),
+        name='prefix-available-summary'
+    ),
     path(
         'prefixes/<int:pk>/child-ips/',
         views.PrefixChildIPAddressesView.as_view(),
         name='prefix-child-ips'
     ),
+    path(
+        'prefixes/<int:pk>/plan/',
+        views.PrefixPlanView.as_view(),
+        name='prefix-plan'
+    ),
     path(
         'vlan-groups/<int:pk>/available-vlans/',
         views.AvailableVLANsView.as_view(),
         name='vlangroup-available-vlans'
     ),
+    path(
+        'vlan-groups/<int:pk>/available-summary/',
+        views.VLANGroupAvailableSummaryView.as_view(),
+        name='vlangroup-available-summary'
+    ),
 ]
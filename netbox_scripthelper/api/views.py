@@ -1,129 +1,739 @@
-from django.shortcuts import get_object_or_404
+import copy
+import hashlib
+from collections import defaultdict
+from contextlib import nullcontext
+from datetime import datetime, timezone
+from operator import itemgetter
+from urllib.parse import urlsplit
+
+from django.core.cache import cache
+from django.db.models import BooleanField, Count, Max
+from django.db.models.expressions import RawSQL
+from django.http import QueryDict, StreamingHttpResponse
+from django.urls import Resolver404, resolve, reverse
+from django.utils.cache import patch_cache_control
+from django.utils.http import parse_etags, quote_etag
+import netaddr
+from rest_framework import status
+from rest_framework.exceptions import PermissionDenied, ValidationError
+from rest_framework.request import Request
 from rest_framework.response import Response
 from rest_framework.views import APIView
 
+from ipam.constants import VLAN_VID_MAX
 from ipam.models import VLAN, VLANGroup, Prefix, IPAddress, IPRange
+from netbox.api.authentication import IsAuthenticatedOrLoginNotRequired
 from netbox.api.viewsets.mixins import ObjectValidationMixin
 
+from .pagination import decode_cursor, get_results_limit, paginate_results
+from .renderers import can_stream, iter_json_page
 from .serializers import (AvailableVLANSerializer,
+                          AvailableVLANRangeSerializer,
                           AvailablePrefixSerializer,
                           AvailableIPSerializer,
                           ChildIPSerializer)
-from netbox_scripthelper.utils import IPSplitter
+from netbox_scripthelper import freespace, reservations
+from netbox_scripthelper.cache import get_request_digest, get_response_key
+from netbox_scripthelper.config import get_setting
+from netbox_scripthelper.instrumentation import get_timings, start_timings
+from netbox_scripthelper.parents import get_parent_or_404, resolve_parent, resolve_parents
+from netbox_scripthelper.utils import (Interval,
+                                       IntervalSet,
+                                       IPSplitter,
+                                       allocate,
+                                       get_network_ranges,
+                                       get_number_ranges,
+                                       iter_available_ips,
+                                       plan_subnets)
 
+# The largest number of addresses or prefixes a single allocation may return
+MAX_ALLOCATE_COUNT = 65536
 
-def get_results_limit(request):
-    try:
-        return int(request.query_params.get('limit', None))
-    except TypeError:
-        return None
+# The largest number of prefixes a single plan may contain
+MAX_PLAN_SIZE = 65536
 
+# Searches matching more address ranges are not pushed down to the database
+MAX_SEARCH_RANGES = 64
+# The host part of an IP address, which orders addresses regardless of their masks
+HOST_SQL = f'HOST("{IPAddress._meta.db_table}"."address")::inet'
+# The number of choices resolved for a form field if the limit is not set
+CHOICES_LIMIT = 50
+# Pages with at least this many results are streamed instead of being rendered at once
+STREAMING_THRESHOLD = 1000
 
-def filter_results(request, objects):
-    q = request.query_params.get('q', '')
-    limit = get_results_limit(request)
-    filtered = []
-    for x in objects:
-        if limit and len(filtered) > limit:
-            break
-        if q and not str(x).startswith(str(q)):
-            continue
-        filtered.append(x)
 
-    return filtered[:limit]
+def search_results(request, objects, key=None):
+    """
+    Lazily filters `objects` by the `q` query parameter. `key` returns the
+    searched value of an object, the object itself by default.
+    """
+    q = str(request.query_params.get('q', ''))
+    if not q:
+        return iter(objects)
+    return (x for x in objects if str(x if key is None else key(x)).startswith(q))
 
 
-class AvailableIPAddressesView(ObjectValidationMixin, APIView):
-    queryset = IPAddress.objects.all()
+def parse_host_cursor(value):
+    """
+    Returns the host address and the primary key of the last IP address of the
+    previous page.
+    """
+    host, _, pk = value.rpartition(',')
+    return netaddr.IPAddress(host), int(pk)
+
+
+def get_host_filter(q, version, after=None):
+    """
+    Returns an SQL condition on the host address of IP addresses that matches
+    the `q` search and the addresses following `after`, a (host, pk) tuple,
+    and a flag that tells whether the condition is exact. Otherwise the matched
+    addresses have to be checked against `q` one by one. The condition is None
+    if there is nothing to filter.
+    """
+    conditions, params = [], []
+    exact = True
+    if after is not None:
+        # The same host may appear many times, so the primary key breaks ties
+        conditions.append(f'({HOST_SQL}, "{IPAddress._meta.db_table}"."{IPAddress._meta.pk.column}") > (%s::inet, %s)')
+        params.extend([str(after[0]), after[1]])
+    if q:
+        ranges, exact = get_network_ranges(q, version)
+        if len(ranges) > MAX_SEARCH_RANGES:
+            exact = False
+        elif not ranges:
+            conditions.append('FALSE')
+        else:
+            conditions.append('(' + ' OR '.join([f'{HOST_SQL} BETWEEN %s::inet AND %s::inet'] * len(ranges)) + ')')
+            for first, last in ranges:
+                params.extend([str(netaddr.IPAddress(first, version)), str(netaddr.IPAddress(last, version))])
+    if not conditions:
+        return None, exact
+    return RawSQL(' AND '.join(conditions), params, output_field=BooleanField()), exact
+
+
+def get_int(params, name, default=None, minimum=0, maximum=None):
+    value = params.get(name, default)
+    if value is None:
+        return None
+    try:
+        value = int(value)
+    except (TypeError, ValueError, OverflowError):
+        raise ValidationError(f'{name} must be an integer.')
+    if value < minimum:
+        raise ValidationError(f'{name} must not be less than {minimum}.')
+    if maximum is not None and value > maximum:
+        raise ValidationError(f'{name} must not be greater than {maximum}.')
+    return value
+
+
+class ParentObjectView(ObjectValidationMixin, APIView):
+    """
+    Base view for listing objects related to a parent object.
+    Responses are kept in the cache if the `cache_timeout` setting is set.
+    """
+    parent_model = None
+    # Whether the view returns pages of objects
+    paginated = True
 
     def get_parent(self, request, pk):
+        return get_parent_or_404(request, self.parent_model, pk)
+
+    def get_children(self, parent):
+        """
+        Returns querysets of the objects the response depends on.
+        """
+        return []
+
+    def get_etag(self, request, parent):
+        """
+        Returns a version token of the response. It changes whenever the parent
+        or any of its children is changed, added or deleted.
+        """
+        versions = [parent.last_updated]
+        for queryset in self.get_children(parent):
+            versions.append(tuple(queryset.order_by().aggregate(
+                count=Count('pk'),
+                last_updated=Max('last_updated')
+            ).values()))
+        token = repr((type(self).__name__, parent.pk, versions, get_request_digest(request)))
+        return quote_etag(hashlib.md5(token.encode()).hexdigest())
+
+    def get_page(self, request, parent, *args):
+        """
+        Returns a serializer of the requested page of objects and a link to the next page.
+        """
         raise NotImplementedError
 
+    def serialize(self, request, serializer, next_link):
+        with get_timings(request).stage('serialize'):
+            results = list(serializer.data)
+        return {
+            'next': next_link,
+            'results': results
+        }
+
+    def get_data(self, request, parent, *args):
+        return self.serialize(request, *self.get_page(request, parent, *args))
+
+    def get_cached_data(self, request, parent):
+        timeout = get_setting('cache_timeout')
+        if not timeout:
+            return self.get_data(request, parent)
+        key = get_response_key(type(self).__name__, request, parent)
+        with get_timings(request).stage('cache'):
+            data = cache.get(key)
+        if data is None:
+            data = self.get_data(request, parent)
+            cache.set(key, data, timeout)
+        return data
+
+    def get_response(self, request, parent):
+        """
+        Returns the response with the requested page. Large pages are written
+        straight into a streaming response record by record.
+        """
+        if not self.paginated or get_setting('cache_timeout') or not can_stream(request):
+            return Response(self.get_cached_data(request, parent))
+        serializer, next_link = self.get_page(request, parent)
+        if len(serializer.instance) < STREAMING_THRESHOLD:
+            return Response(self.serialize(request, serializer, next_link))
+        records = serializer.child.iter_representation(serializer.instance)
+        renderer = request.accepted_renderer
+        return StreamingHttpResponse(iter_json_page(renderer, next_link, records), content_type=renderer.media_type)
+
     def get(self, request, pk):
-        parent = self.get_parent(request, pk)
+        timings = start_timings(request, type(self).__name__)
+        with timings.stage('parent'):
+            parent = self.get_parent(request, pk)
+
+        # Answer conditional requests without calculating the response
+        with timings.stage('etag'):
+            etag = self.get_etag(request, parent)
+        if_none_match = parse_etags(request.headers.get('If-None-Match', ''))
+        if '*' in if_none_match or etag in [tag.removeprefix('W/') for tag in if_none_match]:
+            response = Response(status=status.HTTP_304_NOT_MODIFIED)
+        else:
+            response = self.get_response(request, parent)
+        response['ETag'] = etag
+        patch_cache_control(response, private=True, no_cache=True)
+        timings.finish(response)
+        return response
 
-        # Calculate available IPs within the parent
-        ip_list = filter_results(request, parent.get_available_ips())
+
+class AvailableIPAddressesView(ParentObjectView):
+    queryset = IPAddress.objects.all()
+
+    def get_page(self, request, parent, available_ips=None):
+        timings = get_timings(request)
+        after = decode_cursor(request, netaddr.IPAddress)
+        if available_ips is None:
+            with timings.stage('freespace'):
+                available_ips = freespace.get_available_ips(parent)
+
+        # Walk available IPs within the parent until the limit is reached
+        q = request.query_params.get('q', '')
+        with timings.stage('search'):
+            ip_list, next_link = paginate_results(request, iter_available_ips(available_ips, q, after))
         serializer = AvailableIPSerializer(ip_list, many=True, context={
             'request': request,
             'parent': parent,
             'vrf': parent.vrf,
         })
-        return Response(
-            {
-                'results': serializer.data
-            }
-        )
+        return serializer, next_link
 
 
 class PrefixAvailableIPAddressesView(AvailableIPAddressesView):
+    parent_model = Prefix
 
-    def get_parent(self, request, pk):
-        return get_object_or_404(Prefix.objects.restrict(request.user), pk=pk)
+    def get_children(self, parent):
+        return [parent.get_child_ips(), parent.get_child_ranges()]
 
 
 class IPRangeAvailableIPAddressesView(AvailableIPAddressesView):
+    parent_model = IPRange
 
-    def get_parent(self, request, pk):
-        return get_object_or_404(IPRange.objects.restrict(request.user), pk=pk)
+    def get_children(self, parent):
+        return [parent.get_child_ips()]
 
 
-class AvailableVLANsView(ObjectValidationMixin, APIView):
+class AvailableVLANsView(ParentObjectView):
     queryset = VLAN.objects.all()
+    parent_model = VLANGroup
 
-    def get(self, request, pk):
-        vlangroup = get_object_or_404(VLANGroup.objects.restrict(request.user), pk=pk)
+    def get_children(self, vlangroup):
+        return [vlangroup.get_child_vlans()]
+
+    modes = {
+        'vids': AvailableVLANSerializer,
+        'ranges': AvailableVLANRangeSerializer,
+    }
+
+    def get_params(self, request):
+        mode = request.query_params.get('mode', 'vids')
+        if mode not in self.modes:
+            raise ValidationError(f'Invalid mode: {mode}. Mode must be one of: {", ".join(self.modes)}.')
+        return mode, get_int(request.query_params, 'count', None, 1, VLAN_VID_MAX)
+
+    def search(self, request, available_vids, count):
+        """
+        Returns free VIDs matching the query parameters as an IntervalSet.
+        """
+        # Cursors of both modes end with the last returned VID
+        after = decode_cursor(request, lambda value: int(value.rpartition('-')[2]))
+        if after is not None:
+            available_vids = available_vids.after(after)
+        q = str(request.query_params.get('q', ''))
+        if q:
+            # Jump right to the VIDs that start with q
+            available_vids = available_vids.intersection(IntervalSet.from_ranges(get_number_ranges(q, VLAN_VID_MAX)))
+        if count is not None:
+            # The first block of `count` consecutive VIDs
+            first = available_vids.find_run(count)
+            available_vids = IntervalSet([first], [first + count - 1]) if first is not None else IntervalSet()
+        return available_vids
 
-        available_vlans = filter_results(request, vlangroup.get_available_vids())
-        serializer = AvailableVLANSerializer(available_vlans, many=True, context={
+    def get_page(self, request, vlangroup, available_vids=None):
+        timings = get_timings(request)
+        mode, count = self.get_params(request)
+        if available_vids is None:
+            with timings.stage('freespace'):
+                available_vids = freespace.get_vlangroups_available_vids([vlangroup])[vlangroup.pk]
+
+        with timings.stage('search'):
+            available_vids = self.search(request, available_vids, count)
+            if mode == 'ranges':
+                objects = (Interval(first, last) for first, last in available_vids)
+            else:
+                objects = available_vids.iter_values()
+            available_vlans, next_link = paginate_results(request, objects)
+        serializer = self.modes[mode](available_vlans, many=True, context={
             'request': request,
             'group': vlangroup,
         })
-        return Response(
-            {
-                'results': serializer.data
-            }
-        )
+        return serializer, next_link
 
 
-class AvailablePrefixesView(ObjectValidationMixin, APIView):
+class AvailablePrefixesView(ParentObjectView):
     queryset = Prefix.objects.all()
+    parent_model = Prefix
+
+    def get_children(self, prefix):
+        return [prefix.get_child_prefixes(), prefix.get_child_ranges()]
+
+    def get_page(self, request, prefix, available_prefixes=None):
+        timings = get_timings(request)
+        after = decode_cursor(request, netaddr.IPNetwork)
+        if available_prefixes is None:
+            with timings.stage('freespace'):
+                splitter = freespace.get_prefix_splitter(prefix)
+        else:
+            splitter = IPSplitter(available_prefixes)
 
-    def get(self, request, pk):
-        prefix = get_object_or_404(Prefix.objects.restrict(request.user), pk=pk)
-        available_prefixes = prefix.get_available_prefixes()
         prefix_len = int(request.query_params.get('prefixlen', 0))
-        subnets = IPSplitter(available_prefixes).split(prefix_len)
-        subnets = filter_results(request, subnets)
+        # Subnets are built lazily, so only the requested page is calculated
+        q = request.query_params.get('q', '')
+        with timings.stage('split'):
+            subnets = splitter.iter_subnets(prefix_len, after=after, q=q)
+            subnets, next_link = paginate_results(request, subnets)
 
         serializer = AvailablePrefixSerializer(subnets, many=True, context={
             'request': request,
             'vrf': prefix.vrf,
         })
-        return Response(
-            {
-                'results': serializer.data
-            }
-        )
+        return serializer, next_link
 
 
-class PrefixChildIPAddressesView(ObjectValidationMixin, APIView):
+class PrefixChildIPAddressesView(ParentObjectView):
     queryset = IPAddress.objects.all()
+    parent_model = Prefix
 
-    def get_parent(self, request, pk):
-        return get_object_or_404(Prefix.objects.restrict(request.user), pk=pk)
+    def get_children(self, parent):
+        return [parent.get_child_ips()]
 
-    def get(self, request, pk):
-        parent = self.get_parent(request, pk)
+    def get_page(self, request, parent):
+        timings = get_timings(request)
+        after = decode_cursor(request, parse_host_cursor)
 
-        ip_list = filter_results(request, parent.get_child_ips())
+        # Filter, order and limit addresses in the database and fetch only their values
+        child_ips = parent.get_child_ips().alias(host=RawSQL(HOST_SQL, [])).order_by('host', 'pk')
+        host_filter, exact = get_host_filter(str(request.query_params.get('q', '')), parent.family, after)
+        if host_filter is not None:
+            child_ips = child_ips.filter(host_filter)
+        limit = get_results_limit(request)
+        if exact and limit is not None:
+            # An extra address tells whether the next page exists
+            child_ips = child_ips[:max(limit, 0) + 1]
+        rows = child_ips.values_list('address', 'pk').iterator()
+        if not exact:
+            rows = search_results(request, rows, key=itemgetter(0))
+        with timings.stage('search'):
+            rows, next_link = paginate_results(request, rows, cursor=lambda row: f'{row[0].ip},{row[1]}')
+        ip_list = [address for address, _ in rows]
         serializer = ChildIPSerializer(ip_list, many=True, context={
             'request': request,
             'parent': parent,
             'vrf': parent.vrf,
         })
-        return Response(
-            {
-                'results': serializer.data
-            }
-        )
+        return serializer, next_link
+
+
+class AvailableSummaryView(ParentObjectView):
+    """
+    Base view for counting the free space of a parent object. Everything is
+    calculated from the free ranges, so available objects are never listed.
+    """
+    paginated = False
+
+    def get_data(self, request, parent):
+        raise NotImplementedError
+
+
+class PrefixAvailableSummaryView(AvailableSummaryView):
+    queryset = Prefix.objects.all()
+    parent_model = Prefix
+
+    def get_children(self, prefix):
+        return [prefix.get_child_ips(), prefix.get_child_ranges(), prefix.get_child_prefixes()]
+
+    def get_prefix_len(self, request):
+        prefix_len = request.query_params.get('prefixlen')
+        if prefix_len is None:
+            return None
+        try:
+            prefix_len = int(prefix_len)
+        except ValueError:
+            prefix_len = -1
+        if prefix_len < 0:
+            raise ValidationError('prefixlen must be a non-negative integer.')
+        return prefix_len
+
+    def get_data(self, request, prefix):
+        timings = get_timings(request)
+        prefix_len = self.get_prefix_len(request)
+        with timings.stage('freespace'):
+            available_ips = freespace.get_available_ips(prefix)
+            splitter = freespace.get_prefix_splitter(prefix)
+        largest = splitter.largest()
+        data = {
+            'size': prefix.prefix.size,
+            'available_ips': available_ips.size,
+            'largest_available_prefix': str(largest) if largest else None,
+        }
+        if prefix_len is not None:
+            data['prefixlen'] = prefix_len
+            data['available_prefixes'] = splitter.count(prefix_len)
+        return data
+
+
+class IPRangeAvailableSummaryView(AvailableSummaryView):
+    queryset = IPAddress.objects.all()
+    parent_model = IPRange
+
+    def get_children(self, iprange):
+        return [iprange.get_child_ips()]
+
+    def get_data(self, request, iprange):
+        first, last = iprange.start_address.ip, iprange.end_address.ip
+        with get_timings(request).stage('freespace'):
+            available_ips = freespace.get_available_ips(iprange)
+        largest = IntervalSet.from_ipset(available_ips, first.version).largest()
+        if largest is not None:
+            largest = str(netaddr.IPRange(
+                netaddr.IPAddress(largest.first, first.version), netaddr.IPAddress(largest.last, first.version)
+            ))
+        return {
+            'size': last.value - first.value + 1,
+            'available_ips': available_ips.size,
+            'largest_available_range': largest,
+        }
+
+
+class VLANGroupAvailableSummaryView(AvailableSummaryView):
+    queryset = VLAN.objects.all()
+    parent_model = VLANGroup
+
+    def get_children(self, vlangroup):
+        return [vlangroup.get_child_vlans()]
+
+    def get_data(self, request, vlangroup):
+        with get_timings(request).stage('freespace'):
+            available_vids = freespace.get_vlangroups_available_vids([vlangroup])[vlangroup.pk]
+        largest = available_vids.largest()
+        return {
+            'size': freespace.get_vid_ranges(vlangroup).size,
+            'available_vids': available_vids.size,
+            'largest_available_range': str(largest) if largest else None,
+        }
+
+
+def make_subrequest(request, kind, pk, params):
+    """
+    Returns a GET request to the single-parent location `kind` made on behalf
+    of the user of the HTTP `request`.
+    """
+    subrequest = copy.copy(request)
+    subrequest.method = 'GET'
+    subrequest.path = subrequest.path_info = reverse(f'plugins-api:netbox_scripthelper-api:{kind}', kwargs={'pk': pk})
+    subrequest.GET = QueryDict(mutable=True)
+    for name, value in params.items():
+        subrequest.GET.setlist(name, [str(v) for v in value] if isinstance(value, list) else [str(value)])
+    subrequest.META = {**subrequest.META, 'QUERY_STRING': subrequest.GET.urlencode()}
+    return Request(subrequest)
+
+
+class BulkAvailableObjectsView(APIView):
+    """
+    Returns available objects of many parents at once. The request body is a list of
+    {"kind": ..., "pk": ..., "params": {...}} queries, where the kind is the name
+    of a single-parent location and params are its query parameters.
+    """
+    permission_classes = [IsAuthenticatedOrLoginNotRequired]
+
+    # kind => (view, function calculating the free space of many parents)
+    kinds = {
+        'prefix-available-ips': (PrefixAvailableIPAddressesView, freespace.get_prefixes_available_ips),
+        'prefix-available-prefixes': (AvailablePrefixesView, freespace.get_prefixes_available_prefixes),
+        'iprange-available-ips': (IPRangeAvailableIPAddressesView, freespace.get_ipranges_available_ips),
+        'vlangroup-available-vlans': (AvailableVLANsView, freespace.get_vlangroups_available_vids),
+    }
+
+    def get_queries(self, request):
+        if not isinstance(request.data, list):
+            raise ValidationError('Expected a list of queries.')
+        queries = []
+        for query in request.data:
+            if not isinstance(query, dict) or query.get('kind') not in self.kinds:
+                raise ValidationError(f'Invalid query: {query}. Kind must be one of: {", ".join(self.kinds)}.')
+            try:
+                pk = int(query.get('pk'))
+            except (TypeError, ValueError):
+                raise ValidationError(f'Invalid query: {query}. Invalid pk.')
+            params = query.get('params') or {}
+            if not isinstance(params, dict):
+                raise ValidationError(f'Invalid query: {query}. Params must be an object.')
+            queries.append((query['kind'], pk, params))
+        return queries
+
+    def get_subrequest(self, request, kind, pk, params):
+        return make_subrequest(request._request, kind, pk, params)
+
+    def post(self, request):
+        timings = start_timings(request, type(self).__name__)
+        queries = self.get_queries(request)
+
+        # Fetch parents with a single query per model
+        parents = defaultdict(dict)
+        pks = defaultdict(set)
+        for kind, pk, _ in queries:
+            pks[self.kinds[kind][0].parent_model].add(pk)
+        with timings.stage('parent'):
+            for model, model_pks in pks.items():
+                parents[model] = resolve_parents(request, model, model_pks)
+
+        # Calculate the free space of all parents of the same kind together
+        available = {}
+        with timings.stage('freespace'):
+            for kind, (view, get_available) in self.kinds.items():
+                kind_parents = {parents[view.parent_model].get(pk) for k, pk, _ in queries if k == kind} - {None}
+                if kind_parents:
+                    available[kind] = get_available(kind_parents)
+
+        results = []
+        for kind, pk, params in queries:
+            view, _ = self.kinds[kind]
+            parent = parents[view.parent_model].get(pk)
+            if parent is None:
+                results.append({'kind': kind, 'pk': pk, 'error': 'Not found.'})
+                continue
+            subrequest = self.get_subrequest(request, kind, pk, params)
+            # Stages of the queries are added up to the timings of the bulk request
+            subrequest._scripthelper_timings = timings
+            data = view().get_data(subrequest, parent, available[kind][pk])
+            results.append({'kind': kind, 'pk': pk, **data})
+        response = Response({'results': results})
+        timings.finish(response)
+        return response
+
+
+class AllocateView(APIView):
+    """
+    Returns the first block of free addresses or prefixes of a parent that fits
+    the request and optionally reserves it for a short time, so concurrent
+    callers get different blocks. The parameters are passed in the request body:
+    count, base, prefixlen, alignment, contiguous and reserve.
+    """
+    permission_classes = [IsAuthenticatedOrLoginNotRequired]
+    parent_model = None
+
+    def get_int(self, request, name, default=None, minimum=0, maximum=None):
+        return get_int(request.data, name, default, minimum, maximum)
+
+    def get_bool(self, request, name):
+        value = request.data.get(name, False)
+        if isinstance(value, str):
+            return value.lower() in ('true', '1')
+        return bool(value)
+
+    def get_params(self, request):
+        if not isinstance(request.data, dict):
+            raise ValidationError('Expected an object.')
+        base = request.data.get('base')
+        params = {
+            'count': self.get_int(request, 'count', 1, 1, MAX_ALLOCATE_COUNT),
+            'base': str(base) if base else None,
+            'prefix_len': self.get_int(request, 'prefixlen', None, 1),
+            'alignment': self.get_int(request, 'alignment', 1, 1),
+            'contiguous': self.get_bool(request, 'contiguous'),
+        }
+        if params['alignment'] & (params['alignment'] - 1):
+            raise ValidationError('alignment must be a power of two.')
+        return params
+
+    def get_free_space(self, parent, prefix_len):
+        return freespace.get_available_ips(parent)
+
+    def get_add_permission(self, params):
+        # Reserved objects are held from other users as if they were created
+        return 'ipam.add_ipaddress' if params['prefix_len'] is None else 'ipam.add_prefix'
+
+    def get_serializer(self, request, parent, objects, prefix_len):
+        return AvailableIPSerializer(objects, many=True, context={
+            'request': request,
+            'parent': parent,
+            'vrf': parent.vrf,
+        })
+
+    def allocate(self, parent, free_space, exclude, params):
+        return allocate(free_space, exclude=exclude, **params)
+
+    def post(self, request, pk):
+        parent = get_parent_or_404(request, self.parent_model, pk)
+        params = self.get_params(request)
+        reserve = self.get_bool(request, 'reserve')
+        if reserve and not request.user.has_perm(self.get_add_permission(params)):
+            raise PermissionDenied('Reserving requires the permission to add the allocated objects.')
+        expires = None
+        try:
+            with reservations.lock(parent) if reserve else nullcontext():
+                objects = self.allocate(
+                    parent,
+                    self.get_free_space(parent, params['prefix_len']),
+                    reservations.get_reserved(parent),
+                    params
+                )
+                if reserve:
+                    expires = reservations.reserve(parent, objects, get_setting('reservation_timeout'))
+        except reservations.ReservationLockError as e:
+            return Response({'detail': str(e)}, status=status.HTTP_503_SERVICE_UNAVAILABLE)
+        except (ValueError, OverflowError, netaddr.AddrFormatError) as e:
+            raise ValidationError(str(e))
+        except IndexError:
+            return Response({'detail': 'Not enough free space.'}, status=status.HTTP_409_CONFLICT)
+
+        serializer = self.get_serializer(request, parent, objects, params['prefix_len'])
+        return Response({
+            'results': list(serializer.data),
+            'reserved_until': datetime.fromtimestamp(expires, timezone.utc).isoformat() if expires else None,
+        })
+
+
+class PrefixAllocateView(AllocateView):
+    parent_model = Prefix
+
+    def get_free_space(self, parent, prefix_len):
+        if prefix_len is None:
+            return freespace.get_available_ips(parent)
+        return freespace.get_available_prefixes(parent)
+
+    def get_serializer(self, request, parent, objects, prefix_len):
+        if prefix_len is None:
+            return super().get_serializer(request, parent, objects, prefix_len)
+        return AvailablePrefixSerializer(objects, many=True, context={
+            'request': request,
+            'vrf': parent.vrf,
+        })
+
+
+class PrefixPlanView(PrefixAllocateView):
+    """
+    Carves many prefixes of mixed lengths out of the free space of a prefix in one
+    pass, see `SubnetPlanner`. The body contains `prefixes`, either {prefixlen: count}
+    or a list of prefix lengths, and optionally `reserve`. Either all the prefixes
+    are returned, ordered by length and address, or the status is 409.
+    """
+
+    def get_params(self, request):
+        if not isinstance(request.data, dict):
+            raise ValidationError('Expected an object.')
+        prefixes = request.data.get('prefixes')
+        if isinstance(prefixes, dict):
+            items = prefixes.items()
+        elif isinstance(prefixes, list):
+            items = [(prefix_len, 1) for prefix_len in prefixes]
+        else:
+            raise ValidationError('prefixes must be an object or a list.')
+        requests = defaultdict(int)
+        try:
+            for prefix_len, count in items:
+                prefix_len, count = int(prefix_len), int(count)
+                if count < 0:
+                    raise ValueError
+                requests[prefix_len] += count
+        except (TypeError, ValueError):
+            raise ValidationError('prefixes must map prefix lengths to numbers of prefixes.')
+        if sum(requests.values()) > MAX_PLAN_SIZE:
+            raise ValidationError(f'A plan may contain at most {MAX_PLAN_SIZE} prefixes.')
+        # prefix_len is only used to pick the free space and the serializer
+        return {'requests': dict(requests), 'prefix_len': min(requests, default=0)}
+
+    def allocate(self, parent, free_space, exclude, params):
+        plan = plan_subnets(free_space, params['requests'], parent.family, exclude)
+        return [prefix for prefix_len in sorted(plan) for prefix in plan[prefix_len]]
+
+
+class IPRangeAllocateView(AllocateView):
+    parent_model = IPRange
+
+    def get_params(self, request):
+        params = super().get_params(request)
+        if params['prefix_len'] is not None:
+            raise ValidationError('prefixlen is not supported for IP ranges.')
+        return params
+
+
+def get_choices(request, api_url, params):
+    """
+    Returns the first page of choices of a location as [(id, display)] computed
+    in-process for the HTTP `request`, or None if `api_url` is not a fixed
+    location of the plugin. The free space of a parent is calculated once per
+    request, so fields sharing a parent are evaluated together.
+    """
+    url = urlsplit(api_url)
+    try:
+        match = resolve(url.path)
+    except Resolver404:
+        return None
+    view = getattr(match.func, 'view_class', None)
+    if view is None or not issubclass(view, ParentObjectView) or not view.paginated or 'pk' not in match.kwargs:
+        return None
+    params = {**QueryDict(url.query).dict(), **params}
+    params.setdefault('limit', CHOICES_LIMIT)
+
+    memo = request.__dict__.setdefault('_scripthelper_choices', {})
+    parent_key = (match.url_name, match.kwargs['pk'])
+    if parent_key not in memo:
+        parent = resolve_parent(request, view.parent_model, match.kwargs['pk'])
+        available = None
+        if parent is not None and match.url_name in BulkAvailableObjectsView.kinds:
+            available = BulkAvailableObjectsView.kinds[match.url_name][1]([parent])[parent.pk]
+        memo[parent_key] = (parent, available)
+    parent, available = memo[parent_key]
+    if parent is None:
+        return []
+
+    subrequest = make_subrequest(request, match.url_name, parent.pk, params)
+    if available is None:
+        data = view().get_data(subrequest, parent)
+    else:
+        data = view().get_data(subrequest, parent, available)
+    return [(result['id'], result['display']) for result in data['results']]
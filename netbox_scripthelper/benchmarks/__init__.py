@@ -0,0 +1,16 @@
+"""
+Benchmarks of the scripthelper hot paths.
+
+The benchmarks that do not need a database run standalone:
+
+    python -m netbox_scripthelper.benchmarks --output results.json
+
+The views and the event pipeline are measured on generated data under the
+NetBox test runner:
+
+    SCRIPTHELPER_BENCHMARK_OUTPUT=results-db.json python manage.py test netbox_scripthelper.benchmarks.db
+
+Reports of different releases are compared with `--compare`:
+
+    python -m netbox_scripthelper.benchmarks --compare old.json new.json
+"""
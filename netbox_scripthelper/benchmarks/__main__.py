@@ -0,0 +1,36 @@
+import argparse
+import sys
+
+from . import core  # noqa: F401
+from .runner import (compare_reports,
+                     format_comparison,
+                     format_results,
+                     load_report,
+                     make_report,
+                     run,
+                     save_report)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m netbox_scripthelper.benchmarks')
+    parser.add_argument('-k', dest='pattern', default='', help='run benchmarks whose name contains the pattern')
+    parser.add_argument('--repeat', type=int, default=5, help='number of repetitions (default: 5)')
+    parser.add_argument('--output', help='write the JSON report to the file')
+    parser.add_argument('--compare', nargs=2, metavar=('BASELINE', 'CURRENT'),
+                        help='compare two JSON reports instead of running benchmarks')
+    args = parser.parse_args(argv)
+
+    if args.compare:
+        baseline, current = (load_report(path) for path in args.compare)
+        print(format_comparison(compare_reports(baseline, current)))
+        return 0
+
+    report = make_report(run(args.pattern, args.repeat))
+    print(format_results(report['results']))
+    if args.output:
+        save_report(report, args.output)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,100 @@
+"""
+Benchmarks that do not need a database.
+"""
+from itertools import islice
+
+from netaddr import IPAddress, IPNetwork, IPSet
+
+from netbox_scripthelper.snapshots import decode_snapshots, encode_snapshots
+from netbox_scripthelper.utils import (IPSplitter,
+                                       get_available_ips_list,
+                                       iter_available_ips)
+from .runner import benchmark
+
+
+def get_ipv4_free_space():
+    """
+    Free space of a /8 with every 7th /24 and scattered addresses in use.
+    """
+    prefix = IPNetwork('10.0.0.0/8')
+    used = IPSet([IPNetwork((prefix.first + i * 256, 24), 4) for i in range(0, 65536, 7)])
+    used.update(IPAddress(value, 4) for value in range(prefix.first, prefix.last, 3001))
+    return IPSet([prefix]) - used
+
+
+def get_ipv6_free_space():
+    prefix = IPNetwork('2001:db8::/48')
+    return IPSet([prefix]) - IPSet([IPNetwork(f'2001:db8:0:{i:x}::/64') for i in range(0, 65536, 5)])
+
+
+@benchmark('ipsplitter.split.ipv4_8_to_24')
+def ipsplitter_split_ipv4():
+    splitter = IPSplitter(IPSet([IPNetwork('10.0.0.0/8')]))
+    return lambda: splitter.split(24)
+
+
+@benchmark('ipsplitter.split.ipv4_8_to_30_limit_100_offset_1m')
+def ipsplitter_split_offset():
+    splitter = IPSplitter(IPSet([IPNetwork('10.0.0.0/8')]))
+    return lambda: splitter.split(30, 100, 10 ** 6)
+
+
+@benchmark('ipsplitter.split.ipv6_48_to_64_limit_1000')
+def ipsplitter_split_ipv6():
+    splitter = IPSplitter(get_ipv6_free_space())
+    return lambda: splitter.split(64, 1000)
+
+
+@benchmark('ipsplitter.count.ipv6_48_to_64')
+def ipsplitter_count_ipv6():
+    splitter = IPSplitter(get_ipv6_free_space())
+    return lambda: splitter.count(64)
+
+
+@benchmark('ipsplitter.iter_subnets.ipv4_8_search')
+def ipsplitter_search():
+    splitter = IPSplitter(IPSet([IPNetwork('10.0.0.0/8')]))
+    return lambda: list(splitter.iter_subnets(30, q='10.20.30.'))
+
+
+@benchmark('ipsplitter.init.ipv4_8_fragmented')
+def ipsplitter_init():
+    ipset = get_ipv4_free_space()
+    return lambda: IPSplitter(ipset)
+
+
+@benchmark('available_ips.list.ipv4_8_10k')
+def available_ips_list_ipv4():
+    ipset = get_ipv4_free_space()
+    return lambda: get_available_ips_list(ipset, '10.128.0.0', 10000)
+
+
+@benchmark('available_ips.list.ipv6_48_10k')
+def available_ips_list_ipv6():
+    ipset = get_ipv6_free_space()
+    return lambda: get_available_ips_list(ipset, '2001:db8:0:1::', 10000)
+
+
+@benchmark('available_ips.iter.ipv4_8_search_limit_1000')
+def available_ips_search():
+    ipset = get_ipv4_free_space()
+    return lambda: list(islice(iter_available_ips(ipset, '10.20.3'), 1000))
+
+
+@benchmark('available_ips.iter.ipv6_48_after_limit_1000')
+def available_ips_after():
+    ipset = get_ipv6_free_space()
+    after = IPAddress('2001:db8:0:ff00::')
+    return lambda: list(islice(iter_available_ips(ipset, '', after), 1000))
+
+
+@benchmark('snapshots.encode_decode.10k', number=1)
+def snapshots_roundtrip():
+    snapshots = [
+        {
+            'prechange': {'id': i, 'vid': i % 4094 + 1, 'name': f'vlan{i}', 'custom_fields': {f'cf{n}': n for n in range(50)}},
+            'postchange': {'id': i, 'vid': i % 4094 + 1, 'name': f'vlan{i}-new', 'custom_fields': {f'cf{n}': n for n in range(50)}},
+        }
+        for i in range(10000)
+    ]
+    return lambda: [decode_snapshots(encode_snapshots(s)) for s in snapshots]
@@ -0,0 +1,152 @@
+"""
+Benchmarks of the views and the event pipeline on generated data. They are not
+collected by `manage.py test netbox_scripthelper` and must be run explicitly:
+
+    SCRIPTHELPER_BENCHMARK_OUTPUT=results-db.json python manage.py test netbox_scripthelper.benchmarks.db
+"""
+import os
+import unittest.mock as mock
+
+from django.contrib.contenttypes.models import ContentType
+from django.db.backends.postgresql.psycopg_any import NumericRange
+from django.test import override_settings
+from django.urls import reverse
+from netaddr import IPNetwork
+from rest_framework import status
+from rest_framework.renderers import JSONRenderer
+from rest_framework.test import APIRequestFactory
+
+from core.events import OBJECT_UPDATED
+from extras.choices import EventRuleActionChoices
+from extras.models import EventRule, Webhook
+from ipam.models import IPAddress, Prefix, VLAN, VLANGroup
+from utilities.testing.base import TestCase
+
+from netbox_scripthelper.api.renderers import iter_json_page
+from netbox_scripthelper.api.serializers import AvailableIPSerializer
+from netbox_scripthelper.events import process_event_queue
+from .runner import format_results, make_report, measure, save_report
+
+OUTPUT_ENV = 'SCRIPTHELPER_BENCHMARK_OUTPUT'
+REPEAT = 5
+
+# Results of all benchmark classes, the report is rewritten after each class
+RESULTS = {}
+
+
+class BenchmarkMixin:
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        report = make_report(RESULTS)
+        print()
+        print(format_results(report['results']))
+        if os.environ.get(OUTPUT_ENV):
+            save_report(report, os.environ[OUTPUT_ENV])
+
+    def measure(self, name, func):
+        RESULTS[name] = measure(func, REPEAT)
+
+
+@override_settings(EXEMPT_VIEW_PERMISSIONS=['*'], LOGIN_REQUIRED=False)
+class BenchmarkViews(BenchmarkMixin, TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        # IPv4 /8 with 256 child /24 prefixes and 20k addresses
+        cls.ipv4 = Prefix.objects.create(prefix=IPNetwork('10.0.0.0/8'))
+        Prefix.objects.bulk_create([Prefix(prefix=IPNetwork(f'10.{i}.{i}.0/24')) for i in range(256)])
+        IPAddress.objects.bulk_create([
+            IPAddress(address=IPNetwork(f'10.{i // 256 % 256}.{i % 256}.{i % 200 + 1}/8')) for i in range(20000)
+        ])
+        # IPv6 /48 with 5k addresses
+        cls.ipv6 = Prefix.objects.create(prefix=IPNetwork('2001:db8::/48'))
+        IPAddress.objects.bulk_create([
+            IPAddress(address=IPNetwork(f'2001:db8:0:{i:x}::1/48')) for i in range(5000)
+        ])
+        # VLAN group with 4094 VIDs, every third one is in use
+        cls.vlangroup = VLANGroup.objects.create(
+            name='benchmark', slug='benchmark', vid_ranges=[NumericRange(1, 4094, bounds='[]')]
+        )
+        VLAN.objects.bulk_create([
+            VLAN(name=f'vlan{vid}', vid=vid, group=cls.vlangroup) for vid in range(1, 4095, 3)
+        ])
+
+    def measure_get(self, name, url):
+        def get():
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            if response.streaming:
+                b''.join(response.streaming_content)
+        self.measure(name, get)
+
+    def test_prefix_available_ips(self):
+        url = reverse('plugins-api:netbox_scripthelper-api:prefix-available-ips', kwargs={'pk': self.ipv4.pk})
+        self.measure_get('views.prefix_available_ips.ipv4_8_limit_1000', f'{url}?limit=1000')
+        self.measure_get('views.prefix_available_ips.ipv4_8_search', f'{url}?limit=100&q=10.20.30.')
+        url = reverse('plugins-api:netbox_scripthelper-api:prefix-available-ips', kwargs={'pk': self.ipv6.pk})
+        self.measure_get('views.prefix_available_ips.ipv6_48_limit_1000', f'{url}?limit=1000')
+
+    def test_prefix_available_prefixes(self):
+        url = reverse('plugins-api:netbox_scripthelper-api:prefix-available-prefixes', kwargs={'pk': self.ipv4.pk})
+        self.measure_get('views.prefix_available_prefixes.ipv4_8_to_24', f'{url}?prefixlen=24')
+        url = reverse('plugins-api:netbox_scripthelper-api:prefix-available-prefixes', kwargs={'pk': self.ipv6.pk})
+        self.measure_get('views.prefix_available_prefixes.ipv6_48_to_64_limit_1000', f'{url}?prefixlen=64&limit=1000')
+
+    def test_prefix_child_ips(self):
+        url = reverse('plugins-api:netbox_scripthelper-api:prefix-child-ips', kwargs={'pk': self.ipv4.pk})
+        self.measure_get('views.prefix_child_ips.ipv4_8_limit_1000', f'{url}?limit=1000')
+        self.measure_get('views.prefix_child_ips.ipv4_8_search', f'{url}?q=10.20.')
+
+    def test_vlangroup_available_vlans(self):
+        url = reverse('plugins-api:netbox_scripthelper-api:vlangroup-available-vlans', kwargs={'pk': self.vlangroup.pk})
+        self.measure_get('views.vlangroup_available_vlans.4094', url)
+        self.measure_get('views.vlangroup_available_vlans.search', f'{url}?q=40')
+
+    def test_serializers(self):
+        request = APIRequestFactory().get('/')
+        request.query_params = request.GET
+        ips = list(self.ipv4.prefix[:10000])
+        context = {'request': request, 'parent': self.ipv4, 'vrf': None}
+        self.measure('serializers.available_ip.10k', lambda: AvailableIPSerializer(ips, many=True, context=context).data)
+        serializer = AvailableIPSerializer(ips, many=True, context=context)
+        self.measure('serializers.available_ip.10k_stream', lambda: b''.join(
+            iter_json_page(JSONRenderer(), None, serializer.child.iter_representation(ips))
+        ))
+
+
+@override_settings(EXEMPT_VIEW_PERMISSIONS=['*'], LOGIN_REQUIRED=False)
+class BenchmarkEvents(BenchmarkMixin, TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.object_type = ContentType.objects.get_for_model(VLAN)
+        webhook = Webhook.objects.create(name='benchmark', payload_url='http://localhost/')
+        event_rule = EventRule.objects.create(
+            name='benchmark',
+            event_types=[OBJECT_UPDATED],
+            action_type=EventRuleActionChoices.WEBHOOK,
+            action_object_type=ContentType.objects.get_for_model(Webhook),
+            action_object_id=webhook.pk,
+            conditions={'attr': 'vid', 'value': 100, 'op': 'gt'},
+        )
+        event_rule.object_types.set([cls.object_type])
+
+    @mock.patch('netbox_scripthelper.events.get_queue')
+    def test_process_event_queue(self, get_queue):
+        events = [
+            {
+                'object_type': self.object_type,
+                'event_type': OBJECT_UPDATED,
+                'data': {'id': i, 'vid': i % 4094 + 1, 'name': f'vlan{i}'},
+                'snapshots': {
+                    'prechange': {'vid': i % 4094 + 1, 'name': f'vlan{i}'},
+                    'postchange': {'vid': i % 4094 + 1, 'name': f'vlan{i}-new'},
+                },
+                'username': None,
+                'request_id': None,
+            }
+            for i in range(10000)
+        ]
+        self.measure('events.process_event_queue.10k', lambda: process_event_queue(events))
@@ -0,0 +1,107 @@
+import json
+import platform
+import statistics
+import timeit
+from datetime import datetime, timezone
+from typing import Callable, Dict, List, Tuple
+
+# The version of the results format
+REPORT_FORMAT = 1
+
+# name => (setup, number). `setup` prepares data and returns the measured callable,
+# which is called `number` times per repetition.
+BENCHMARKS: Dict[str, Tuple[Callable[[], Callable[[], object]], int]] = {}
+
+
+def benchmark(name: str = None, number: int = 1):
+    """
+    Registers a benchmark. The decorated function prepares data and returns
+    the callable to measure, so the preparation is not included in the timings.
+    """
+
+    def decorator(setup):
+        BENCHMARKS[name or setup.__name__] = (setup, number)
+        return setup
+    return decorator
+
+
+def measure(func: Callable[[], object], repeat: int = 5, number: int = 1) -> dict:
+    """
+    Returns timings of a single call of `func` in seconds.
+    """
+
+    timings = [t / number for t in timeit.repeat(func, repeat=repeat, number=number)]
+    return {
+        'repeat': repeat,
+        'number': number,
+        'min': min(timings),
+        'median': statistics.median(timings),
+        'mean': statistics.mean(timings),
+    }
+
+
+def run(pattern: str = '', repeat: int = 5) -> Dict[str, dict]:
+    """
+    Runs the registered benchmarks whose name contains `pattern`.
+    """
+
+    results = {}
+    for name in sorted(BENCHMARKS):
+        if pattern not in name:
+            continue
+        setup, number = BENCHMARKS[name]
+        results[name] = measure(setup(), repeat, number)
+    return results
+
+
+def make_report(results: Dict[str, dict]) -> dict:
+    from netbox_scripthelper import ScriptHelperConfig
+    return {
+        'format': REPORT_FORMAT,
+        'version': ScriptHelperConfig.version,
+        'python': platform.python_version(),
+        'machine': platform.machine(),
+        'timestamp': datetime.now(timezone.utc).isoformat(),
+        'results': results,
+    }
+
+
+def save_report(report: dict, path: str):
+    with open(path, 'w') as f:
+        json.dump(report, f, indent=2, sort_keys=True)
+
+
+def load_report(path: str) -> dict:
+    with open(path) as f:
+        report = json.load(f)
+    if report.get('format') != REPORT_FORMAT:
+        raise ValueError(f'{path}: unsupported report format {report.get("format")}')
+    return report
+
+
+def compare_reports(baseline: dict, current: dict) -> List[Tuple[str, float, float, float]]:
+    """
+    Returns (name, baseline median, current median, ratio) of the benchmarks
+    present in both reports. A ratio above 1 means the current report is slower.
+    """
+
+    rows = []
+    for name in sorted(baseline['results'].keys() & current['results'].keys()):
+        old = baseline['results'][name]['median']
+        new = current['results'][name]['median']
+        rows.append((name, old, new, new / old if old else float('inf')))
+    return rows
+
+
+def format_results(results: Dict[str, dict]) -> str:
+    lines = [f'{"benchmark":<52} {"min, ms":>12} {"median, ms":>12}']
+    for name, timings in results.items():
+        lines.append(f'{name:<52} {timings["min"] * 1000:>12.3f} {timings["median"] * 1000:>12.3f}')
+    return '\n'.join(lines)
+
+
+def format_comparison(rows: List[Tuple[str, float, float, float]]) -> str:
+    lines = [f'{"benchmark":<52} {"old, ms":>12} {"new, ms":>12} {"ratio":>8}']
+    for name, old, new, ratio in rows:
+        lines.append(f'{name:<52} {old * 1000:>12.3f} {new * 1000:>12.3f} {ratio:>8.2f}')
+    return '\n'.join(lines)
@@ -0,0 +1,105 @@
+import hashlib
+import uuid
+from functools import partial
+
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Q
+
+from ipam.models import IPAddress, IPRange, Prefix, VLAN, VLANGroup
+
+CACHE_PREFIX = 'netbox_scripthelper'
+
+
+def _get_generation_key(model, pk):
+    return f'{CACHE_PREFIX}:generation:{model._meta.label_lower}:{pk}'
+
+
+def get_generation(model, pk):
+    """
+    Returns a token that changes every time the content of the object is changed.
+    """
+
+    return cache.get_or_set(_get_generation_key(model, pk), lambda: uuid.uuid4().hex, timeout=None)
+
+
+def bump_generation(model, key):
+    """
+    Changes the generation token of `key` of the `model` once the current
+    transaction is committed. The key is a pk or a name of a group of objects.
+    """
+
+    transaction.on_commit(partial(cache.delete, _get_generation_key(model, key)))
+
+
+def get_request_digest(request):
+    """
+    Returns a digest of the host and query parameters of the request.
+    """
+
+    params = sorted((name, value) for name, values in request.query_params.lists() for value in values)
+    return hashlib.md5(repr((request.get_host(), params)).encode()).hexdigest()
+
+
+def get_response_key(endpoint, request, parent):
+    """
+    Returns the cache key of a response of the `endpoint` for the `parent` object.
+    Access to the parent is checked before the cache is consulted, so responses
+    do not depend on the user and are shared between users.
+    """
+
+    digest = get_request_digest(request)
+    generation = get_generation(type(parent), parent.pk)
+    return f'{CACHE_PREFIX}:response:{endpoint}:{parent.pk}:{generation}:{digest}'
+
+
+def _get_containing_prefixes(prefix, vrf_id):
+    # Global containers include children from all VRFs
+    return Prefix.objects.filter(
+        Q(vrf_id=vrf_id) | Q(vrf__isnull=True),
+        prefix__net_contains_or_equals=str(prefix)
+    ).values_list('pk', flat=True)
+
+
+def get_affected_parents(instance):
+    """
+    Returns (model, pk) of the objects whose available or child objects
+    depend on `instance`.
+    """
+
+    parents = set()
+    if isinstance(instance, IPAddress):
+        prefixes = _get_containing_prefixes(instance.address.ip, instance.vrf_id)
+        parents.update((Prefix, pk) for pk in prefixes)
+        ranges = IPRange.objects.filter(
+            vrf_id=instance.vrf_id,
+            start_address__lte=instance.address,
+            end_address__gte=instance.address
+        ).values_list('pk', flat=True)
+        parents.update((IPRange, pk) for pk in ranges)
+    elif isinstance(instance, IPRange):
+        prefixes = _get_containing_prefixes(instance.start_address.ip, instance.vrf_id)
+        parents.update((Prefix, pk) for pk in prefixes)
+        parents.add((IPRange, instance.pk))
+    elif isinstance(instance, Prefix):
+        prefixes = _get_containing_prefixes(instance.prefix, instance.vrf_id)
+        parents.update((Prefix, pk) for pk in prefixes)
+        parents.add((Prefix, instance.pk))
+    elif isinstance(instance, VLAN):
+        if instance.group_id:
+            parents.add((VLANGroup, instance.group_id))
+    elif isinstance(instance, VLANGroup):
+        parents.add((VLANGroup, instance.pk))
+    return parents
+
+
+def invalidate_parents(parents):
+    """
+    Drops cached responses of `parents` once the current transaction is committed.
+    """
+
+    def invalidate():
+        cache.delete_many([_get_generation_key(model, pk) for model, pk in parents])
+
+    if parents:
+        transaction.on_commit(invalidate)
@@ -0,0 +1,11 @@
+from netbox.plugins import get_plugin_config
+
+from . import ScriptHelperConfig
+
+
+def get_setting(name):
+    """
+    Returns the plugin setting `name` or its default value.
+    """
+
+    return get_plugin_config(ScriptHelperConfig.name, name, ScriptHelperConfig.default_settings[name])
@@ -1,40 +1,202 @@
 from collections import defaultdict
 
 from django.contrib.auth import get_user_model
+from django.db import transaction
 from django.utils import timezone
 from django.utils.translation import gettext as _
 from django_rq import get_queue
+from rq import Queue
 
 from netbox.config import get_config
 from netbox.constants import RQ_QUEUE_DEFAULT
 from utilities.rqworker import get_rq_retry
 from extras.choices import EventRuleActionChoices
+from extras.conditions import ConditionSet
 from extras.models import EventRule
 
+from .cache import bump_generation, get_generation
+from .config import get_setting
+from .instrumentation import Timings
+from .snapshots import encode_snapshots
 
-def process_event_rules(event_rules, object_type, event_type, data, username=None, snapshots=None, request_id=None):
-    if username:
-        user = get_user_model().objects.get(username=username)
+# The key of EventRule.action_data that overrides the `coalesce_script_events` setting
+COALESCE_ACTION_DATA_KEY = 'coalesce_events'
+
+
+def compile_conditions(conditions):
+    """
+    Returns a callable that evaluates the event rule `conditions` against event data.
+    """
+
+    if not conditions:
+        return lambda data: True
+    return ConditionSet(conditions).eval
+
+
+class EventRuleCache:
+    """
+    Process-local cache of enabled event rules by (event_type, object_type).
+    Other processes are notified about changes through a version token kept
+    in the Django cache, it is checked once per flush.
+    """
+
+    def __init__(self):
+        self.version = None
+        self.rules = {}
+
+    def refresh(self):
+        version = get_generation(EventRule, 'enabled')
+        if version != self.version:
+            self.rules = {}
+            self.version = version
+
+    def get(self, event_type, object_type):
+        key = (event_type, object_type.pk)
+        if key not in self.rules:
+            self.rules[key] = list(EventRule.objects.filter(
+                event_types__contains=[event_type],
+                object_types=object_type,
+                enabled=True
+            ))
+        return self.rules[key]
+
+    def clear(self):
+        self.version = None
+        self.rules = {}
+
+    def invalidate(self):
+        """
+        Drops cached rules in all processes once the current transaction is committed.
+        """
+        bump_generation(EventRule, 'enabled')
+        transaction.on_commit(self.clear)
+
+
+event_rules_cache = EventRuleCache()
+
+
+class EventDispatcher:
+    """
+    Collects actions of the events flushed at once. Users, queues and settings
+    are resolved once per flush and webhook jobs are pushed to RQ through a
+    single pipeline per queue.
+    """
+
+    def __init__(self):
+        self.users = {}
+        self.queues = {}
+        self.webhook_queue_name = get_config().QUEUE_MAPPINGS.get('webhook', RQ_QUEUE_DEFAULT)
+        self.retry = get_rq_retry()
+        self.jobs = defaultdict(list)
+        self.coalesce = get_setting('coalesce_script_events')
+        self.compact_snapshots = get_setting('compact_snapshots')
+        self.scripts = {}
+        self.conditions = {}
+
+    def eval_conditions(self, event_rule, data):
+        """
+        Evaluates conditions of the event rule, they are compiled once per flush.
+        """
+        if event_rule.pk not in self.conditions:
+            self.conditions[event_rule.pk] = compile_conditions(event_rule.conditions)
+        return self.conditions[event_rule.pk](data)
+
+    def get_script_snapshots(self, event_rules, snapshots):
+        """
+        Returns snapshots passed to scripts, they are encoded only if there is a script rule.
+        """
+        if not snapshots or not self.compact_snapshots:
+            return snapshots
+        if any(event_rule.action_type == EventRuleActionChoices.SCRIPT for event_rule in event_rules):
+            return encode_snapshots(snapshots)
+        return snapshots
+
+    def resolve_users(self, usernames):
+        usernames = set(usernames) - set(self.users) - {None, ''}
+        if usernames:
+            for user in get_user_model().objects.filter(username__in=usernames):
+                self.users[user.username] = user
+
+    def get_user(self, username):
+        if not username:
+            return None
+        self.resolve_users([username])
+        if username not in self.users:
+            raise get_user_model().DoesNotExist(f'User {username} does not exist.')
+        return self.users[username]
+
+    def get_queue(self, name):
+        if name not in self.queues:
+            self.queues[name] = get_queue(name)
+        return self.queues[name]
+
+    def enqueue(self, queue_name, func, **kwargs):
+        self.jobs[queue_name].append(Queue.prepare_data(func, kwargs=kwargs, retry=self.retry))
+
+    def should_coalesce(self, event_rule):
+        return (event_rule.action_data or {}).get(COALESCE_ACTION_DATA_KEY, self.coalesce)
+
+    def enqueue_script(self, event_rule, name, user, event_data):
+        """
+        Enqueues a ScriptJob for the event. With coalescing enabled the events are
+        collected instead and one ScriptJob per rule is enqueued when the dispatcher
+        is flushed. The job runs on behalf of the user of the first event.
+        """
+        if not self.should_coalesce(event_rule):
+            from extras.jobs import ScriptJob
+            ScriptJob.enqueue(
+                instance=event_rule.action_object,
+                name=name,
+                user=user,
+                data=event_data
+            )
+            return
+        if event_rule.pk not in self.scripts:
+            self.scripts[event_rule.pk] = (event_rule, name, user, [])
+        self.scripts[event_rule.pk][-1].append(event_data)
+
+    def flush(self):
+        from extras.jobs import ScriptJob
+        for event_rule, name, user, events in self.scripts.values():
+            ScriptJob.enqueue(
+                instance=event_rule.action_object,
+                name=name,
+                user=user,
+                data={'events': events}
+            )
+        self.scripts.clear()
+        for queue_name, jobs in self.jobs.items():
+            rq_queue = self.get_queue(queue_name)
+            with rq_queue.connection.pipeline() as pipeline:
+                rq_queue.enqueue_many(jobs, pipeline=pipeline)
+                pipeline.execute()
+        self.jobs.clear()
+
+
+def process_event_rules(event_rules, object_type, event_type, data, username=None, snapshots=None, request_id=None,
+                        dispatcher=None):
+    if dispatcher is None:
+        dispatcher = EventDispatcher()
+        flush = True
     else:
-        user = None
+        flush = False
+    user = dispatcher.get_user(username)
+    script_snapshots = dispatcher.get_script_snapshots(event_rules, snapshots)
 
     for event_rule in event_rules:
 
         # Evaluate event rule conditions (if any)
-        if not event_rule.eval_conditions(data):
+        if not dispatcher.eval_conditions(event_rule, data):
             continue
 
         # Compile event data
-        event_data = event_rule.action_data or {}
+        event_data = dict(event_rule.action_data or {})
+        event_data.pop(COALESCE_ACTION_DATA_KEY, None)
         event_data.update(data)
 
         # Webhooks
         if event_rule.action_type == EventRuleActionChoices.WEBHOOK:
 
-            # Select the appropriate RQ queue
-            queue_name = get_config().QUEUE_MAPPINGS.get('webhook', RQ_QUEUE_DEFAULT)
-            rq_queue = get_queue(queue_name)
-
             # Compile the task parameters
             params = {
                 "event_rule": event_rule,
@@ -44,36 +206,26 @@ def process_event_rules(event_rules, object_type, event_type, data, username=Non
                 "snapshots": snapshots,
                 "timestamp": timezone.now().isoformat(),
                 "username": username,
-                "retry": get_rq_retry()
             }
             if snapshots:
                 params["snapshots"] = snapshots
             if request_id:
                 params["request_id"] = request_id
 
-            # Enqueue the task
-            rq_queue.enqueue(
-                "extras.webhooks.send_webhook",
-                **params
-            )
+            # Collect the task, it is enqueued when the dispatcher is flushed
+            dispatcher.enqueue(dispatcher.webhook_queue_name, "extras.webhooks.send_webhook", **params)
 
         # Scripts
         elif event_rule.action_type == EventRuleActionChoices.SCRIPT:
             # Resolve the script from action parameters
             script = event_rule.action_object.python_class()
             # a little trick for https://github.com/netbox-community/netbox/issues/14896
-            event_data['snapshots'] = snapshots
+            event_data['snapshots'] = script_snapshots
             event_data['event'] = event_type
             event_data['username'] = username
 
             # Enqueue a Job to record the script's execution
-            from extras.jobs import ScriptJob
-            ScriptJob.enqueue(
-                instance=event_rule.action_object,
-                name=script.name,
-                user=user,
-                data=event_data
-            )
+            dispatcher.enqueue_script(event_rule, script.name, user, event_data)
 
         # Notification groups
         elif event_rule.action_type == EventRuleActionChoices.NOTIFICATION:
@@ -90,32 +242,58 @@ def process_event_rules(event_rules, object_type, event_type, data, username=Non
                 action_type=event_rule.action_type
             ))
 
+    if flush:
+        dispatcher.flush()
 
-def process_event_queue(events):
+
+def handle_events(events):
     """
-    Flush a list of object representation to RQ for EventRule processing.
+    Runs event rules for a list of object representation. It is called either
+    at the end of the request or by an RQ worker in the asynchronous mode.
     """
-    events_cache = defaultdict(dict)
+    events = list(events)
+    timings = Timings('handle_events')
+    dispatcher = EventDispatcher()
+    with timings.stage('users'):
+        dispatcher.resolve_users(event['username'] for event in events)
+    with timings.stage('rules'):
+        event_rules_cache.refresh()
+        event_rules = [event_rules_cache.get(event['event_type'], event['object_type']) for event in events]
+
+    with timings.stage('process'):
+        for event, rules in zip(events, event_rules):
+            process_event_rules(
+                event_rules=rules,
+                object_type=event['object_type'],
+                event_type=event['event_type'],
+                data=event['data'],
+                username=event['username'],
+                snapshots=event['snapshots'],
+                request_id=event['request_id'],
+                dispatcher=dispatcher
+            )
 
-    for event in events:
-        event_type = event['event_type']
-        object_type = event['object_type']
+    with timings.stage('flush'):
+        dispatcher.flush()
+    timings.finish()
 
-        # Cache applicable Event Rules
-        if object_type not in events_cache[event_type]:
-            events_cache[event_type][object_type] = EventRule.objects.filter(
-                event_types__contains=[event['event_type']],
-                object_types=object_type,
-                enabled=True
+
+def process_event_queue(events):
+    """
+    Flush a list of object representation to RQ for EventRule processing.
+    In the asynchronous mode all events are passed to a single RQ job.
+    """
+    events = list(events)
+    if not events:
+        return
+    if get_setting('async_events'):
+        timings = Timings('process_event_queue')
+        with timings.stage('enqueue'):
+            get_queue(get_setting('events_queue')).enqueue(
+                'netbox_scripthelper.events.handle_events',
+                events,
+                retry=get_rq_retry()
             )
-        event_rules = events_cache[event_type][object_type]
-
-        process_event_rules(
-            event_rules=event_rules,
-            object_type=object_type,
-            event_type=event['event_type'],
-            data=event['data'],
-            username=event['username'],
-            snapshots=event['snapshots'],
-            request_id=event['request_id']
-        )
+        timings.finish()
+        return
+    handle_events(events)
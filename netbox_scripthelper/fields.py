@@ -1,21 +1,72 @@
 
+from functools import partial
+
 from django import forms
 from django.conf import settings
 from extras.scripts import ScriptVariable
+from netbox.context import current_request
 from utilities.forms import widgets
 from utilities.forms.fields import ExpandableNameField
 
 
+def can_prefetch(api_url, query_params):
+    """
+    Returns True if choices of `api_url` do not depend on other fields, which the
+    browser resolves: {{field}} in the URL and $field in query parameters.
+    """
+    if '{{' in api_url:
+        return False
+    for value in query_params.values():
+        values = value if isinstance(value, (list, tuple)) else [value]
+        if any(isinstance(v, str) and v.startswith('$') for v in values):
+            return False
+    return True
+
+
+def prefetch_choices(api_url, query_params):
+    """
+    Returns the first page of choices of `api_url` resolved on the server side.
+    """
+    request = current_request.get()
+    if request is None:
+        return []
+    from .api.views import get_choices
+    return get_choices(request, api_url, query_params) or []
+
+
+class PrefetchedAPISelect(widgets.APISelect):
+    """
+    API select rendered with the first page of choices. The API is requested
+    only for search.
+    """
+
+    class Media:
+        # Turns off the preload of selects marked with data-prefetched
+        js = ('netbox_scripthelper/prefetched-select.js',)
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.attrs['data-prefetched'] = 'true'
+
+
 class DynamicChoiceField(forms.ChoiceField):
     """
     Dynamic selection field for a object, backed by NetBox's REST API.
+    If `prefetch` is set, the first page of choices of a fixed `api_url` is
+    rendered with the form, and the API is requested only for search.
+    Choices depending on other fields are always loaded by the browser.
     """
 
     widget = widgets.APISelect
 
     def __init__(self, query_params=None, initial_params=None, null_option=None, disabled_indicator=None,
-                 fetch_trigger=None, empty_label=None, *args, **kwargs):
+                 fetch_trigger=None, empty_label=None, api_url=None, prefetch=False, *args, **kwargs):
         self.query_params = query_params or {}
+        self.api_url = api_url
+        if api_url and prefetch and can_prefetch(api_url, self.query_params):
+            # Choices are evaluated when the form is rendered
+            kwargs['choices'] = partial(prefetch_choices, api_url, self.query_params)
+            kwargs.setdefault('widget', PrefetchedAPISelect)
         self.initial_params = initial_params or {}
         self.null_option = null_option
         self.disabled_indicator = disabled_indicator
@@ -31,6 +82,9 @@ class DynamicChoiceField(forms.ChoiceField):
             'data-empty-option': self.empty_option
         }
 
+        if self.api_url:
+            attrs['data-url'] = self.api_url
+
         # Set value-field attribute if the field specifies to_field_name
         if self.to_field_name:
             attrs['value-field'] = self.to_field_name
@@ -72,21 +126,17 @@ class DynamicChoiceField(forms.ChoiceField):
 class DynamicChoiceVar(ScriptVariable):
     form_field = DynamicChoiceField
 
-    def __init__(self, api_url, query_params=None, null_option=None, *args, **kwargs):
+    def __init__(self, api_url, query_params=None, null_option=None, prefetch=False, *args, **kwargs):
         super().__init__(*args, **kwargs)
 
         self.api_url = api_url
         self.field_attrs.update({
             'query_params': query_params,
             'null_option': null_option,
+            'api_url': api_url,
+            'prefetch': prefetch,
         })
 
-    def as_field(self):
-        form_field = super().as_field()
-        form_field.widget.attrs['data-url'] = self.api_url
-
-        return form_field
-
 
 class ExpandableStringVar(ScriptVariable):
     form_field = ExpandableNameField
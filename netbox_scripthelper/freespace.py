@@ -0,0 +1,412 @@
+"""
+Calculation of the free space of many parent objects at once.
+
+The functions mirror `get_available_ips()`, `get_available_prefixes()` and
+`get_available_vids()` of NetBox models, but fetch the children of all the
+parents with a single query per model.
+
+If the `freespace_engine` setting is "database", the free space of prefixes
+and IP ranges is calculated by PostgreSQL instead: children are ordered by
+their first address and only the gaps between them are returned. All the
+parents of a model are calculated with a single query as well.
+
+If the `freespace_index` setting is enabled, the free space is read from the
+index kept in the database (see `index`) and is calculated only for parents
+that are not indexed yet.
+"""
+from bisect import bisect_left, bisect_right
+
+import netaddr
+from django.db import connection
+from django.db.models import Q
+
+from ipam.choices import PrefixStatusChoices
+from ipam.models import IPAddress, IPRange, Prefix, VLAN
+
+from . import index
+from .config import get_setting
+from .utils import IntervalSet, IPSplitter, ranges_to_cidrs
+
+# The parents are given as a VALUES list and their children as (parent, first address,
+# last address) rows. Within each parent the running maximum of last addresses is the
+# end of the covered space, so a gap exists wherever the next child starts more than
+# one address after it. The last rows hold the first and the last covered addresses
+# of each parent, which bound the gaps at the edges of the parent.
+GAPS_SQL = """
+WITH parents ({columns}) AS ({parents}),
+children ("parent", "first", "last") AS ({children}),
+ordered AS (
+    SELECT
+        "parent",
+        MAX("last") OVER w AS covered,
+        LEAD("first") OVER w AS next_first
+    FROM children
+    WINDOW w AS (PARTITION BY "parent" ORDER BY "first", "last" ROWS BETWEEN UNBOUNDED PRECEDING AND CURRENT ROW)
+)
+SELECT "parent", FALSE, HOST(covered), HOST(next_first) FROM ordered
+WHERE CASE WHEN next_first > covered THEN next_first - 1 > covered ELSE FALSE END
+UNION ALL
+SELECT "parent", TRUE, HOST(MIN("first")), HOST(MAX("last")) FROM children GROUP BY "parent"
+"""
+
+# Columns of the parents of the queries below
+PREFIX_COLUMNS = (('id', 'bigint'), ('vrf_id', 'bigint'), ('is_global', 'boolean'), ('prefix', 'cidr'))
+IPRANGE_COLUMNS = (('id', 'bigint'), ('vrf_id', 'bigint'), ('start_address', 'inet'), ('end_address', 'inet'))
+
+# Addresses and utilized IP ranges within prefixes
+PREFIX_IPS_SQL = f"""
+SELECT parents.id, HOST(c.address)::inet, HOST(c.address)::inet
+FROM "{IPAddress._meta.db_table}" c JOIN parents ON HOST(c.address)::inet <<= parents.prefix
+    AND (parents.is_global OR c.vrf_id IS NOT DISTINCT FROM parents.vrf_id)
+UNION ALL
+SELECT parents.id, HOST(c.start_address)::inet, HOST(c.end_address)::inet
+FROM "{IPRange._meta.db_table}" c JOIN parents ON c.vrf_id IS NOT DISTINCT FROM parents.vrf_id
+    AND HOST(c.start_address)::inet <<= parents.prefix AND HOST(c.end_address)::inet <<= parents.prefix
+WHERE c.mark_utilized
+"""
+
+# Prefixes within prefixes
+PREFIX_PREFIXES_SQL = f"""
+SELECT parents.id, HOST(c.prefix)::inet, HOST(BROADCAST(c.prefix))::inet
+FROM "{Prefix._meta.db_table}" c JOIN parents ON c.prefix << parents.prefix
+    AND (parents.is_global OR c.vrf_id IS NOT DISTINCT FROM parents.vrf_id)
+"""
+
+# Addresses within IP ranges
+IPRANGE_IPS_SQL = f"""
+SELECT parents.id, HOST(c.address)::inet, HOST(c.address)::inet
+FROM "{IPAddress._meta.db_table}" c JOIN parents ON c.vrf_id IS NOT DISTINCT FROM parents.vrf_id
+    AND c.address >= parents.start_address AND c.address <= parents.end_address
+"""
+
+
+class SortedChildren:
+    """
+    Children sorted by their first address for looking up the ones within a range.
+    """
+
+    def __init__(self, rows, get_address):
+        keys = sorted((get_address(row).version, get_address(row).value, index) for index, row in enumerate(rows))
+        self.rows = [rows[index] for _, _, index in keys]
+        self.keys = [(version, value) for version, value, _ in keys]
+
+    def between(self, version, first, last):
+        return self.rows[bisect_left(self.keys, (version, first)):bisect_right(self.keys, (version, last))]
+
+
+def is_global_container(prefix):
+    """
+    Global containers hold children from all VRFs.
+    """
+    return prefix.vrf_id is None and prefix.status == PrefixStatusChoices.STATUS_CONTAINER
+
+
+def _get_children_filter(prefixes, lookup):
+    query = Q()
+    for prefix in prefixes:
+        condition = Q(**{lookup: str(prefix.prefix)})
+        if not is_global_container(prefix):
+            condition &= Q(vrf_id=prefix.vrf_id)
+        query |= condition
+    return query
+
+
+def exclude_reserved_ips(prefix, available_ips):
+    """
+    Removes addresses that NetBox never offers from the free space of the prefix.
+    """
+    # IPv6 /127's, pool, or IPv4 /31-/32 sets are fully usable
+    if (prefix.family == 6 and prefix.prefix.prefixlen >= 127) or prefix.is_pool or (
+            prefix.family == 4 and prefix.prefix.prefixlen >= 31):
+        return available_ips
+    if prefix.family == 4:
+        # For "normal" IPv4 prefixes, omit first and last addresses
+        return available_ips - netaddr.IPSet([
+            netaddr.IPAddress(prefix.prefix.first),
+            netaddr.IPAddress(prefix.prefix.last),
+        ])
+    # For IPv6 prefixes, omit the Subnet-Router anycast address
+    return available_ips - netaddr.IPSet([netaddr.IPAddress(prefix.prefix.first)])
+
+
+def get_gaps(children, columns, parents, bounds):
+    """
+    Returns sorted (first, last) ranges of integer addresses of each parent that
+    are not covered by its children as {pk: gaps}. `parents` are rows of the
+    `columns` starting with the primary key, `children` is an SQL query of
+    (parent, first, last) rows joined with them and `bounds` are the first and
+    the last integer addresses of each parent as {pk: (first, last)}.
+    All the parents are calculated with a single query.
+    """
+    row = '(' + ', '.join(f'%s::{column_type}' for _, column_type in columns) + ')'
+    sql = GAPS_SQL.format(
+        columns=', '.join(f'"{name}"' for name, _ in columns),
+        parents='VALUES ' + ', '.join([row] * len(parents)),
+        children=children
+    )
+    with connection.cursor() as cursor:
+        cursor.execute(sql, [value for parent in parents for value in parent])
+        rows = cursor.fetchall()
+
+    gaps = {pk: [] for pk in bounds}
+    covered = {}
+    for pk, is_bounds, start, end in rows:
+        if is_bounds:
+            covered[pk] = (netaddr.IPAddress(start).value, netaddr.IPAddress(end).value)
+        else:
+            gaps[pk].append((netaddr.IPAddress(start).value + 1, netaddr.IPAddress(end).value - 1))
+    for pk, (first, last) in bounds.items():
+        if pk not in covered:
+            # No children
+            gaps[pk] = [(first, last)]
+            continue
+        lowest, highest = covered[pk]
+        if lowest > first:
+            gaps[pk].append((first, lowest - 1))
+        if highest < last:
+            gaps[pk].append((highest + 1, last))
+        gaps[pk].sort()
+    return gaps
+
+
+def _get_prefix_rows(prefixes):
+    return [
+        (prefix.pk, prefix.vrf_id, is_global_container(prefix), str(prefix.prefix)) for prefix in prefixes
+    ]
+
+
+def _get_prefix_bounds(prefixes):
+    return {prefix.pk: (prefix.prefix.first, prefix.prefix.last) for prefix in prefixes}
+
+
+def query_prefixes_available_ips(prefixes):
+    """
+    Returns available IPs of each prefix as {pk: IPSet} calculated by the database.
+    """
+    gaps = get_gaps(PREFIX_IPS_SQL, PREFIX_COLUMNS, _get_prefix_rows(prefixes), _get_prefix_bounds(prefixes))
+    return {
+        prefix.pk: exclude_reserved_ips(prefix, netaddr.IPSet(ranges_to_cidrs(gaps[prefix.pk], prefix.family)))
+        for prefix in prefixes
+    }
+
+
+def query_prefixes_available_prefixes(prefixes):
+    """
+    Returns available prefixes within each prefix as {pk: IPSet} calculated by the database.
+    """
+    gaps = get_gaps(PREFIX_PREFIXES_SQL, PREFIX_COLUMNS, _get_prefix_rows(prefixes), _get_prefix_bounds(prefixes))
+    return {prefix.pk: netaddr.IPSet(ranges_to_cidrs(gaps[prefix.pk], prefix.family)) for prefix in prefixes}
+
+
+def query_ipranges_available_ips(ipranges):
+    """
+    Returns available IPs of each IP range as {pk: IPSet} calculated by the database.
+    """
+    rows = [
+        (iprange.pk, iprange.vrf_id, str(iprange.start_address), str(iprange.end_address)) for iprange in ipranges
+    ]
+    bounds = {iprange.pk: (iprange.start_address.ip.value, iprange.end_address.ip.value) for iprange in ipranges}
+    gaps = get_gaps(IPRANGE_IPS_SQL, IPRANGE_COLUMNS, rows, bounds)
+    return {
+        iprange.pk: netaddr.IPSet(ranges_to_cidrs(gaps[iprange.pk], iprange.start_address.version))
+        for iprange in ipranges
+    }
+
+
+def use_database():
+    return get_setting('freespace_engine') == 'database'
+
+
+def use_index():
+    return get_setting('freespace_index')
+
+
+def get_available_ips(parent):
+    """
+    Returns available IPs of a prefix or an IP range as an IPSet.
+    """
+    if use_index():
+        return index.get_available([parent], index.KIND_IPS)[parent.pk]
+    if not use_database():
+        return parent.get_available_ips()
+    if isinstance(parent, IPRange):
+        return query_ipranges_available_ips([parent])[parent.pk]
+    return query_prefixes_available_ips([parent])[parent.pk]
+
+
+def get_available_prefixes(prefix):
+    """
+    Returns available prefixes within the prefix as an IPSet.
+    """
+    if use_index():
+        return index.get_available([prefix], index.KIND_PREFIXES)[prefix.pk]
+    if not use_database():
+        return prefix.get_available_prefixes()
+    return query_prefixes_available_prefixes([prefix])[prefix.pk]
+
+
+def get_prefix_splitter(prefix):
+    """
+    Returns an IPSplitter of the available prefixes within the prefix.
+    """
+    if use_index():
+        intervals = index.get_intervals([prefix], index.KIND_PREFIXES)[prefix.pk]
+        return IPSplitter.from_intervals({prefix.family: intervals})
+    return IPSplitter(get_available_prefixes(prefix))
+
+
+def get_prefixes_available_ips(prefixes):
+    """
+    Returns available IPs of each prefix as {pk: IPSet}.
+    """
+    if use_index():
+        return index.get_available(prefixes, index.KIND_IPS)
+    return calculate_prefixes_available_ips(prefixes)
+
+
+def get_prefixes_available_prefixes(prefixes):
+    """
+    Returns available prefixes within each prefix as {pk: IPSet}.
+    """
+    if use_index():
+        return index.get_available(prefixes, index.KIND_PREFIXES)
+    return calculate_prefixes_available_prefixes(prefixes)
+
+
+def get_ipranges_available_ips(ipranges):
+    """
+    Returns available IPs of each IP range as {pk: IPSet}.
+    """
+    if use_index():
+        return index.get_available(ipranges, index.KIND_IPS)
+    return calculate_ipranges_available_ips(ipranges)
+
+
+def get_vlangroups_available_vids(vlangroups):
+    """
+    Returns available VIDs of each VLAN group as {pk: IntervalSet}.
+    """
+    if use_index():
+        return index.get_intervals(vlangroups, index.KIND_VIDS)
+    return calculate_vlangroups_available_vids(vlangroups)
+
+
+def calculate_prefixes_available_ips(prefixes):
+    """
+    Calculates available IPs of each prefix as {pk: IPSet}.
+    """
+    prefixes = list(prefixes)
+    if not prefixes:
+        return {}
+    if use_database():
+        return query_prefixes_available_ips(prefixes)
+    child_ips = SortedChildren(
+        list(IPAddress.objects.filter(
+            _get_children_filter(prefixes, 'address__net_host_contained')
+        ).values_list('vrf_id', 'address')),
+        lambda row: row[1].ip
+    )
+    ranges_filter = Q()
+    for prefix in prefixes:
+        ranges_filter |= Q(
+            vrf_id=prefix.vrf_id,
+            start_address__net_host_contained=str(prefix.prefix),
+            end_address__net_host_contained=str(prefix.prefix)
+        )
+    child_ranges = SortedChildren(
+        list(IPRange.objects.filter(ranges_filter, mark_utilized=True).values_list(
+            'vrf_id', 'start_address', 'end_address'
+        )),
+        lambda row: row[1].ip
+    )
+
+    available = {}
+    for prefix in prefixes:
+        bounds = (prefix.family, prefix.prefix.first, prefix.prefix.last)
+        available_ips = netaddr.IPSet(prefix.prefix) - netaddr.IPSet([
+            address.ip for vrf_id, address in child_ips.between(*bounds)
+            if is_global_container(prefix) or vrf_id == prefix.vrf_id
+        ])
+        for vrf_id, start_address, end_address in child_ranges.between(*bounds):
+            if vrf_id == prefix.vrf_id and end_address.ip in prefix.prefix:
+                available_ips.remove(netaddr.IPRange(start_address.ip, end_address.ip))
+        available[prefix.pk] = exclude_reserved_ips(prefix, available_ips)
+    return available
+
+
+def calculate_prefixes_available_prefixes(prefixes):
+    """
+    Calculates available prefixes within each prefix as {pk: IPSet}.
+    """
+    prefixes = list(prefixes)
+    if not prefixes:
+        return {}
+    if use_database():
+        return query_prefixes_available_prefixes(prefixes)
+    child_prefixes = SortedChildren(
+        list(Prefix.objects.filter(
+            _get_children_filter(prefixes, 'prefix__net_contained')
+        ).values_list('vrf_id', 'prefix')),
+        lambda row: row[1].network
+    )
+
+    available = {}
+    for prefix in prefixes:
+        children = child_prefixes.between(prefix.family, prefix.prefix.first, prefix.prefix.last)
+        available[prefix.pk] = netaddr.IPSet(prefix.prefix) - netaddr.IPSet([
+            child for vrf_id, child in children
+            if child.prefixlen > prefix.prefix.prefixlen and (is_global_container(prefix) or vrf_id == prefix.vrf_id)
+        ])
+    return available
+
+
+def calculate_ipranges_available_ips(ipranges):
+    """
+    Calculates available IPs of each IP range as {pk: IPSet}.
+    """
+    ipranges = list(ipranges)
+    if not ipranges:
+        return {}
+    if use_database():
+        return query_ipranges_available_ips(ipranges)
+    query = Q()
+    for iprange in ipranges:
+        query |= Q(vrf_id=iprange.vrf_id, address__gte=iprange.start_address, address__lte=iprange.end_address)
+    child_ips = SortedChildren(
+        list(IPAddress.objects.filter(query).values_list('vrf_id', 'address')),
+        lambda row: row[1].ip
+    )
+
+    available = {}
+    for iprange in ipranges:
+        first, last = iprange.start_address.ip, iprange.end_address.ip
+        available[iprange.pk] = netaddr.IPSet(netaddr.IPRange(first, last)) - netaddr.IPSet([
+            address.ip for vrf_id, address in child_ips.between(first.version, first.value, last.value)
+            if vrf_id == iprange.vrf_id
+        ])
+    return available
+
+
+def get_vid_ranges(vlangroup):
+    """
+    Returns VIDs of the group as an IntervalSet.
+    """
+    return IntervalSet.from_ranges(
+        (vid_range.lower + (not vid_range.lower_inc), vid_range.upper - (not vid_range.upper_inc))
+        for vid_range in vlangroup.vid_ranges
+    )
+
+
+def calculate_vlangroups_available_vids(vlangroups):
+    """
+    Calculates available VIDs of each VLAN group as {pk: IntervalSet}.
+    """
+    vlangroups = list(vlangroups)
+    used_vids = {vlangroup.pk: [] for vlangroup in vlangroups}
+    for group_id, vid in VLAN.objects.filter(group__in=vlangroups).values_list('group_id', 'vid'):
+        used_vids[group_id].append((vid, vid))
+
+    return {
+        vlangroup.pk: get_vid_ranges(vlangroup).difference(IntervalSet.from_ranges(used_vids[vlangroup.pk]))
+        for vlangroup in vlangroups
+    }
@@ -0,0 +1,362 @@
+"""
+Index of the free space of parent objects.
+
+The free space of prefixes, IP ranges and VLAN groups is stored in `FreeSpace`
+rows as compact ranges of integers. A parent is indexed the first time its
+free space is requested. Afterwards the rows are updated by signals: a new
+child is cut out of the free space of its parents and the range of a deleted
+one is returned to it, unless other children still take it. Saves that do not
+change the fields in `TRACKED_FIELDS` are ignored, other changes make the
+affected parents be calculated again. Updates take row locks of the parents,
+so a child committed while its parent is being indexed is applied to the new
+row. Use the `scripthelper_freespace` management command to rebuild the
+index or to check it against the live calculation.
+"""
+from collections import defaultdict
+from functools import partial
+
+import netaddr
+from django.contrib.contenttypes.models import ContentType
+from django.db import transaction
+from django.db.models import Q
+
+from ipam.models import IPAddress, IPRange, Prefix, VLAN, VLANGroup
+
+from . import freespace
+from .cache import get_affected_parents
+from .models import FreeSpace
+from .utils import IntervalSet, ranges_to_cidrs
+
+KIND_IPS = 'ips'
+KIND_PREFIXES = 'prefixes'
+KIND_VIDS = 'vids'
+
+# parent model => {kind: name of the `freespace` function calculating the free space of many parents}
+KINDS = {
+    Prefix: {
+        KIND_IPS: 'calculate_prefixes_available_ips',
+        KIND_PREFIXES: 'calculate_prefixes_available_prefixes',
+    },
+    IPRange: {
+        KIND_IPS: 'calculate_ipranges_available_ips',
+    },
+    VLANGroup: {
+        KIND_VIDS: 'calculate_vlangroups_available_vids',
+    },
+}
+
+# child model => kind of the free space of its parents the child takes
+CHILD_KINDS = {
+    IPAddress: KIND_IPS,
+    IPRange: KIND_IPS,
+    Prefix: KIND_PREFIXES,
+    VLAN: KIND_VIDS,
+}
+
+# model => fields that affect the free space of the object or of its parents
+TRACKED_FIELDS = {
+    IPAddress: ('address', 'vrf_id'),
+    IPRange: ('start_address', 'end_address', 'vrf_id', 'mark_utilized'),
+    Prefix: ('prefix', 'vrf_id', 'status', 'is_pool'),
+    VLAN: ('vid', 'group_id'),
+    VLANGroup: ('vid_ranges',),
+}
+
+# The number of parents calculated at once while rebuilding the index
+BATCH_SIZE = 500
+
+
+def get_version(parent):
+    if isinstance(parent, IPRange):
+        return parent.start_address.version
+    return getattr(parent, 'family', None)
+
+
+def to_intervals(parent, available):
+    """
+    Returns the free space calculated by `freespace` as an IntervalSet.
+    """
+    if isinstance(available, IntervalSet):
+        return available
+    return IntervalSet.from_ipset(available, get_version(parent))
+
+
+def calculate(parents, kind):
+    """
+    Calculates the free space of `parents` of the same model as {pk: IntervalSet}.
+    """
+    parents = list(parents)
+    if not parents:
+        return {}
+    available = getattr(freespace, KINDS[type(parents[0])][kind])(parents)
+    return {parent.pk: to_intervals(parent, available[parent.pk]) for parent in parents}
+
+
+def save(parents, kind, intervals):
+    """
+    Stores the free space of `parents` of the same model given as {pk: IntervalSet}.
+    """
+    parents = list(parents)
+    if not parents:
+        return
+    parent_type = ContentType.objects.get_for_model(parents[0])
+    FreeSpace.objects.bulk_create(
+        [
+            FreeSpace(parent_type=parent_type, parent_id=parent.pk, kind=kind, intervals=list(intervals[parent.pk]))
+            for parent in parents
+        ],
+        update_conflicts=True,
+        unique_fields=('parent_type', 'parent_id', 'kind'),
+        update_fields=('intervals', 'last_updated'),
+    )
+
+
+def lock_parents(model, pks):
+    """
+    Locks rows of the parent objects until the end of the transaction.
+    """
+    list(model.objects.select_for_update().filter(pk__in=pks).order_by('pk').values_list('pk', flat=True))
+
+
+def get_intervals(parents, kind):
+    """
+    Returns the indexed free space of `parents` of the same model as {pk: IntervalSet}.
+    Parents missing from the index are calculated and indexed.
+    """
+    parents = list(parents)
+    if not parents:
+        return {}
+    rows = FreeSpace.objects.filter(
+        parent_type=ContentType.objects.get_for_model(parents[0]),
+        parent_id__in=[parent.pk for parent in parents],
+        kind=kind
+    ).values_list('parent_id', 'intervals')
+    intervals = {parent_id: IntervalSet.from_ranges(ranges) for parent_id, ranges in rows}
+    missing = [parent for parent in parents if parent.pk not in intervals]
+    if missing:
+        with transaction.atomic():
+            # `update` of a child committed meanwhile waits for the lock and then
+            # finds the new rows
+            lock_parents(type(missing[0]), [parent.pk for parent in missing])
+            calculated = calculate(missing, kind)
+            save(missing, kind, calculated)
+        intervals.update(calculated)
+    return intervals
+
+
+def get_available(parents, kind):
+    """
+    Same as `get_intervals`, but returns the free space of IP addresses and
+    prefixes as {pk: IPSet}.
+    """
+    parents = list(parents)
+    intervals = get_intervals(parents, kind)
+    return {
+        parent.pk: netaddr.IPSet(ranges_to_cidrs(intervals[parent.pk], get_version(parent)))
+        for parent in parents
+    }
+
+
+def is_child(parent, instance):
+    """
+    Returns True if `instance` takes a part of the free space of `parent`.
+    """
+    if isinstance(instance, VLAN):
+        return instance.group_id == parent.pk
+    if isinstance(parent, IPRange):
+        return (
+            isinstance(instance, IPAddress) and instance.vrf_id == parent.vrf_id and
+            parent.start_address.ip <= instance.address.ip <= parent.end_address.ip
+        )
+    if not freespace.is_global_container(parent) and instance.vrf_id != parent.vrf_id:
+        return False
+    if isinstance(instance, IPAddress):
+        return instance.address.ip in parent.prefix
+    return instance.prefix in parent.prefix and instance.prefix.prefixlen > parent.prefix.prefixlen
+
+
+def has_changed(prechange, instance):
+    """
+    Returns True if the saved `instance` may change the free space of its parents
+    or of itself compared to the `prechange` object.
+    """
+    return any(
+        str(getattr(prechange, field)) != str(getattr(instance, field)) for field in TRACKED_FIELDS[type(instance)]
+    )
+
+
+def get_taken(instance):
+    """
+    Returns the range a child takes from the free space of its parents.
+    """
+    if isinstance(instance, IPAddress):
+        return instance.address.ip.value, instance.address.ip.value
+    if isinstance(instance, Prefix):
+        return instance.prefix.first, instance.prefix.last
+    return instance.vid, instance.vid
+
+
+def get_reserved(parent):
+    """
+    Returns addresses of the prefix that are never free.
+    """
+    all_ips = netaddr.IPSet(parent.prefix)
+    return IntervalSet.from_ipset(all_ips - freespace.exclude_reserved_ips(parent, all_ips), parent.family)
+
+
+def get_still_taken(parent, instance):
+    """
+    Returns the part of the range of the deleted `instance` that other children
+    still take from the free space of `parent`.
+    """
+    first, last = get_taken(instance)
+    if isinstance(instance, VLAN):
+        taken = VLAN.objects.filter(group_id=parent.pk, vid=instance.vid).exists()
+        return IntervalSet.from_ranges([(first, last)] if taken else [])
+    if isinstance(parent, IPRange):
+        taken = IPAddress.objects.filter(vrf_id=parent.vrf_id, address__net_host=str(instance.address.ip)).exists()
+        return IntervalSet.from_ranges([(first, last)] if taken else [])
+
+    scope = Q() if freespace.is_global_container(parent) else Q(vrf_id=parent.vrf_id)
+    if isinstance(instance, Prefix):
+        # Prefixes within the deleted one and the ones containing it
+        children = Prefix.objects.filter(scope, prefix__net_contained=str(parent.prefix)).filter(
+            Q(prefix__net_contained_or_equal=str(instance.prefix)) | Q(prefix__net_contains=str(instance.prefix))
+        ).values_list('prefix', flat=True)
+        return IntervalSet.from_ranges((child.first, child.last) for child in children).intersection(
+            IntervalSet([first], [last])
+        )
+    ip = instance.address.ip
+    taken = IPAddress.objects.filter(scope, address__net_host=str(ip)).exists() or any(
+        start_address.ip <= ip <= end_address.ip
+        for start_address, end_address in IPRange.objects.filter(
+            vrf_id=parent.vrf_id,
+            start_address__net_host_contained=str(parent.prefix),
+            end_address__net_host_contained=str(parent.prefix),
+            mark_utilized=True
+        ).values_list('start_address', 'end_address')
+    )
+    return IntervalSet.from_ranges([(first, last)] if taken else []).union(get_reserved(parent))
+
+
+def get_freed(parent, instance):
+    """
+    Returns the range the deleted `instance` returns to the free space of `parent`.
+    """
+    first, last = get_taken(instance)
+    return IntervalSet([first], [last]).difference(get_still_taken(parent, instance))
+
+
+def update(affected, instance=None, created=False, deleted=False):
+    """
+    Updates the indexed free space of the `affected` (model, pk) parents after
+    `instance` has been changed. A created IP address, prefix or VLAN is cut out
+    of the free space of its parents and a deleted one is returned to it, other
+    changes make the parents be calculated again. Parents that are not indexed
+    are skipped.
+    """
+    pks = defaultdict(set)
+    for model, pk in affected:
+        pks[model].add(pk)
+    for model, model_pks in pks.items():
+        with transaction.atomic():
+            _update_rows(model, model_pks, instance, created, deleted)
+
+
+def _update_rows(model, pks, instance, created, deleted):
+    # Parents are locked, so concurrent changes of children are applied one by one
+    # and a parent being indexed right now is updated once its row is saved
+    lock_parents(model, pks)
+    rows = FreeSpace.objects.select_for_update().filter(
+        parent_type=ContentType.objects.get_for_model(model),
+        parent_id__in=pks
+    )
+    parents = model.objects.in_bulk({row.parent_id for row in rows})
+    stale = defaultdict(list)
+    for row in rows:
+        parent = parents.get(row.parent_id)
+        if parent is None:
+            row.delete()
+        elif instance is not None and parent.pk == instance.pk and type(parent) is type(instance):
+            # The parent itself is changed
+            stale[row.kind].append(parent)
+        elif row.kind != CHILD_KINDS.get(type(instance)):
+            continue
+        elif not (created or deleted) or isinstance(instance, IPRange):
+            stale[row.kind].append(parent)
+        elif is_child(parent, instance):
+            intervals = IntervalSet.from_ranges(row.intervals)
+            if created:
+                intervals = intervals.difference(IntervalSet.from_ranges([get_taken(instance)]))
+            else:
+                intervals = intervals.union(get_freed(parent, instance))
+            row.intervals = list(intervals)
+            row.save(update_fields=('intervals', 'last_updated'))
+    for kind, stale_parents in stale.items():
+        save(stale_parents, kind, calculate(stale_parents, kind))
+
+
+def update_on_commit(affected, instance=None, created=False, deleted=False):
+    transaction.on_commit(partial(update, affected, instance, created, deleted))
+
+
+def update_on_save(instance, created, prechange_parents=(), changed=True):
+    if not (created or changed):
+        # Other fields do not affect the free space
+        return
+    affected = get_affected_parents(instance)
+    affected.update(prechange_parents)
+    update_on_commit(affected, instance, created)
+
+
+def update_on_delete(instance):
+    if isinstance(instance, tuple(KINDS)):
+        FreeSpace.objects.filter(
+            parent_type=ContentType.objects.get_for_model(instance),
+            parent_id=instance.pk
+        ).delete()
+    affected = get_affected_parents(instance)
+    affected.discard((type(instance), instance.pk))
+    update_on_commit(affected, instance, deleted=True)
+
+
+def iter_parents(model, batch_size=BATCH_SIZE):
+    """
+    Yields all objects of the parent model in batches.
+    """
+    pks = list(model.objects.order_by('pk').values_list('pk', flat=True))
+    for index in range(0, len(pks), batch_size):
+        yield list(model.objects.filter(pk__in=pks[index:index + batch_size]))
+
+
+def rebuild(models=None):
+    """
+    Calculates the free space of all parents again. Returns the number of indexed parents.
+    """
+    count = 0
+    for model in models or KINDS:
+        for parents in iter_parents(model):
+            for kind in KINDS[model]:
+                save(parents, kind, calculate(parents, kind))
+            count += len(parents)
+    return count
+
+
+def check(models=None):
+    """
+    Compares the index with the live calculation.
+    Yields (parent, kind, indexed, calculated) of every indexed parent that differs.
+    """
+    for model in models or KINDS:
+        for parents in iter_parents(model):
+            for kind in KINDS[model]:
+                rows = dict(FreeSpace.objects.filter(
+                    parent_type=ContentType.objects.get_for_model(model),
+                    parent_id__in=[parent.pk for parent in parents],
+                    kind=kind
+                ).values_list('parent_id', 'intervals'))
+                indexed = [parent for parent in parents if parent.pk in rows]
+                for parent_id, calculated in calculate(indexed, kind).items():
+                    stored = IntervalSet.from_ranges(rows[parent_id])
+                    if stored != calculated:
+                        yield model.objects.get(pk=parent_id), kind, stored, calculated
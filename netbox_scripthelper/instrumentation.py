@@ -0,0 +1,120 @@
+import logging
+import time
+from functools import lru_cache
+
+from django.db import connection
+from django.utils.module_loading import import_string
+
+from .config import get_setting
+
+logger = logging.getLogger('netbox_scripthelper.instrumentation')
+
+
+@lru_cache(maxsize=None)
+def _get_metrics_hook(path):
+    return import_string(path)
+
+
+class Stage:
+    """
+    Measures the time and the number of DB queries of a block of code.
+    """
+
+    def __init__(self, timings, name):
+        self.timings = timings
+        self.name = name
+        self.queries = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        self.queries += 1
+        return execute(sql, params, many, context)
+
+    def __enter__(self):
+        self.wrapper = connection.execute_wrapper(self)
+        self.wrapper.__enter__()
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        duration = time.perf_counter() - self.start
+        self.wrapper.__exit__(*exc_info)
+        self.timings.add(self.name, duration, self.queries)
+
+
+class NullStage:
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        pass
+
+
+NULL_STAGE = NullStage()
+
+
+class Timings:
+    """
+    Per-stage timings and DB query counts of a request or an event flush.
+    Stages with the same name are summed up. If instrumentation is disabled,
+    stages do nothing.
+    """
+
+    def __init__(self, name, enabled=None):
+        self.name = name
+        self.enabled = get_setting('instrumentation') if enabled is None else enabled
+        self.stages = {}
+        self.start = time.perf_counter()
+
+    def stage(self, name):
+        if not self.enabled:
+            return NULL_STAGE
+        return Stage(self, name)
+
+    def add(self, name, duration, queries):
+        total_duration, total_queries = self.stages.get(name, (0, 0))
+        self.stages[name] = (total_duration + duration, total_queries + queries)
+
+    def get_server_timing(self):
+        """
+        Returns the value of the Server-Timing header, durations are in milliseconds.
+        """
+        return ', '.join(
+            f'{name};desc="{queries} queries";dur={duration * 1000:.3f}'
+            for name, (duration, queries) in self.stages.items()
+        )
+
+    def finish(self, response=None):
+        """
+        Reports the timings to the log and the metrics hook and sets the
+        Server-Timing header of the response.
+        """
+        if not self.enabled:
+            return
+        self.stages['total'] = (time.perf_counter() - self.start, sum(q for _, q in self.stages.values()))
+        if response is not None:
+            response['Server-Timing'] = self.get_server_timing()
+        logger.info('%s: %s', self.name, ' '.join(
+            f'{name}={duration * 1000:.3f}ms/{queries}q' for name, (duration, queries) in self.stages.items()
+        ))
+        hook = get_setting('metrics_hook')
+        if hook:
+            try:
+                _get_metrics_hook(hook)(self.name, dict(self.stages))
+            except Exception:
+                logger.exception('metrics hook %s failed', hook)
+
+
+NULL_TIMINGS = Timings(None, enabled=False)
+
+
+def get_timings(request):
+    """
+    Returns the timings of the request, they are started by `start_timings`.
+    """
+    return getattr(request, '_scripthelper_timings', NULL_TIMINGS)
+
+
+def start_timings(request, name):
+    request._scripthelper_timings = Timings(name)
+    return request._scripthelper_timings
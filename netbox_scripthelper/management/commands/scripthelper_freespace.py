@@ -0,0 +1,33 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from netbox_scripthelper import index
+from netbox_scripthelper.utils import Interval
+
+
+def format_intervals(intervals):
+    return ', '.join(str(Interval(first, last)) for first, last in intervals)
+
+
+class Command(BaseCommand):
+    help = 'Rebuilds the free space index or checks it against the live calculation.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rebuild', action='store_true', help='Calculate the free space of all parents again')
+        parser.add_argument('--check', action='store_true', help='Compare indexed parents with the live calculation')
+
+    def handle(self, *args, **options):
+        if not options['rebuild'] and not options['check']:
+            raise CommandError('Specify --rebuild or --check.')
+        if options['rebuild']:
+            count = index.rebuild()
+            self.stdout.write(self.style.SUCCESS(f'Indexed the free space of {count} parents.'))
+        if options['check']:
+            mismatches = 0
+            for parent, kind, indexed, calculated in index.check():
+                mismatches += 1
+                self.stdout.write(f'{parent._meta.verbose_name} {parent} ({parent.pk}): {kind} differ')
+                self.stdout.write(f'  indexed:    {format_intervals(indexed)}')
+                self.stdout.write(f'  calculated: {format_intervals(calculated)}')
+            if mismatches:
+                raise CommandError(f'The free space of {mismatches} parents is out of date.')
+            self.stdout.write(self.style.SUCCESS('The free space index is consistent.'))
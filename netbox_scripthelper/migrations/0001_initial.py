@@ -0,0 +1,29 @@
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+        ('contenttypes', '0002_remove_content_type_name'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='FreeSpace',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False)),
+                ('parent_id', models.PositiveBigIntegerField()),
+                ('kind', models.CharField(choices=[('ips', 'Available IPs'), ('prefixes', 'Available prefixes'), ('vids', 'Available VIDs')], max_length=16)),
+                ('intervals', models.JSONField(default=list)),
+                ('last_updated', models.DateTimeField(auto_now=True)),
+                ('parent_type', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='contenttypes.contenttype')),
+            ],
+            options={
+                'ordering': ('parent_type', 'parent_id', 'kind'),
+                'constraints': [models.UniqueConstraint(fields=('parent_type', 'parent_id', 'kind'), name='netbox_scripthelper_freespace_unique_parent_kind')],
+            },
+        ),
+    ]
@@ -0,0 +1,36 @@
+from django.db import models
+
+
+class FreeSpace(models.Model):
+    """
+    Free space of a parent object stored as sorted [first, last] ranges of integers
+    (addresses or VIDs). Rows are kept up to date by signals, see `index`.
+    """
+    parent_type = models.ForeignKey(
+        to='contenttypes.ContentType',
+        on_delete=models.CASCADE,
+        related_name='+'
+    )
+    parent_id = models.PositiveBigIntegerField()
+    kind = models.CharField(
+        max_length=16,
+        choices=(
+            ('ips', 'Available IPs'),
+            ('prefixes', 'Available prefixes'),
+            ('vids', 'Available VIDs'),
+        )
+    )
+    intervals = models.JSONField(default=list)
+    last_updated = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        ordering = ('parent_type', 'parent_id', 'kind')
+        constraints = (
+            models.UniqueConstraint(
+                fields=('parent_type', 'parent_id', 'kind'),
+                name='netbox_scripthelper_freespace_unique_parent_kind'
+            ),
+        )
+
+    def __str__(self):
+        return f'{self.parent_type.model} {self.parent_id}: {self.kind}'
@@ -0,0 +1,85 @@
+"""
+Resolution of parent objects shared by the plugin views.
+
+Parents are fetched with the relations the views use and memoized on the
+HTTP request, so the bulk endpoint, its subrequests and form choices resolve
+every parent once. Object permissions of users can be kept for a short time
+(the `permission_cache_timeout` setting) instead of being loaded on every request.
+"""
+import threading
+import time
+
+from django.http import Http404
+
+from ipam.models import IPRange, Prefix
+from netbox.authentication import ObjectPermissionBackend
+
+from .config import get_setting
+
+# Relations of the parents used by the views
+PARENT_RELATED = {
+    Prefix: ('vrf',),
+    IPRange: ('vrf',),
+}
+
+# user pk => (expiration time, object permissions)
+_permissions = {}
+# Guards `_permissions` shared by threads of a worker
+_permissions_lock = threading.Lock()
+
+
+def prepare_user(user):
+    """
+    Reuses object permissions of the user loaded by a recent request.
+    """
+    timeout = get_setting('permission_cache_timeout')
+    if not timeout or not user.is_authenticated or user.is_superuser or hasattr(user, '_object_perm_cache'):
+        return
+    now = time.monotonic()
+    with _permissions_lock:
+        cached = _permissions.get(user.pk)
+    if cached is not None and cached[0] > now:
+        user._object_perm_cache = cached[1]
+        return
+    # The backend stores the permissions in user._object_perm_cache
+    permissions = ObjectPermissionBackend().get_all_permissions(user)
+    with _permissions_lock:
+        for pk in [pk for pk, (expires, _) in _permissions.items() if expires <= now]:
+            del _permissions[pk]
+        _permissions[user.pk] = (now + timeout, permissions)
+
+
+def _get_memo(request):
+    http_request = getattr(request, '_request', request)
+    return http_request.__dict__.setdefault('_scripthelper_parents', {})
+
+
+def resolve_parents(request, model, pks):
+    """
+    Returns {pk: parent} of the objects of `model` visible to the user of the
+    request. Objects that are not memoized yet are fetched with a single query.
+    """
+    memo = _get_memo(request)
+    pks = {int(pk) for pk in pks}
+    missing = {pk for pk in pks if (model, pk) not in memo}
+    if missing:
+        prepare_user(request.user)
+        queryset = model.objects.restrict(request.user).select_related(*PARENT_RELATED.get(model, ()))
+        found = {parent.pk: parent for parent in queryset.filter(pk__in=missing)}
+        for pk in missing:
+            memo[(model, pk)] = found.get(pk)
+    return {pk: memo[(model, pk)] for pk in pks if memo[(model, pk)] is not None}
+
+
+def resolve_parent(request, model, pk):
+    """
+    Returns the parent object or None if it does not exist or is not visible to the user.
+    """
+    return resolve_parents(request, model, [pk]).get(int(pk))
+
+
+def get_parent_or_404(request, model, pk):
+    parent = resolve_parent(request, model, pk)
+    if parent is None:
+        raise Http404(f'No {model._meta.object_name} matches the given query.')
+    return parent
@@ -0,0 +1,71 @@
+"""
+Short-lived reservations of allocated addresses and prefixes.
+
+Reservations of a parent object are kept in the Django cache as a list of
+(expiration time, CIDR). Callers that reserve objects are serialized by
+a lock of the parent, which is built on the atomic `cache.add`.
+"""
+import time
+import uuid
+from contextlib import contextmanager
+
+from django.core.cache import cache
+from netaddr import IPSet
+
+from .cache import CACHE_PREFIX
+
+# Time to wait for the lock of a parent, in seconds
+LOCK_WAIT = 5
+# The lock is released automatically if the holder dies
+LOCK_TIMEOUT = 10
+
+
+class ReservationLockError(Exception):
+    pass
+
+
+def _get_key(parent):
+    return f'{CACHE_PREFIX}:reservations:{parent._meta.label_lower}:{parent.pk}'
+
+
+@contextmanager
+def lock(parent):
+    """
+    Holds the reservation lock of the parent object.
+    Raises ReservationLockError if the lock can not be acquired in time.
+    """
+    key = f'{_get_key(parent)}:lock'
+    token = uuid.uuid4().hex
+    deadline = time.monotonic() + LOCK_WAIT
+    while not cache.add(key, token, LOCK_TIMEOUT):
+        if time.monotonic() > deadline:
+            raise ReservationLockError(f'Reservations of {parent} are locked')
+        time.sleep(0.05)
+    try:
+        yield
+    finally:
+        if cache.get(key) == token:
+            cache.delete(key)
+
+
+def _get_reservations(parent):
+    now = time.time()
+    return [(expires, cidr) for expires, cidr in cache.get(_get_key(parent), []) if expires > now]
+
+
+def get_reserved(parent):
+    """
+    Returns reserved addresses of the parent object as an IPSet.
+    """
+    return IPSet(cidr for _, cidr in _get_reservations(parent))
+
+
+def reserve(parent, objects, timeout):
+    """
+    Reserves addresses or prefixes for `timeout` seconds, the caller must hold the lock.
+    Returns the expiration time as a UNIX timestamp.
+    """
+    expires = time.time() + timeout
+    reservations = _get_reservations(parent) + [(expires, str(obj)) for obj in objects]
+    cache.set(_get_key(parent), reservations, timeout)
+    return expires
@@ -0,0 +1,76 @@
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_save
+
+from extras.models import EventRule, NotificationGroup, Script, Webhook
+from ipam.models import IPAddress, IPRange, Prefix, VLAN, VLANGroup
+
+from . import index
+from .cache import get_affected_parents, invalidate_parents
+from .config import get_setting
+from .events import event_rules_cache
+
+CACHED_MODELS = (IPAddress, IPRange, Prefix, VLAN, VLANGroup)
+# Event rules are cached along with their action objects
+EVENT_RULE_MODELS = (EventRule, NotificationGroup, Script, Webhook)
+
+
+def collect_prechange_parents(sender, instance, **kwargs):
+    """
+    Remember the parents of an object before it is moved to another place.
+    """
+    if not instance.pk or not (get_setting('cache_timeout') or get_setting('freespace_index')):
+        return
+    prechange = sender.objects.filter(pk=instance.pk).first()
+    if prechange is None:
+        return
+    instance._scripthelper_changed = index.has_changed(prechange, instance)
+    if instance._scripthelper_changed:
+        instance._scripthelper_parents = get_affected_parents(prechange)
+
+
+def invalidate_on_save(sender, instance, **kwargs):
+    if not get_setting('cache_timeout'):
+        return
+    parents = get_affected_parents(instance)
+    parents.update(getattr(instance, '_scripthelper_parents', set()))
+    invalidate_parents(parents)
+
+
+def invalidate_on_delete(sender, instance, **kwargs):
+    if not get_setting('cache_timeout'):
+        return
+    invalidate_parents(get_affected_parents(instance))
+
+
+def update_index_on_save(sender, instance, created, **kwargs):
+    if not get_setting('freespace_index'):
+        return
+    index.update_on_save(
+        instance,
+        created,
+        getattr(instance, '_scripthelper_parents', set()),
+        getattr(instance, '_scripthelper_changed', True)
+    )
+
+
+def update_index_on_delete(sender, instance, **kwargs):
+    if not get_setting('freespace_index'):
+        return
+    index.update_on_delete(instance)
+
+
+for model in CACHED_MODELS:
+    pre_save.connect(collect_prechange_parents, sender=model)
+    post_save.connect(invalidate_on_save, sender=model)
+    post_delete.connect(invalidate_on_delete, sender=model)
+    post_save.connect(update_index_on_save, sender=model)
+    post_delete.connect(update_index_on_delete, sender=model)
+
+
+def invalidate_event_rules(sender, **kwargs):
+    event_rules_cache.invalidate()
+
+
+for model in EVENT_RULE_MODELS:
+    post_save.connect(invalidate_event_rules, sender=model)
+    post_delete.connect(invalidate_event_rules, sender=model)
+m2m_changed.connect(invalidate_event_rules, sender=EventRule.object_types.through)
@@ -0,0 +1,69 @@
+import base64
+import json
+import zlib
+
+from django.core.serializers.json import DjangoJSONEncoder
+
+ENCODING = 'zlib+json'
+
+
+def get_changed_keys(prechange, postchange):
+    """
+    Returns sorted keys whose values differ between two snapshots.
+    """
+
+    prechange = prechange or {}
+    postchange = postchange or {}
+    return sorted(
+        key for key in prechange.keys() | postchange.keys()
+        if key not in prechange or key not in postchange or prechange[key] != postchange[key]
+    )
+
+
+def encode_snapshots(snapshots):
+    """
+    Returns a compact form of the snapshots: the changed keys and a zlib-compressed
+    JSON with the full postchange and only the changed values of prechange.
+    """
+
+    if not snapshots:
+        return snapshots
+    prechange = snapshots.get('prechange')
+    postchange = snapshots.get('postchange')
+    changed = get_changed_keys(prechange, postchange)
+    if prechange is not None and postchange is not None:
+        payload = {
+            'postchange': postchange,
+            'prechange': {key: prechange[key] for key in changed if key in prechange},
+            'added': [key for key in changed if key not in prechange],
+        }
+    else:
+        payload = {'postchange': postchange, 'prechange': prechange}
+    data = zlib.compress(json.dumps(payload, cls=DjangoJSONEncoder, separators=(',', ':')).encode())
+    return {
+        'encoding': ENCODING,
+        'changed': changed,
+        'data': base64.b64encode(data).decode(),
+    }
+
+
+def decode_snapshots(snapshots):
+    """
+    Rebuilds full prechange and postchange snapshots from the compact form.
+    Snapshots that are not encoded are returned as is.
+
+    Usage in a script:
+        snapshots = decode_snapshots(data['snapshots'])
+        prechange = snapshots['prechange']
+    """
+
+    if not snapshots or snapshots.get('encoding') != ENCODING:
+        return snapshots
+    payload = json.loads(zlib.decompress(base64.b64decode(snapshots['data'])))
+    prechange = payload['prechange']
+    postchange = payload['postchange']
+    if 'added' in payload:
+        diff = prechange
+        prechange = {key: value for key, value in postchange.items() if key not in payload['added']}
+        prechange.update(diff)
+    return {'prechange': prechange, 'postchange': postchange}
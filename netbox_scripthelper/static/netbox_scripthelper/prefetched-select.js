@@ -0,0 +1,11 @@
+// NetBox loads the first page of an API select when it is focused. Choices of
+// selects marked with data-prefetched are rendered with the form, so the preload
+// is turned off once the selects are initialized and the API is requested only
+// for search.
+window.addEventListener('load', function () {
+  document.querySelectorAll('select[data-prefetched]').forEach(function (select) {
+    if (select.tomselect) {
+      select.tomselect.settings.preload = false;
+    }
+  });
+});
@@ -0,0 +1,221 @@
+import unittest
+import unittest.mock as mock
+from utilities.testing.base import TestCase
+
+from django.contrib.auth import get_user_model
+from django.contrib.contenttypes.models import ContentType
+from django.test.utils import CaptureQueriesContext
+from django.db import connection
+
+from rq import Queue
+
+from core.events import OBJECT_CREATED
+from extras.choices import EventRuleActionChoices
+from extras.models import EventRule, Webhook
+from ipam.models import VLAN
+from netbox_scripthelper.snapshots import decode_snapshots
+from netbox_scripthelper.events import (
+    EventDispatcher, compile_conditions, event_rules_cache, handle_events, process_event_queue, process_event_rules
+)
+
+try:
+    import fakeredis
+except ImportError:
+    fakeredis = None
+
+
+class TestProcessEventQueue(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.object_type = ContentType.objects.get_for_model(VLAN)
+        webhook = Webhook.objects.create(name='webhook', payload_url='http://localhost/')
+        event_rule = EventRule.objects.create(
+            name='rule',
+            event_types=[OBJECT_CREATED],
+            action_type=EventRuleActionChoices.WEBHOOK,
+            action_object_type=ContentType.objects.get_for_model(Webhook),
+            action_object_id=webhook.pk,
+            action_data={'extra': 1},
+        )
+        event_rule.object_types.set([cls.object_type])
+        cls.event_rule = event_rule
+        get_user_model().objects.create(username='user1')
+        get_user_model().objects.create(username='user2')
+
+    def setUp(self):
+        event_rules_cache.clear()
+
+    def create_event(self, vid, username):
+        return {
+            'object_type': self.object_type,
+            'event_type': OBJECT_CREATED,
+            'data': {'id': vid, 'vid': vid},
+            'snapshots': {'prechange': None, 'postchange': {'vid': vid}},
+            'username': username,
+            'request_id': None,
+        }
+
+    @mock.patch('netbox_scripthelper.events.get_queue')
+    def test_webhooks(self, get_queue):
+        events = [self.create_event(vid, f'user{vid % 2 + 1}') for vid in range(1, 11)]
+        process_event_queue(events)
+
+        get_queue.assert_called_once()
+        rq_queue = get_queue.return_value
+        rq_queue.enqueue_many.assert_called_once()
+        jobs = rq_queue.enqueue_many.call_args.args[0]
+        self.assertEqual(len(jobs), 10)
+        self.assertListEqual([job.kwargs['data']['vid'] for job in jobs], list(range(1, 11)))
+        self.assertTrue(all(job.kwargs['data']['extra'] == 1 for job in jobs))
+        # action data of the rule must stay untouched
+        self.assertDictEqual(EventRule.objects.get(pk=self.event_rule.pk).action_data, {'extra': 1})
+
+    @mock.patch('netbox_scripthelper.events.get_queue')
+    def test_conditions(self, get_queue):
+        self.event_rule.conditions = {'attr': 'vid', 'value': 2, 'op': 'gt'}
+        self.event_rule.save()
+        process_event_queue([self.create_event(vid, 'user1') for vid in range(1, 6)])
+        jobs = get_queue.return_value.enqueue_many.call_args.args[0]
+        self.assertListEqual([job.kwargs['data']['vid'] for job in jobs], [3, 4, 5])
+
+    @mock.patch('netbox_scripthelper.events.get_queue')
+    def test_rules_cache(self, get_queue):
+        process_event_queue([self.create_event(1, 'user1')])
+        with self.assertNumQueries(0):
+            event_rules_cache.refresh()
+            event_rules_cache.get(OBJECT_CREATED, self.object_type)
+
+        version = event_rules_cache.version
+        with self.captureOnCommitCallbacks(execute=True):
+            self.event_rule.enabled = False
+            self.event_rule.save()
+        event_rules_cache.refresh()
+        self.assertNotEqual(event_rules_cache.version, version)
+        self.assertListEqual(event_rules_cache.get(OBJECT_CREATED, self.object_type), [])
+
+    @mock.patch('netbox_scripthelper.events.get_setting', side_effect=lambda name: {
+        'async_events': True, 'events_queue': 'default', 'coalesce_script_events': False,
+        'compact_snapshots': False, 'instrumentation': False,
+    }[name])
+    @mock.patch('netbox_scripthelper.events.get_queue')
+    def test_async(self, get_queue, get_setting):
+        events = [self.create_event(vid, 'user1') for vid in range(1, 4)]
+        process_event_queue(iter(events))
+
+        get_queue.assert_called_once_with('default')
+        rq_queue = get_queue.return_value
+        rq_queue.enqueue.assert_called_once()
+        self.assertEqual(rq_queue.enqueue.call_args.args[0], 'netbox_scripthelper.events.handle_events')
+        self.assertListEqual(rq_queue.enqueue.call_args.args[1], events)
+        rq_queue.enqueue_many.assert_not_called()
+
+        # the worker side
+        handle_events(rq_queue.enqueue.call_args.args[1])
+        jobs = rq_queue.enqueue_many.call_args.args[0]
+        self.assertEqual(len(jobs), 3)
+
+    @unittest.skipUnless(fakeredis, 'fakeredis is not installed')
+    def test_rq_queue(self):
+        rq_queue = Queue('default', connection=fakeredis.FakeStrictRedis())
+        with mock.patch('netbox_scripthelper.events.get_queue', return_value=rq_queue):
+            process_event_queue([self.create_event(vid, 'user1') for vid in range(1, 4)])
+
+        jobs = rq_queue.jobs
+        self.assertEqual(len(jobs), 3)
+        self.assertTrue(all(job.func_name == 'extras.webhooks.send_webhook' for job in jobs))
+        self.assertListEqual([job.kwargs['data']['vid'] for job in jobs], [1, 2, 3])
+        self.assertEqual(jobs[0].kwargs['event_rule'], self.event_rule)
+        self.assertEqual(jobs[0].kwargs['model_name'], 'vlan')
+        self.assertEqual(jobs[0].kwargs['event_type'], OBJECT_CREATED)
+        self.assertEqual(jobs[0].kwargs['username'], 'user1')
+
+    @unittest.skipUnless(fakeredis, 'fakeredis is not installed')
+    @mock.patch('netbox_scripthelper.events.get_setting', side_effect=lambda name: {
+        'async_events': True, 'events_queue': 'default', 'coalesce_script_events': False,
+        'compact_snapshots': False, 'instrumentation': False,
+    }[name])
+    def test_async_rq_queue(self, get_setting):
+        rq_queue = Queue('default', connection=fakeredis.FakeStrictRedis())
+        with mock.patch('netbox_scripthelper.events.get_queue', return_value=rq_queue):
+            process_event_queue([self.create_event(vid, 'user1') for vid in range(1, 4)])
+            jobs = rq_queue.jobs
+            self.assertEqual(len(jobs), 1)
+            self.assertEqual(jobs[0].func_name, 'netbox_scripthelper.events.handle_events')
+            rq_queue.remove(jobs[0])
+
+            # the worker side
+            jobs[0].perform()
+
+        jobs = rq_queue.jobs
+        self.assertEqual(len(jobs), 3)
+        self.assertTrue(all(job.func_name == 'extras.webhooks.send_webhook' for job in jobs))
+        self.assertListEqual([job.kwargs['data']['vid'] for job in jobs], [1, 2, 3])
+
+    def test_compile_conditions(self):
+        self.assertTrue(compile_conditions(None)({'vid': 1}))
+        condition = compile_conditions({'attr': 'vid', 'value': 2, 'op': 'gt'})
+        self.assertFalse(condition({'vid': 1}))
+        self.assertTrue(condition({'vid': 3}))
+
+    def test_resolve_users(self):
+        dispatcher = EventDispatcher()
+        with CaptureQueriesContext(connection) as queries:
+            dispatcher.resolve_users(['user1', 'user2', None])
+            dispatcher.get_user('user1')
+            dispatcher.get_user('user2')
+        self.assertEqual(len(queries), 1)
+        self.assertIsNone(dispatcher.get_user(None))
+        with self.assertRaises(get_user_model().DoesNotExist):
+            dispatcher.get_user('unknown')
+
+
+class TestCoalesceScriptEvents(TestCase):
+
+    def create_rule(self, pk, action_data=None):
+        event_rule = mock.MagicMock(pk=pk, action_type=EventRuleActionChoices.SCRIPT, action_data=action_data,
+                                    conditions=None)
+        event_rule.eval_conditions.return_value = True
+        event_rule.action_object.python_class.return_value.name = f'script{pk}'
+        return event_rule
+
+    def process(self, event_rules, dispatcher):
+        object_type = ContentType.objects.get_for_model(VLAN)
+        for vid in range(1, 4):
+            process_event_rules(
+                event_rules, object_type, OBJECT_CREATED, {'id': vid},
+                snapshots={'postchange': {'vid': vid}}, dispatcher=dispatcher
+            )
+        dispatcher.flush()
+
+    @mock.patch('extras.jobs.ScriptJob.enqueue')
+    def test_coalesce(self, enqueue):
+        event_rules = [self.create_rule(1, {'coalesce_events': True}), self.create_rule(2)]
+        self.process(event_rules, EventDispatcher())
+
+        # 1 coalesced job for the first rule and 3 jobs for the second one
+        self.assertEqual(enqueue.call_count, 4)
+        coalesced = [c for c in enqueue.call_args_list if 'events' in c.kwargs['data']]
+        self.assertEqual(len(coalesced), 1)
+        events = coalesced[0].kwargs['data']['events']
+        self.assertListEqual([e['snapshots']['postchange']['vid'] for e in events], [1, 2, 3])
+        self.assertTrue(all(e['event'] == OBJECT_CREATED for e in events))
+        # The control key is not passed to the script
+        self.assertNotIn('coalesce_events', enqueue.call_args.kwargs['data'])
+        self.assertTrue(all('coalesce_events' not in e for e in events))
+
+    @mock.patch('extras.jobs.ScriptJob.enqueue')
+    def test_compact_snapshots(self, enqueue):
+        dispatcher = EventDispatcher()
+        dispatcher.compact_snapshots = True
+        self.process([self.create_rule(1)], dispatcher)
+        snapshots = enqueue.call_args.kwargs['data']['snapshots']
+        self.assertListEqual(snapshots['changed'], ['vid'])
+        self.assertDictEqual(decode_snapshots(snapshots), {'prechange': None, 'postchange': {'vid': 3}})
+
+    @mock.patch('extras.jobs.ScriptJob.enqueue')
+    def test_setting(self, enqueue):
+        event_rules = [self.create_rule(1), self.create_rule(2, {'coalesce_events': False})]
+        with mock.patch('netbox_scripthelper.events.get_setting', return_value=True):
+            self.process(event_rules, EventDispatcher())
+        self.assertEqual(enqueue.call_count, 4)
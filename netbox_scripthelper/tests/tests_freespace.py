@@ -0,0 +1,90 @@
+from utilities.testing.base import TestCase
+
+from django.test import override_settings
+
+from ipam.choices import PrefixStatusChoices
+from ipam.models import IPAddress, IPRange, Prefix, VRF
+from netbox_scripthelper import freespace
+
+
+class TestDatabaseEngine(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        vrf = VRF.objects.create(name='vrf1')
+        cls.prefixes = [
+            Prefix.objects.create(prefix='10.0.0.0/24'),
+            Prefix.objects.create(prefix='10.0.0.0/16', status=PrefixStatusChoices.STATUS_CONTAINER),
+            Prefix.objects.create(prefix='10.1.0.0/24', vrf=vrf),
+            Prefix.objects.create(prefix='10.2.0.0/30'),
+            Prefix.objects.create(prefix='10.3.0.0/24', is_pool=True),
+            Prefix.objects.create(prefix='2001:db8::/64'),
+            Prefix.objects.create(prefix='0.0.0.0/0', status=PrefixStatusChoices.STATUS_CONTAINER),
+        ]
+        Prefix.objects.create(prefix='10.0.0.0/26')
+        Prefix.objects.create(prefix='10.0.0.32/27')
+        Prefix.objects.create(prefix='10.0.0.128/30')
+        Prefix.objects.create(prefix='10.0.0.132/30')
+        Prefix.objects.create(prefix='10.1.0.0/25', vrf=vrf)
+        Prefix.objects.create(prefix='10.1.0.128/25')
+        Prefix.objects.create(prefix='255.255.255.0/24')
+        IPAddress.objects.bulk_create([
+            IPAddress(address='10.0.0.1/24'),
+            IPAddress(address='10.0.0.2/24'),
+            IPAddress(address='10.0.0.2/25'),
+            IPAddress(address='10.0.0.100/24'),
+            IPAddress(address='10.0.1.1/16', vrf=vrf),
+            IPAddress(address='10.1.0.5/24', vrf=vrf),
+            IPAddress(address='10.1.0.6/24'),
+            IPAddress(address='10.2.0.1/30'),
+            IPAddress(address='10.2.0.2/30'),
+            IPAddress(address='10.3.0.0/24'),
+            IPAddress(address='10.3.0.255/24'),
+            IPAddress(address='2001:db8::1/64'),
+            IPAddress(address='2001:db8::ffff:ffff:ffff:ffff/64'),
+            IPAddress(address='255.255.255.255/32'),
+        ])
+        cls.ipranges = [
+            IPRange.objects.create(start_address='10.0.0.10/24', end_address='10.0.0.20/24', mark_utilized=True),
+            IPRange.objects.create(start_address='10.0.0.15/24', end_address='10.0.0.30/24'),
+            IPRange.objects.create(start_address='10.1.0.1/24', end_address='10.1.0.10/24', vrf=vrf),
+            IPRange.objects.create(start_address='2001:db8::/64', end_address='2001:db8::10/64'),
+        ]
+
+    def test(self):
+        cases = [
+            ('prefix_ips', freespace.get_prefixes_available_ips, self.prefixes),
+            ('prefix_prefixes', freespace.get_prefixes_available_prefixes, self.prefixes),
+            ('iprange_ips', freespace.get_ipranges_available_ips, self.ipranges),
+        ]
+        for name, get_available, parents in cases:
+            with override_settings(PLUGINS_CONFIG={'netbox_scripthelper': {'freespace_engine': 'python'}}):
+                expected = get_available(parents)
+            with override_settings(PLUGINS_CONFIG={'netbox_scripthelper': {'freespace_engine': 'database'}}):
+                got = get_available(parents)
+            for parent in parents:
+                self.assertEqual(got[parent.pk], expected[parent.pk], f'{name}: {parent}')
+
+    @override_settings(PLUGINS_CONFIG={'netbox_scripthelper': {'freespace_engine': 'database'}})
+    def test_queries(self):
+        # All the parents of a model are calculated with a single query
+        for get_available, parents in [
+            (freespace.get_prefixes_available_ips, self.prefixes),
+            (freespace.get_prefixes_available_prefixes, self.prefixes),
+            (freespace.get_ipranges_available_ips, self.ipranges),
+        ]:
+            with self.assertNumQueries(1):
+                get_available(parents)
+
+    def test_gaps(self):
+        prefix = self.prefixes[0]
+        # A parent without children
+        empty = Prefix(pk=0, prefix='192.168.0.0/24')
+        rows = [(p.pk, None, False, str(p.prefix)) for p in (prefix, empty)]
+        bounds = {p.pk: (p.prefix.first, p.prefix.last) for p in (prefix, empty)}
+        gaps = freespace.get_gaps(freespace.PREFIX_IPS_SQL, freespace.PREFIX_COLUMNS, rows, bounds)
+        first, last = bounds[prefix.pk]
+        self.assertListEqual(gaps[prefix.pk], [
+            (first, first), (first + 3, first + 9), (first + 21, first + 99), (first + 101, last)
+        ])
+        self.assertListEqual(gaps[0], [bounds[0]])
@@ -0,0 +1,158 @@
+from io import StringIO
+import unittest.mock as mock
+
+from netaddr import IPNetwork
+
+from utilities.testing.base import TestCase
+
+from django.core.management import CommandError, call_command
+from django.db.backends.postgresql.psycopg_any import NumericRange
+from django.test import override_settings
+
+from ipam.models import IPAddress, IPRange, Prefix, VLAN, VLANGroup
+from netbox_scripthelper import freespace, index
+from netbox_scripthelper.models import FreeSpace
+from netbox_scripthelper.utils import IntervalSet
+
+
+@override_settings(PLUGINS_CONFIG={'netbox_scripthelper': {'freespace_index': True}})
+class TestFreeSpaceIndex(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.prefix = Prefix.objects.create(prefix='10.0.0.0/24')
+        Prefix.objects.create(prefix='10.0.0.0/26')
+        IPAddress.objects.create(address='10.0.0.10/24')
+        cls.iprange = IPRange.objects.create(start_address='10.0.0.100/24', end_address='10.0.0.110/24')
+        cls.vlangroup = VLANGroup.objects.create(name='vg', slug='vg', vid_ranges=[NumericRange(10, 20, bounds='[]')])
+        VLAN.objects.create(name='vlan12', vid=12, group=cls.vlangroup)
+
+    def assertConsistent(self):
+        self.assertListEqual(list(index.check()), [])
+
+    def test_get(self):
+        self.assertEqual(
+            freespace.get_available_ips(self.prefix),
+            freespace.calculate_prefixes_available_ips([self.prefix])[self.prefix.pk]
+        )
+        self.assertEqual(
+            freespace.get_available_prefixes(self.prefix),
+            freespace.calculate_prefixes_available_prefixes([self.prefix])[self.prefix.pk]
+        )
+        self.assertEqual(
+            freespace.get_available_ips(self.iprange),
+            freespace.calculate_ipranges_available_ips([self.iprange])[self.iprange.pk]
+        )
+        self.assertEqual(
+            freespace.get_vlangroups_available_vids([self.vlangroup])[self.vlangroup.pk],
+            IntervalSet([10, 13], [11, 20])
+        )
+        self.assertEqual(FreeSpace.objects.count(), 4)
+        splitter = freespace.get_prefix_splitter(self.prefix)
+        self.assertListEqual([str(s) for s in splitter.iter_subnets(26)], ['10.0.0.64/26', '10.0.0.128/26', '10.0.0.192/26'])
+        self.assertConsistent()
+
+    def test_create(self):
+        freespace.get_available_ips(self.prefix)
+        freespace.get_available_ips(self.iprange)
+        freespace.get_available_prefixes(self.prefix)
+        freespace.get_vlangroups_available_vids([self.vlangroup])
+        with self.captureOnCommitCallbacks(execute=True):
+            IPAddress.objects.create(address='10.0.0.105/24')
+            IPAddress.objects.create(address='10.0.0.20/25')
+            Prefix.objects.create(prefix='10.0.0.128/25')
+            VLAN.objects.create(name='vlan15', vid=15, group=self.vlangroup)
+            IPRange.objects.create(start_address='10.0.0.200/24', end_address='10.0.0.210/24', mark_utilized=True)
+        self.assertNotIn('10.0.0.105', freespace.get_available_ips(self.iprange))
+        self.assertNotIn('10.0.0.20', freespace.get_available_ips(self.prefix))
+        self.assertNotIn('10.0.0.200', freespace.get_available_ips(self.prefix))
+        self.assertEqual(
+            freespace.get_vlangroups_available_vids([self.vlangroup])[self.vlangroup.pk],
+            IntervalSet([10, 13, 16], [11, 14, 20])
+        )
+        self.assertConsistent()
+
+    def test_change(self):
+        freespace.get_available_ips(self.prefix)
+        freespace.get_available_prefixes(self.prefix)
+        freespace.get_vlangroups_available_vids([self.vlangroup])
+        with self.captureOnCommitCallbacks(execute=True):
+            IPAddress.objects.get(address='10.0.0.10/24').delete()
+            child = Prefix.objects.get(prefix='10.0.0.0/26')
+            child.prefix = IPNetwork('10.0.0.64/26')
+            child.save()
+            VLAN.objects.get(vid=12).delete()
+            self.vlangroup.vid_ranges = [NumericRange(10, 30, bounds='[]')]
+            self.vlangroup.save()
+        self.assertIn('10.0.0.10', freespace.get_available_ips(self.prefix))
+        self.assertIn('10.0.0.0/26', freespace.get_available_prefixes(self.prefix))
+        self.assertEqual(
+            freespace.get_vlangroups_available_vids([self.vlangroup])[self.vlangroup.pk],
+            IntervalSet([10], [30])
+        )
+        self.assertConsistent()
+
+    def test_unchanged(self):
+        freespace.get_available_ips(self.prefix)
+        freespace.get_available_ips(self.iprange)
+        ip = IPAddress.objects.get(address='10.0.0.10/24')
+        ip.description = 'changed'
+        with self.captureOnCommitCallbacks() as callbacks:
+            ip.save()
+        # Nothing is calculated or updated
+        with self.assertNumQueries(0):
+            for callback in callbacks:
+                callback()
+        self.assertFalse(index.has_changed(IPAddress.objects.get(pk=ip.pk), ip))
+        ip.address = IPNetwork('10.0.0.11/24')
+        self.assertTrue(index.has_changed(IPAddress.objects.get(pk=ip.pk), ip))
+        self.assertConsistent()
+
+    def test_delete(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            IPAddress.objects.create(address='10.0.0.10/25')
+            IPAddress.objects.create(address='10.0.0.105/24')
+            IPAddress.objects.create(address='10.0.0.255/24')
+            Prefix.objects.create(prefix='10.0.0.0/28')
+        freespace.get_available_ips(self.prefix)
+        freespace.get_available_ips(self.iprange)
+        freespace.get_available_prefixes(self.prefix)
+        freespace.get_vlangroups_available_vids([self.vlangroup])
+        with mock.patch.object(index, 'calculate', wraps=index.calculate) as calculate:
+            with self.captureOnCommitCallbacks(execute=True):
+                IPAddress.objects.get(address='10.0.0.10/24').delete()
+                IPAddress.objects.get(address='10.0.0.105/24').delete()
+                IPAddress.objects.get(address='10.0.0.255/24').delete()
+                Prefix.objects.get(prefix='10.0.0.0/26').delete()
+                VLAN.objects.get(vid=12).delete()
+        # The free space is updated without calculating the parents again
+        calculate.assert_not_called()
+        # 10.0.0.10/25 still takes the address, the broadcast address is never free
+        self.assertNotIn('10.0.0.10', freespace.get_available_ips(self.prefix))
+        self.assertNotIn('10.0.0.255', freespace.get_available_ips(self.prefix))
+        self.assertIn('10.0.0.105', freespace.get_available_ips(self.iprange))
+        self.assertNotIn('10.0.0.0/28', freespace.get_available_prefixes(self.prefix))
+        self.assertIn('10.0.0.16/28', freespace.get_available_prefixes(self.prefix))
+        self.assertEqual(
+            freespace.get_vlangroups_available_vids([self.vlangroup])[self.vlangroup.pk],
+            IntervalSet([10], [20])
+        )
+        self.assertConsistent()
+
+    def test_delete_parent(self):
+        freespace.get_available_ips(self.prefix)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.prefix.delete()
+        self.assertFalse(FreeSpace.objects.exists())
+
+    def test_command(self):
+        freespace.get_available_ips(self.prefix)
+        FreeSpace.objects.update(intervals=[])
+        with self.assertRaises(CommandError):
+            call_command('scripthelper_freespace', '--check', stdout=StringIO())
+        out = StringIO()
+        call_command('scripthelper_freespace', '--rebuild', '--check', stdout=out)
+        self.assertIn('Indexed the free space of 4 parents.', out.getvalue())
+        self.assertIn('consistent', out.getvalue())
+        self.assertEqual(FreeSpace.objects.count(), 6)
+        self.assertConsistent()
@@ -0,0 +1,66 @@
+import unittest.mock as mock
+from utilities.testing.base import TestCase
+
+from django.db.backends.postgresql.psycopg_any import NumericRange
+from django.test import override_settings
+from django.urls import reverse
+from rest_framework import status
+
+from ipam.models import VLANGroup
+from netbox_scripthelper.instrumentation import NULL_STAGE, Timings
+
+metrics = mock.MagicMock()
+
+
+class TestTimings(TestCase):
+
+    def test_stages(self):
+        timings = Timings('test', enabled=True)
+        with timings.stage('query'):
+            list(VLANGroup.objects.all())
+            list(VLANGroup.objects.all())
+        with timings.stage('query'):
+            list(VLANGroup.objects.all())
+        with timings.stage('python'):
+            pass
+        self.assertEqual(timings.stages['query'][1], 3)
+        self.assertEqual(timings.stages['python'][1], 0)
+        header = timings.get_server_timing()
+        self.assertRegex(header, r'^query;desc="3 queries";dur=[\d.]+, python;desc="0 queries";dur=[\d.]+$')
+
+    def test_disabled(self):
+        timings = Timings('test', enabled=False)
+        self.assertIs(timings.stage('query'), NULL_STAGE)
+        timings.finish()
+        self.assertDictEqual(timings.stages, {})
+
+
+@override_settings(EXEMPT_VIEW_PERMISSIONS=['*'], LOGIN_REQUIRED=False)
+class TestServerTiming(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.vlangroup = VLANGroup.objects.create(
+            name='TestVG1', slug='testvg1', vid_ranges=[NumericRange(10, 15, bounds='[]')]
+        )
+
+    def test_disabled(self):
+        url = reverse('plugins-api:netbox_scripthelper-api:vlangroup-available-vlans', kwargs={'pk': self.vlangroup.pk})
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertNotIn('Server-Timing', response)
+
+    @override_settings(PLUGINS_CONFIG={'netbox_scripthelper': {
+        'instrumentation': True,
+        'metrics_hook': 'netbox_scripthelper.tests.tests_instrumentation.metrics',
+    }})
+    def test_enabled(self):
+        metrics.reset_mock()
+        url = reverse('plugins-api:netbox_scripthelper-api:vlangroup-available-vlans', kwargs={'pk': self.vlangroup.pk})
+        with self.assertLogs('netbox_scripthelper.instrumentation', 'INFO'):
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        stages = [item.split(';')[0] for item in response['Server-Timing'].split(', ')]
+        self.assertListEqual(stages, ['parent', 'etag', 'freespace', 'search', 'serialize', 'total'])
+        metrics.assert_called_once()
+        self.assertEqual(metrics.call_args.args[0], 'AvailableVLANsView')
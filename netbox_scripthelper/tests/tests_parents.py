@@ -0,0 +1,94 @@
+import threading
+import unittest.mock as mock
+
+from utilities.testing.base import TestCase
+
+from django.contrib.auth import get_user_model
+from django.contrib.contenttypes.models import ContentType
+from django.http import Http404
+from django.test import RequestFactory, override_settings
+
+from ipam.models import Prefix, VRF
+from netbox_scripthelper import parents
+from netbox_scripthelper.parents import get_parent_or_404, prepare_user, resolve_parent, resolve_parents
+from users.models import ObjectPermission
+
+
+class TestResolveParents(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        vrf = VRF.objects.create(name='vrf1')
+        cls.prefixes = [
+            Prefix.objects.create(prefix='10.0.0.0/24', vrf=vrf),
+            Prefix.objects.create(prefix='10.0.1.0/24', vrf=vrf),
+            Prefix.objects.create(prefix='10.0.2.0/24'),
+        ]
+
+    def setUp(self):
+        super().setUp()
+        parents._permissions.clear()
+        permission = ObjectPermission.objects.create(
+            name='view prefixes', actions=['view'], constraints={'prefix__net_contained_or_equal': '10.0.0.0/23'}
+        )
+        permission.object_types.add(ContentType.objects.get_for_model(Prefix))
+        permission.users.add(self.user)
+
+    def create_request(self):
+        request = RequestFactory().get('/')
+        request.user = get_user_model().objects.get(pk=self.user.pk)
+        return request
+
+    def test_memo(self):
+        request = self.create_request()
+        pks = [prefix.pk for prefix in self.prefixes]
+        found = resolve_parents(request, Prefix, pks)
+        self.assertSetEqual(set(found), set(pks[:2]))
+        with self.assertNumQueries(0):
+            self.assertEqual(resolve_parent(request, Prefix, pks[0]).vrf.name, 'vrf1')
+            self.assertIsNone(resolve_parent(request, Prefix, pks[2]))
+            with self.assertRaises(Http404):
+                get_parent_or_404(request, Prefix, pks[2])
+
+    @override_settings(PLUGINS_CONFIG={'netbox_scripthelper': {'permission_cache_timeout': 60}})
+    def test_permission_cache(self):
+        user = self.create_request().user
+        prepare_user(user)
+        self.assertIn(self.user.pk, parents._permissions)
+
+        # permissions of another request are reused
+        request = self.create_request()
+        with self.assertNumQueries(1):
+            found = resolve_parents(request, Prefix, [prefix.pk for prefix in self.prefixes])
+        self.assertEqual(len(found), 2)
+
+    @override_settings(PLUGINS_CONFIG={'netbox_scripthelper': {'permission_cache_timeout': 60}})
+    def test_permission_cache_threads(self):
+        users = [self.create_request().user for _ in range(8)]
+        for index, user in enumerate(users):
+            user.pk = self.user.pk + index
+        # expired entries are removed while other threads add theirs
+        parents._permissions.update({-pk: (0, {}) for pk in range(1000)})
+        errors = []
+
+        def prepare(user):
+            try:
+                for _ in range(50):
+                    if hasattr(user, '_object_perm_cache'):
+                        del user._object_perm_cache
+                    prepare_user(user)
+            except Exception as e:
+                errors.append(e)
+
+        with mock.patch.object(parents.ObjectPermissionBackend, 'get_all_permissions', return_value={}):
+            threads = [threading.Thread(target=prepare, args=(user,)) for user in users]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        self.assertListEqual(errors, [])
+        self.assertSetEqual(set(parents._permissions), {user.pk for user in users})
+
+    def test_permission_cache_disabled(self):
+        prepare_user(self.create_request().user)
+        self.assertDictEqual(parents._permissions, {})
@@ -0,0 +1,34 @@
+import unittest
+
+from netbox_scripthelper.snapshots import decode_snapshots, encode_snapshots, get_changed_keys
+
+
+class TestSnapshots(unittest.TestCase):
+
+    def test_changed_keys(self):
+        cases = [
+            ("created", None, {'a': 1}, ['a']),
+            ("deleted", {'a': 1}, None, ['a']),
+            ("updated", {'a': 1, 'b': 2, 'c': 3}, {'a': 1, 'b': 5, 'd': 4}, ['b', 'c', 'd']),
+            ("not changed", {'a': [1]}, {'a': [1]}, []),
+        ]
+        for case in cases:
+            self.assertListEqual(get_changed_keys(case[1], case[2]), case[-1], case[0])
+
+    def test_encode(self):
+        cases = [
+            ("created", {'prechange': None, 'postchange': {'id': 1, 'tags': ['a']}}),
+            ("deleted", {'prechange': {'id': 1, 'custom_fields': {'x': None}}, 'postchange': None}),
+            ("updated", {'prechange': {'id': 1, 'name': 'a', 'old': 1}, 'postchange': {'id': 1, 'name': 'b', 'new': 2}}),
+            ("not changed", {'prechange': {'id': 1}, 'postchange': {'id': 1}}),
+        ]
+        for case in cases:
+            encoded = encode_snapshots(case[1])
+            self.assertEqual(encoded['encoding'], 'zlib+json', case[0])
+            self.assertDictEqual(decode_snapshots(encoded), case[1], case[0])
+
+    def test_plain(self):
+        snapshots = {'prechange': None, 'postchange': {'id': 1}}
+        self.assertIs(decode_snapshots(snapshots), snapshots)
+        self.assertIsNone(encode_snapshots(None))
+        self.assertIsNone(decode_snapshots(None))
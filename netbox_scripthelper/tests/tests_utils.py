@@ -1,6 +1,10 @@
 import unittest
 from netaddr import IPSet, IPNetwork, IPAddress, IPRange
-from netbox_scripthelper.utils import get_available_ips_list, IPSplitter
+from itertools import islice
+from netbox_scripthelper.utils import (
+    allocate, get_available_ips_list, get_number_ranges, iter_available_ips, plan_subnets, IntervalSet, IPSplitter,
+    SubnetPlanner
+)
 
 
 class TestGetAvailableIPList(unittest.TestCase):
@@ -24,6 +28,53 @@ class TestGetAvailableIPList(unittest.TestCase):
             raised = True
         self.assertTrue(raised)
 
+    def test_ipv6(self):
+        ipset = IPSet([IPNetwork('2001:db8::/64')]) - IPSet([IPAddress('2001:db8::5')])
+        iplist = get_available_ips_list(ipset, '2001:db8::3/64', 3)
+        self.assertListEqual(iplist, [IPAddress('2001:db8::3'), IPAddress('2001:db8::4'), IPAddress('2001:db8::6')])
+
+
+class TestIntervalSet(unittest.TestCase):
+
+    def test_operations(self):
+        a = IntervalSet.from_ranges([(1, 5), (10, 20), (6, 7)])
+        b = IntervalSet.from_ranges([(4, 12), (30, 40)])
+        self.assertListEqual(list(a), [(1, 7), (10, 20)])
+        self.assertListEqual(list(a.union(b)), [(1, 20), (30, 40)])
+        self.assertListEqual(list(a.intersection(b)), [(4, 7), (10, 12)])
+        self.assertListEqual(list(a.difference(b)), [(1, 3), (13, 20)])
+        self.assertListEqual(list(a.after(4)), [(5, 7), (10, 20)])
+        self.assertEqual(a.size, 18)
+
+    def test_lookups(self):
+        a = IntervalSet.from_ranges([(1, 5), (10, 20)])
+        self.assertEqual(a.nth(5), 10)
+        self.assertListEqual(a.nth([0, 4, 5, 15]), [1, 5, 10, 20])
+        self.assertListEqual(a.first(3, 4), [4, 5, 10])
+        self.assertEqual(a.rank(12), 7)
+        with self.assertRaises(IndexError):
+            a.nth(16)
+        with self.assertRaises(IndexError):
+            a.first(3, 19)
+
+    def test_runs(self):
+        a = IntervalSet.from_ranges([(1, 5), (10, 20), (30, 32)])
+        self.assertListEqual(list(IntervalSet.from_ranges([(1, 3), (7, 8)]).iter_values()), [1, 2, 3, 7, 8])
+        self.assertEqual(a.find_run(5), 1)
+        self.assertEqual(a.find_run(6), 10)
+        self.assertEqual(a.find_run(3, 4), 10)
+        self.assertEqual(a.find_run(3, 19), 30)
+        self.assertIsNone(a.find_run(12))
+        self.assertIsNone(IntervalSet().find_run(1))
+        self.assertIsNone(a.find_run(10 ** 19))
+
+    def test_ipv6(self):
+        a = IntervalSet.from_ipset(IPSet([IPNetwork('2001:db8::/32')]) - IPSet([IPNetwork('2001:db8::/64')]), 6)
+        base = IPNetwork('2001:db8::/32').first
+        self.assertEqual(a.size, 2 ** 96 - 2 ** 64)
+        self.assertListEqual(a.first(2), [base + 2 ** 64, base + 2 ** 64 + 1])
+        self.assertEqual(a.nth(a.size - 1), IPNetwork('2001:db8::/32').last)
+
 
 class TestIPSplitter(unittest.TestCase):
 
@@ -31,9 +82,173 @@ class TestIPSplitter(unittest.TestCase):
         cases = [
             ("limit", IPSet([IPNetwork('192.168.1.0/24'),]), (30, 2), [IPNetwork('192.168.1.0/30'), IPNetwork('192.168.1.4/30')]),
             ("no limit", IPSet([IPNetwork('192.168.1.0/29'),]), (30,), [IPNetwork('192.168.1.0/30'), IPNetwork('192.168.1.4/30')]),
-            ("no free space", IPSet([IPNetwork('192.168.1.0/29'),]), (28,), [])
+            ("no free space", IPSet([IPNetwork('192.168.1.0/29'),]), (28,), []),
+            ("offset", IPSet([IPNetwork('192.168.1.0/29'), IPNetwork('192.168.2.0/30')]), (30, 2, 1), [IPNetwork('192.168.1.4/30'), IPNetwork('192.168.2.0/30')]),
+            ("unaligned", IPSet([IPRange('192.168.1.4', '192.168.1.19')]), (29,), [IPNetwork('192.168.1.8/29')]),
+            ("cidrs", IPSet([IPRange('192.168.1.4', '192.168.1.19')]), (0,), [IPNetwork('192.168.1.4/30'), IPNetwork('192.168.1.8/29'), IPNetwork('192.168.1.16/30')]),
+            ("ipv6", IPSet([IPNetwork('2001:db8::/32'),]), (64, 2, 2**32 - 1), [IPNetwork('2001:db8:ffff:ffff::/64')]),
         ]
         for case in cases:
             got = IPSplitter(case[1]).split(*case[2])
             self.assertListEqual(case[-1], got, case[0])
         IPSplitter(IPSet([IPNetwork("10.0.0.0/16"),])).split(24)
+
+    def test_count(self):
+        cases = [
+            ("ipv4", IPSet([IPNetwork('10.0.0.0/8'),]), 30, 2**22),
+            ("ipv6", IPSet([IPNetwork('2001:db8::/32'),]), 64, 2**32),
+            ("unaligned", IPSet([IPRange('192.168.1.4', '192.168.1.19')]), 29, 1),
+            ("too long", IPSet([IPNetwork('10.0.0.0/8'),]), 33, 0),
+        ]
+        for case in cases:
+            self.assertEqual(IPSplitter(case[1]).count(case[2]), case[-1], case[0])
+
+    def test_after(self):
+        splitter = IPSplitter(IPSet([IPNetwork('192.168.1.0/28'),]))
+        got = list(splitter.iter_subnets(30, after=IPNetwork('192.168.1.4/30')))
+        self.assertListEqual(got, [IPNetwork('192.168.1.8/30'), IPNetwork('192.168.1.12/30')])
+
+    def test_search(self):
+        ipsets = [
+            IPSet([IPNetwork('10.0.0.0/16')]) - IPSet([IPNetwork('10.0.3.0/24'), IPNetwork('10.0.17.128/25')]),
+            IPSet([IPNetwork('2001:db8::/112'), IPNetwork('10.1.0.0/20')]) - IPSet([IPNetwork('2001:db8::100/120')]),
+        ]
+        queries = ['', '10.0.1', '10.0.17.', '10.0.0.0/2', '10.0.0.0/', '10.0.0.00', '2001:db8::1', '2001:db8::/12', 'x']
+        for ipset in ipsets:
+            splitter = IPSplitter(ipset)
+            for prefix_len in (0, 24, 28, 120, 124):
+                subnets = list(splitter.iter_subnets(prefix_len))
+                for q in queries:
+                    expected = [subnet for subnet in subnets if str(subnet).startswith(q)]
+                    got = list(splitter.iter_subnets(prefix_len, q=q))
+                    self.assertListEqual(got, expected, f'{ipset} {prefix_len} {q}')
+
+    def test_huge_search(self):
+        splitter = IPSplitter(IPSet([IPNetwork('10.0.0.0/8')]))
+        got = list(splitter.iter_subnets(30, q='10.20.30.25'))
+        self.assertListEqual(got, [IPNetwork('10.20.30.252/30')])
+        splitter = IPSplitter(IPSet([IPNetwork('2001:db8::/32')]))
+        self.assertListEqual(list(islice(splitter.iter_subnets(64, q='2001:db8::0'), 2)), [])
+        got = list(islice(splitter.iter_subnets(64, q='2001:db8:0:'), 2))
+        self.assertListEqual(got, [IPNetwork('2001:db8:0:1::/64'), IPNetwork('2001:db8:0:2::/64')])
+
+
+class TestSubnetPlanner(unittest.TestCase):
+
+    def test(self):
+        cases = [
+            ("mixed", IPSet([IPNetwork('10.0.0.0/22')]), {24: 2, 26: 3, 30: 2}, {
+                24: [IPNetwork('10.0.0.0/24'), IPNetwork('10.0.1.0/24')],
+                26: [IPNetwork('10.0.2.0/26'), IPNetwork('10.0.2.64/26'), IPNetwork('10.0.2.128/26')],
+                30: [IPNetwork('10.0.2.192/30'), IPNetwork('10.0.2.196/30')],
+            }),
+            ("list", IPSet([IPNetwork('10.0.0.0/28')]), [30, 29, 30], {
+                29: [IPNetwork('10.0.0.0/29')],
+                30: [IPNetwork('10.0.0.8/30'), IPNetwork('10.0.0.12/30')],
+            }),
+            # the /30 is taken from the small block, so the /29 still fits
+            ("best fit", IPSet([IPRange('10.0.0.4', '10.0.0.15')]), [30, 29], {
+                29: [IPNetwork('10.0.0.8/29')],
+                30: [IPNetwork('10.0.0.4/30')],
+            }),
+            ("ipv6", IPSet([IPNetwork('2001:db8::/48')]), {56: 1, 64: 2}, {
+                56: [IPNetwork('2001:db8::/56')],
+                64: [IPNetwork('2001:db8:0:100::/64'), IPNetwork('2001:db8:0:101::/64')],
+            }),
+            ("empty", IPSet([IPNetwork('10.0.0.0/24')]), {}, {}),
+        ]
+        for case in cases:
+            self.assertDictEqual(plan_subnets(case[1], case[2]), case[-1], case[0])
+
+    def test_fragmentation(self):
+        ipset = IPSet([IPNetwork('10.0.0.0/16')])
+        plan = plan_subnets(ipset, {24: 40, 26: 10, 30: 200})
+        self.assertListEqual([len(plan[prefix_len]) for prefix_len in (24, 26, 30)], [40, 10, 200])
+        taken = IPSet(subnet for subnets in plan.values() for subnet in subnets)
+        self.assertEqual(taken.size, 40 * 256 + 10 * 64 + 200 * 4)
+        # everything is packed at the beginning of the free space
+        self.assertEqual(list((ipset - taken).iter_cidrs())[-2:], [IPNetwork('10.0.64.0/18'), IPNetwork('10.0.128.0/17')])
+
+    def test_exclude(self):
+        ipset = IPSet([IPNetwork('10.0.0.0/28')])
+        got = plan_subnets(ipset, [30, 30], exclude=IPSet([IPNetwork('10.0.0.0/30')]))
+        self.assertDictEqual(got, {30: [IPNetwork('10.0.0.4/30'), IPNetwork('10.0.0.8/30')]})
+
+    def test_errors(self):
+        ipset = IPSet([IPNetwork('10.0.0.0/24')])
+        with self.assertRaises(IndexError):
+            plan_subnets(ipset, {25: 2, 30: 1})
+        with self.assertRaises(IndexError):
+            plan_subnets(ipset, {23: 1})
+        with self.assertRaises(ValueError):
+            plan_subnets(ipset, {33: 1})
+        with self.assertRaises(ValueError):
+            plan_subnets(ipset, {24: -1})
+        with self.assertRaises(ValueError):
+            plan_subnets(ipset | IPSet([IPNetwork('2001:db8::/64')]), {64: 1})
+        self.assertDictEqual(SubnetPlanner(IPSet()).plan({64: 0}, version=6), {64: []})
+
+
+class TestAllocate(unittest.TestCase):
+
+    def test_alignment(self):
+        ipset = IPSet([IPNetwork('10.0.0.0/24')])
+        cases = [
+            ("addresses", {'count': 2, 'alignment': 4}, ['10.0.0.0', '10.0.0.4']),
+            ("contiguous addresses", {'count': 2, 'alignment': 4, 'contiguous': True}, ['10.0.0.0', '10.0.0.1']),
+            ("prefixes", {'count': 2, 'prefix_len': 30, 'alignment': 16}, ['10.0.0.0/30', '10.0.0.16/30']),
+            # only the first prefix of a contiguous block is aligned
+            ("contiguous prefixes", {'count': 2, 'prefix_len': 30, 'alignment': 16, 'contiguous': True, 'base': '10.0.0.1'},
+             ['10.0.0.16/30', '10.0.0.20/30']),
+        ]
+        for case in cases:
+            self.assertListEqual([str(x) for x in allocate(ipset, **case[1])], case[-1], case[0])
+
+
+class TestNumberRanges(unittest.TestCase):
+
+    def test(self):
+        vids = list(range(1, 101)) + [409, 1000, 4094]
+        available = IntervalSet.from_ranges((vid, vid) for vid in vids)
+        for q in ['', '1', '10', '40', '409', '4095', '0', 'a']:
+            expected = [vid for vid in vids if str(vid).startswith(q)]
+            matched = available.intersection(IntervalSet.from_ranges(get_number_ranges(q, 4094)))
+            self.assertListEqual(list(matched.iter_values()), expected, q)
+
+
+class TestIterAvailableIPs(unittest.TestCase):
+
+    def test_matches_string_search(self):
+        ipsets = [
+            IPSet([IPNetwork('192.168.0.0/22')]) - IPSet([IPAddress('192.168.1.7'), IPNetwork('192.168.2.0/25')]),
+            IPSet([IPNetwork('2001:db8::/118')]) - IPSet([IPAddress('2001:db8::5')]),
+            IPSet([IPNetwork('::ffff:10.0.0.0/120'), IPNetwork('2001:0:0:1::/120')]),
+        ]
+        queries = ['', '1', '192.168.1.1', '192.168.01', '10.0', '2001:db8::', '2001:db8::3f', '2001:DB8', '::ffff:10.0.0.1', '2001:0:0:1::f']
+        for ipset in ipsets:
+            for q in queries:
+                expected = [ip for ip in ipset if str(ip).startswith(q)]
+                self.assertListEqual(list(iter_available_ips(ipset, q)), expected, f'{ipset} {q}')
+
+    def test_huge_prefix(self):
+        ipset = IPSet([IPNetwork('2001:db8::/48')]) - IPSet([IPAddress('2001:db8::1')])
+        cases = [
+            ("no filter", '', [IPAddress('2001:db8::'), IPAddress('2001:db8::2')]),
+            ("filter", '2001:db8:0:ff', [IPAddress('2001:db8:0:ff::'), IPAddress('2001:db8:0:ff::1')]),
+            ("compressed filter", '2001:db8::ff', [IPAddress('2001:db8::ff'), IPAddress('2001:db8::ff0')]),
+            ("not matched", '2001:db9', []),
+            ("zero after compression", '2001:db8::0', []),
+            # "::" replaces the first of the longest runs of zeros
+            ("uncompressed zeros", '2001:db8:0:0:', [IPAddress('2001:db8:0:0:1::'), IPAddress('2001:db8:0:0:2::')]),
+            ("never printed", '2001:db8:0:0:1:0:0:', []),
+        ]
+        for case in cases:
+            got = list(islice(iter_available_ips(ipset, case[1]), 2))
+            self.assertListEqual(got, case[-1], case[0])
+
+    def test_after(self):
+        ipset = IPSet([IPNetwork('10.0.0.0/30'), IPNetwork('2001:db8::/126')])
+        got = list(iter_available_ips(ipset, '', IPAddress('10.0.0.2')))
+        self.assertListEqual(got, [IPAddress('10.0.0.3')] + list(IPNetwork('2001:db8::/126')))
+        got = list(iter_available_ips(ipset, '2001:db8::', IPAddress('2001:db8::1')))
+        self.assertListEqual(got, [IPAddress('2001:db8::2'), IPAddress('2001:db8::3')])
@@ -1,40 +1,18 @@
-import unittest
 import unittest.mock as mock
 from utilities.testing.base import TestCase
 
+from django.core.cache import cache
 from django.urls import reverse
-from django.test import override_settings
+from django.test import RequestFactory, override_settings
 from rest_framework import status
 
-from ipam.models import VLANGroup, VLAN, Prefix, IPAddress
-from netbox_scripthelper.api.views import filter_results
+from ipam.models import VLANGroup, VLAN, Prefix, IPAddress, IPRange, VRF
+from netbox.context import current_request
+from netbox_scripthelper.api.views import get_choices
+from netbox_scripthelper.fields import DynamicChoiceVar, PrefetchedAPISelect
 from django.db.backends.postgresql.psycopg_any import NumericRange
 
 
-class TestFilterResults(unittest.TestCase):
-
-    def create_request(self, **kwargs):
-        mm = mock.MagicMock()
-        mm.query_params = kwargs
-        return mm
-
-    def test(self):
-
-        cases = [
-            ("empty", self.create_request(), [], []),
-            ("only limit", self.create_request(limit=2), [1, 2, 3, 4, 5], [1, 2]),
-            ("only limit: all", self.create_request(limit=20), [1, 2, 3, 4, 5], [1, 2, 3, 4, 5]),
-            ("only q: matched", self.create_request(q=2), [1, 2, 3, 20, 5], [2, 20]),
-            ("only q: not matched", self.create_request(q=7), [1, 2, 3, 20, 5], []),
-            ("q and limit", self.create_request(q=2, limit=2), [1, 2, 3, 20, 21], [2, 20]),
-            ("q and limit: all", self.create_request(q=2, limit=10), [1, 2, 3, 20, 21], [2, 20, 21]),
-        ]
-
-        for case in cases:
-            got = filter_results(case[1], case[2])
-            self.assertListEqual(got, case[-1], case[0])
-
-
 class TestAvailablesVLANS(TestCase):
 
     @classmethod
@@ -59,6 +37,48 @@ class TestAvailablesVLANS(TestCase):
             self.assertEqual(response.status_code, status.HTTP_200_OK, case[0])
             self.assertEqual(len(response.data['results']), case[-1], case[0])
 
+    @override_settings(EXEMPT_VIEW_PERMISSIONS=['*'], LOGIN_REQUIRED=False)
+    def test_pagination(self):
+        vg = VLANGroup.objects.get(name='TestVG2')
+        url = reverse('plugins-api:netbox_scripthelper-api:vlangroup-available-vlans', kwargs={'pk': vg.pk})
+        pages = []
+        next_url = f'{url}?limit=2'
+        while next_url:
+            response = self.client.get(next_url)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            pages.append([r['id'] for r in response.data['results']])
+            next_url = response.data['next']
+        self.assertListEqual(pages, [[10, 11], [13, 14], [15]])
+
+        response = self.client.get(f'{url}?limit=2&cursor=invalid')
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    @override_settings(EXEMPT_VIEW_PERMISSIONS=['*'], LOGIN_REQUIRED=False)
+    def test_ranges(self):
+        vg = VLANGroup.objects.get(name='TestVG2')
+        url = reverse('plugins-api:netbox_scripthelper-api:vlangroup-available-vlans', kwargs={'pk': vg.pk})
+        cases = [
+            ("ranges", "?mode=ranges", ['10-11', '13-15']),
+            ("ranges with filter", "?mode=ranges&q=1", ['10-11', '13-15']),
+            ("ranges with limit", "?mode=ranges&limit=1", ['10-11']),
+            ("contiguous range", "?mode=ranges&count=3", ['13-15']),
+            ("contiguous vids", "?count=2", [10, 11]),
+            ("no contiguous vids", "?count=4", []),
+        ]
+        for case in cases:
+            response = self.client.get(f'{url}{case[1]}')
+            self.assertEqual(response.status_code, status.HTTP_200_OK, case[0])
+            self.assertListEqual([r['id'] for r in response.data['results']], case[-1], case[0])
+
+        response = self.client.get(f'{url}?mode=ranges&limit=1')
+        response = self.client.get(response.data['next'])
+        self.assertListEqual(response.data['results'], [
+            {'id': '13-15', 'display': '13-15', 'first': 13, 'last': 15, 'size': 3}
+        ])
+        for query in ('?mode=unknown', '?count=0', '?count=x', '?count=4095', '?count=10000000000000000000'):
+            response = self.client.get(f'{url}{query}')
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST, query)
+
 
 class TestAvailablesPrefixes(TestCase):
 
@@ -98,6 +118,19 @@ class TestAvailablesPrefixes(TestCase):
             self.assertEqual(response.status_code, status.HTTP_200_OK, case[0])
             self.assertEqual(len(response.data['results']), case[-1], case[0])
 
+    @override_settings(EXEMPT_VIEW_PERMISSIONS=['*'], LOGIN_REQUIRED=False)
+    def test_pagination(self):
+        p = Prefix.objects.get(prefix='172.20.0.0/24')
+        url = reverse('plugins-api:netbox_scripthelper-api:prefix-available-prefixes', kwargs={'pk': p.pk})
+        pages = []
+        next_url = f'{url}?prefixlen=26&limit=1'
+        while next_url:
+            response = self.client.get(next_url)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            pages.append([r['id'] for r in response.data['results']])
+            next_url = response.data['next']
+        self.assertListEqual(pages, [['172.20.0.0/26'], ['172.20.0.64/26']])
+
 
 class TestAvailablesIPAddresses(TestCase):
 
@@ -123,3 +156,519 @@ class TestAvailablesIPAddresses(TestCase):
             response = self.client.get(f'{url}{case[1]}')
             self.assertEqual(response.status_code, status.HTTP_200_OK, case[0])
             self.assertEqual(len(response.data['results']), case[-1], case[0])
+
+    @override_settings(EXEMPT_VIEW_PERMISSIONS=['*'], LOGIN_REQUIRED=False)
+    def test_pagination(self):
+        p = Prefix.objects.get(prefix='192.168.0.0/28')
+        url = reverse('plugins-api:netbox_scripthelper-api:prefix-available-ips', kwargs={'pk': p.pk})
+        response = self.client.get(f'{url}?limit=3&with_mask=false')
+        self.assertListEqual([r['id'] for r in response.data['results']], ['192.168.0.1', '192.168.0.3', '192.168.0.4'])
+        response = self.client.get(response.data['next'])
+        self.assertListEqual([r['id'] for r in response.data['results']], ['192.168.0.6', '192.168.0.7', '192.168.0.8'])
+        response = self.client.get(f'{url}?limit=20')
+        self.assertIsNone(response.data['next'])
+
+
+class TestChildIPAddresses(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        Prefix.objects.create(prefix='10.5.0.0/24')
+        IPAddress.objects.bulk_create([
+            IPAddress(address='10.5.0.100/24'),
+            IPAddress(address='10.5.0.10/16'),
+            IPAddress(address='10.5.0.2/24'),
+            IPAddress(address='10.5.0.20/32'),
+            IPAddress(address='10.5.0.1/24'),
+            IPAddress(address='10.6.0.1/24'),
+        ])
+
+    @override_settings(EXEMPT_VIEW_PERMISSIONS=['*'], LOGIN_REQUIRED=False)
+    def test(self):
+        cases = [
+            ("no_filter", "", ['10.5.0.1/24', '10.5.0.2/24', '10.5.0.10/16', '10.5.0.20/32', '10.5.0.100/24']),
+            ("limit", "?limit=2", ['10.5.0.1/24', '10.5.0.2/24']),
+            ("filter", "?q=10.5.0.1", ['10.5.0.1/24', '10.5.0.10/16', '10.5.0.100/24']),
+            ("filter_and_limit", "?q=10.5.0.1&limit=1", ['10.5.0.1/24']),
+            ("filter_with_mask", "?q=10.5.0.10/1", ['10.5.0.10/16']),
+            ("not_matched", "?q=10.6", []),
+            ("invalid", "?q=abc", []),
+        ]
+        p = Prefix.objects.get(prefix='10.5.0.0/24')
+        url = reverse('plugins-api:netbox_scripthelper-api:prefix-child-ips', kwargs={'pk': p.pk})
+        for case in cases:
+            response = self.client.get(f'{url}{case[1]}')
+            self.assertEqual(response.status_code, status.HTTP_200_OK, case[0])
+            self.assertListEqual([r['id'] for r in response.data['results']], case[-1], case[0])
+
+    @override_settings(EXEMPT_VIEW_PERMISSIONS=['*'], LOGIN_REQUIRED=False)
+    def test_pagination(self):
+        p = Prefix.objects.get(prefix='10.5.0.0/24')
+        url = reverse('plugins-api:netbox_scripthelper-api:prefix-child-ips', kwargs={'pk': p.pk})
+        pages = []
+        next_url = f'{url}?limit=2'
+        while next_url:
+            response = self.client.get(next_url)
+            pages.append([r['id'] for r in response.data['results']])
+            next_url = response.data['next']
+        self.assertListEqual(pages, [['10.5.0.1/24', '10.5.0.2/24'], ['10.5.0.10/16', '10.5.0.20/32'], ['10.5.0.100/24']])
+
+    @override_settings(EXEMPT_VIEW_PERMISSIONS=['*'], LOGIN_REQUIRED=False)
+    def test_duplicate_hosts(self):
+        # A global container lists addresses of all VRFs
+        p = Prefix.objects.create(prefix='10.7.0.0/24', status='container')
+        vrf = VRF.objects.create(name='TestVRF')
+        IPAddress.objects.create(address='10.7.0.1/24')
+        IPAddress.objects.create(address='10.7.0.1/25')
+        IPAddress.objects.create(address='10.7.0.1/24', vrf=vrf)
+        IPAddress.objects.create(address='10.7.0.2/24')
+        url = reverse('plugins-api:netbox_scripthelper-api:prefix-child-ips', kwargs={'pk': p.pk})
+        pages = []
+        next_url = f'{url}?limit=2'
+        while next_url:
+            response = self.client.get(next_url)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            pages.append([r['id'] for r in response.data['results']])
+            next_url = response.data['next']
+        self.assertListEqual(pages, [['10.7.0.1/24', '10.7.0.1/25'], ['10.7.0.1/24', '10.7.0.2/24']])
+        self.assertEqual(self.client.get(f'{url}?cursor=MTAuNy4wLjE').status_code, status.HTTP_404_NOT_FOUND)
+
+
+class TestStreamingResponses(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        Prefix.objects.create(prefix='10.0.0.0/20')
+        IPAddress.objects.create(address='10.0.0.10/20')
+        VLANGroup.objects.create(name='TestVG', slug='testvg', vid_ranges=[NumericRange(1, 4094, bounds='[]')])
+
+    def get_content(self, url, stream):
+        threshold = 1000 if stream else 10 ** 6
+        with mock.patch('netbox_scripthelper.api.views.STREAMING_THRESHOLD', threshold):
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.streaming, stream)
+        self.assertIn('ETag', response)
+        return b''.join(response.streaming_content) if stream else response.content
+
+    @override_settings(EXEMPT_VIEW_PERMISSIONS=['*'], LOGIN_REQUIRED=False)
+    def test(self):
+        p = Prefix.objects.get(prefix='10.0.0.0/20')
+        vg = VLANGroup.objects.get(name='TestVG')
+        urls = [
+            reverse('plugins-api:netbox_scripthelper-api:prefix-available-ips', kwargs={'pk': p.pk}),
+            reverse('plugins-api:netbox_scripthelper-api:prefix-available-ips', kwargs={'pk': p.pk}) + '?limit=2000',
+            reverse('plugins-api:netbox_scripthelper-api:prefix-available-ips', kwargs={'pk': p.pk}) + '?with_mask=false',
+            reverse('plugins-api:netbox_scripthelper-api:prefix-available-prefixes', kwargs={'pk': p.pk}) + '?prefixlen=32',
+            reverse('plugins-api:netbox_scripthelper-api:vlangroup-available-vlans', kwargs={'pk': vg.pk}),
+        ]
+        for url in urls:
+            self.assertEqual(self.get_content(url, True), self.get_content(url, False), url)
+
+    @override_settings(EXEMPT_VIEW_PERMISSIONS=['*'], LOGIN_REQUIRED=False)
+    def test_small_pages(self):
+        p = Prefix.objects.get(prefix='10.0.0.0/20')
+        url = reverse('plugins-api:netbox_scripthelper-api:prefix-available-ips', kwargs={'pk': p.pk})
+        self.assertEqual(len(self.client.get(f'{url}?limit=999').data['results']), 999)
+        response = self.client.get(f'{url}?limit=1000', HTTP_ACCEPT='application/json; indent=4')
+        self.assertFalse(response.streaming)
+
+
+class TestAvailablesIPv6Addresses(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        Prefix.objects.create(prefix='2001:db8::/48')
+        IPAddress.objects.create(address='2001:db8::ff/48')
+
+    @override_settings(EXEMPT_VIEW_PERMISSIONS=['*'], LOGIN_REQUIRED=False)
+    def test(self):
+        cases = [
+            ("with_limit_no_filter", "?limit=5", 5),
+            ("with_limit_with_filter", "?limit=3&q=2001:db8::f", 3),
+            ("with_limit_with_filter_deep", "?limit=3&q=2001:db8:0:ffff:", 3),
+            ("empty", "?limit=3&q=2001:db9", 0),
+        ]
+        p = Prefix.objects.get(prefix='2001:db8::/48')
+        url = reverse('plugins-api:netbox_scripthelper-api:prefix-available-ips', kwargs={'pk': p.pk})
+        for case in cases:
+            response = self.client.get(f'{url}{case[1]}')
+            self.assertEqual(response.status_code, status.HTTP_200_OK, case[0])
+            self.assertEqual(len(response.data['results']), case[-1], case[0])
+        response = self.client.get(f'{url}?limit=2&q=2001:db8::f&with_mask=false')
+        self.assertListEqual([r['id'] for r in response.data['results']], ['2001:db8::f', '2001:db8::f0'])
+
+
+@override_settings(
+    EXEMPT_VIEW_PERMISSIONS=['*'],
+    LOGIN_REQUIRED=False,
+    CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}},
+    PLUGINS_CONFIG={'netbox_scripthelper': {'cache_timeout': 60}}
+)
+class TestResponseCache(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        Prefix.objects.create(prefix='10.0.0.0/29')
+        vg = VLANGroup.objects.create(name='TestVG3', slug='testvg3', vid_ranges=[NumericRange(10, 15, bounds='[]')])
+        VLAN.objects.create(name='TestVlan3', vid=12, group=vg)
+
+    def test_ips(self):
+        p = Prefix.objects.get(prefix='10.0.0.0/29')
+        url = reverse('plugins-api:netbox_scripthelper-api:prefix-available-ips', kwargs={'pk': p.pk})
+        self.assertEqual(len(self.client.get(url).data['results']), 6)
+
+        # bulk_create doesn't send signals, so the cached response is returned
+        IPAddress.objects.bulk_create([IPAddress(address='10.0.0.1/29')])
+        self.assertEqual(len(self.client.get(url).data['results']), 6)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            IPAddress.objects.create(address='10.0.0.2/29')
+        self.assertEqual(len(self.client.get(url).data['results']), 4)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            IPAddress.objects.filter(address='10.0.0.2/29').delete()
+        self.assertEqual(len(self.client.get(url).data['results']), 5)
+
+    def test_vlans(self):
+        vg = VLANGroup.objects.get(name='TestVG3')
+        url = reverse('plugins-api:netbox_scripthelper-api:vlangroup-available-vlans', kwargs={'pk': vg.pk})
+        self.assertEqual(len(self.client.get(url).data['results']), 5)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            VLAN.objects.filter(vid=12).update(name='Renamed')
+            vlan = VLAN.objects.get(vid=12, group=vg)
+            vlan.vid = 13
+            vlan.save()
+        self.assertListEqual([r['id'] for r in self.client.get(url).data['results']], [10, 11, 12, 14, 15])
+
+
+class TestConditionalRequests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        Prefix.objects.create(prefix='10.1.0.0/29')
+
+    @override_settings(EXEMPT_VIEW_PERMISSIONS=['*'], LOGIN_REQUIRED=False)
+    def test(self):
+        p = Prefix.objects.get(prefix='10.1.0.0/29')
+        url = reverse('plugins-api:netbox_scripthelper-api:prefix-available-ips', kwargs={'pk': p.pk})
+        response = self.client.get(url)
+        etag = response['ETag']
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertEqual(response['ETag'], etag)
+
+        response = self.client.get(f'{url}?limit=1', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+        IPAddress.objects.create(address='10.1.0.1/29')
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertNotEqual(response['ETag'], etag)
+
+
+class TestBulkAvailable(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        Prefix.objects.create(prefix='10.2.0.0/29')
+        Prefix.objects.create(prefix='10.3.0.0/24')
+        Prefix.objects.create(prefix='10.3.0.0/26')
+        IPAddress.objects.create(address='10.2.0.1/29')
+        vg = VLANGroup.objects.create(name='TestVG4', slug='testvg4', vid_ranges=[NumericRange(10, 15, bounds='[]')])
+        VLAN.objects.create(name='TestVlan4', vid=12, group=vg)
+
+    @override_settings(EXEMPT_VIEW_PERMISSIONS=['*'], LOGIN_REQUIRED=False)
+    def test(self):
+        p1 = Prefix.objects.get(prefix='10.2.0.0/29')
+        p2 = Prefix.objects.get(prefix='10.3.0.0/24')
+        vg = VLANGroup.objects.get(name='TestVG4')
+        queries = [
+            {'kind': 'prefix-available-ips', 'pk': p1.pk, 'params': {'with_mask': 'false'}},
+            {'kind': 'prefix-available-ips', 'pk': p2.pk, 'params': {'limit': 2}},
+            {'kind': 'prefix-available-prefixes', 'pk': p2.pk, 'params': {'prefixlen': 26}},
+            {'kind': 'vlangroup-available-vlans', 'pk': vg.pk},
+            {'kind': 'prefix-available-ips', 'pk': 0},
+        ]
+        url = reverse('plugins-api:netbox_scripthelper-api:bulk-available')
+        response = self.client.post(url, queries, content_type='application/json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        results = response.data['results']
+        self.assertListEqual(
+            [r['id'] for r in results[0]['results']],
+            ['10.2.0.2', '10.2.0.3', '10.2.0.4', '10.2.0.5', '10.2.0.6']
+        )
+        self.assertEqual(len(results[1]['results']), 2)
+        self.assertIsNotNone(results[1]['next'])
+        self.assertListEqual([r['id'] for r in results[2]['results']], ['10.3.0.64/26', '10.3.0.128/26', '10.3.0.192/26'])
+        self.assertListEqual([r['id'] for r in results[3]['results']], [10, 11, 13, 14, 15])
+        self.assertIn('error', results[4])
+
+        response = self.client.post(url, [{'kind': 'unknown', 'pk': 1}], content_type='application/json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+@override_settings(
+    EXEMPT_VIEW_PERMISSIONS=['*'],
+    LOGIN_REQUIRED=False,
+    CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}},
+)
+class TestAvailableSummary(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        Prefix.objects.create(prefix='10.0.0.0/16')
+        Prefix.objects.create(prefix='10.0.0.0/24')
+        Prefix.objects.create(prefix='2001:db8::/32')
+        IPAddress.objects.create(address='10.0.0.1/16')
+        IPRange.objects.create(start_address='10.1.0.10/24', end_address='10.1.0.20/24')
+        IPAddress.objects.create(address='10.1.0.15/24')
+        vg = VLANGroup.objects.create(name='TestVG5', slug='testvg5', vid_ranges=[NumericRange(10, 20, bounds='[]')])
+        VLAN.objects.create(name='TestVlan12', vid=12, group=vg)
+
+    @override_settings(EXEMPT_VIEW_PERMISSIONS=['*'], LOGIN_REQUIRED=False)
+    def test_prefix(self):
+        p = Prefix.objects.get(prefix='10.0.0.0/16')
+        url = reverse('plugins-api:netbox_scripthelper-api:prefix-available-summary', kwargs={'pk': p.pk})
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertDictEqual(response.data, {
+            'size': 65536,
+            'available_ips': 65533,
+            'largest_available_prefix': '10.0.128.0/17',
+        })
+        response = self.client.get(f'{url}?prefixlen=24')
+        self.assertEqual(response.data['available_prefixes'], 255)
+        response = self.client.get(f'{url}?prefixlen=-1')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+        p = Prefix.objects.get(prefix='2001:db8::/32')
+        url = reverse('plugins-api:netbox_scripthelper-api:prefix-available-summary', kwargs={'pk': p.pk})
+        response = self.client.get(f'{url}?prefixlen=64')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertDictEqual(response.data, {
+            'size': 2 ** 96,
+            'available_ips': 2 ** 96 - 1,
+            'largest_available_prefix': '2001:db8::/32',
+            'prefixlen': 64,
+            'available_prefixes': 2 ** 32,
+        })
+
+    @override_settings(EXEMPT_VIEW_PERMISSIONS=['*'], LOGIN_REQUIRED=False)
+    def test_iprange(self):
+        r = IPRange.objects.get(start_address='10.1.0.10/24')
+        url = reverse('plugins-api:netbox_scripthelper-api:iprange-available-summary', kwargs={'pk': r.pk})
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertDictEqual(response.data, {
+            'size': 11,
+            'available_ips': 10,
+            'largest_available_range': '10.1.0.16-10.1.0.20',
+        })
+
+        # IPv6 addresses below 2^32 are not printed as IPv4 ones
+        r = IPRange.objects.create(start_address='::10/64', end_address='::20/64')
+        IPAddress.objects.create(address='::15/64')
+        url = reverse('plugins-api:netbox_scripthelper-api:iprange-available-summary', kwargs={'pk': r.pk})
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertDictEqual(response.data, {
+            'size': 17,
+            'available_ips': 16,
+            'largest_available_range': '::16-::20',
+        })
+
+    @override_settings(EXEMPT_VIEW_PERMISSIONS=['*'], LOGIN_REQUIRED=False)
+    def test_vlangroup(self):
+        vg = VLANGroup.objects.get(name='TestVG5')
+        url = reverse('plugins-api:netbox_scripthelper-api:vlangroup-available-summary', kwargs={'pk': vg.pk})
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertDictEqual(response.data, {
+            'size': 11,
+            'available_vids': 10,
+            'largest_available_range': '13-20',
+        })
+
+
+@override_settings(EXEMPT_VIEW_PERMISSIONS=['*'], LOGIN_REQUIRED=False)
+class TestAllocate(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.prefix = Prefix.objects.create(prefix='10.0.0.0/24')
+        IPAddress.objects.create(address='10.0.0.2/24')
+        Prefix.objects.create(prefix='10.0.0.0/28')
+
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+
+    def allocate(self, **data):
+        url = reverse('plugins-api:netbox_scripthelper-api:prefix-allocate', kwargs={'pk': self.prefix.pk})
+        return self.client.post(url, data, content_type='application/json')
+
+    def test(self):
+        cases = [
+            ("default", {}, ['10.0.0.1/24']),
+            ("count", {'count': 3}, ['10.0.0.1/24', '10.0.0.3/24', '10.0.0.4/24']),
+            ("contiguous", {'count': 3, 'contiguous': True}, ['10.0.0.3/24', '10.0.0.4/24', '10.0.0.5/24']),
+            ("aligned", {'count': 2, 'contiguous': True, 'alignment': 4}, ['10.0.0.4/24', '10.0.0.5/24']),
+            ("base", {'count': 2, 'base': '10.0.0.100'}, ['10.0.0.100/24', '10.0.0.101/24']),
+            ("prefixes", {'count': 2, 'prefixlen': 28}, ['10.0.0.16/28', '10.0.0.32/28']),
+            ("aligned prefixes", {'count': 2, 'prefixlen': 28, 'alignment': 64}, ['10.0.0.64/28', '10.0.0.128/28']),
+            ("aligned contiguous prefixes", {'count': 2, 'prefixlen': 30, 'alignment': 32, 'contiguous': True},
+             ['10.0.0.32/30', '10.0.0.36/30']),
+        ]
+        for case in cases:
+            response = self.allocate(**case[1])
+            self.assertEqual(response.status_code, status.HTTP_200_OK, case[0])
+            self.assertListEqual([r['id'] for r in response.data['results']], case[-1], case[0])
+            self.assertIsNone(response.data['reserved_until'], case[0])
+
+    def test_errors(self):
+        response = self.allocate(count=1000)
+        self.assertEqual(response.status_code, status.HTTP_409_CONFLICT)
+        self.assertEqual(response.data['detail'], 'Not enough free space.')
+        cases = [
+            ("zero count", {'count': 0}, 'count must not be less than 1.'),
+            ("huge count", {'count': 10**20}, 'count must not be greater than 65536.'),
+            ("huge contiguous count", {'count': 10**20, 'contiguous': True}, 'count must not be greater than 65536.'),
+            ("alignment", {'alignment': 3}, 'alignment must be a power of two.'),
+        ]
+        for case in cases:
+            response = self.allocate(**case[1])
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST, case[0])
+            self.assertEqual(response.data[0], case[-1], case[0])
+        self.assertEqual(self.allocate(base='invalid').status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_reserve_permission(self):
+        response = self.allocate(reserve=True)
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+        self.add_permissions('ipam.add_ipaddress')
+        self.assertEqual(self.allocate(reserve=True).status_code, status.HTTP_200_OK)
+        # prefixes require their own permission
+        self.assertEqual(self.allocate(prefixlen=28, reserve=True).status_code, status.HTTP_403_FORBIDDEN)
+        self.client.logout()
+        self.assertEqual(self.allocate(reserve=True).status_code, status.HTTP_403_FORBIDDEN)
+
+    def test_reserve(self):
+        self.add_permissions('ipam.add_ipaddress')
+        first = self.allocate(count=2, reserve=True)
+        self.assertEqual(first.status_code, status.HTTP_200_OK)
+        self.assertIsNotNone(first.data['reserved_until'])
+        second = self.allocate(count=2, reserve=True)
+        self.assertListEqual([r['id'] for r in first.data['results']], ['10.0.0.1/24', '10.0.0.3/24'])
+        self.assertListEqual([r['id'] for r in second.data['results']], ['10.0.0.4/24', '10.0.0.5/24'])
+        # reserved addresses are skipped without reserving too
+        response = self.allocate()
+        self.assertListEqual([r['id'] for r in response.data['results']], ['10.0.0.6/24'])
+
+
+@override_settings(EXEMPT_VIEW_PERMISSIONS=['*'], LOGIN_REQUIRED=False)
+class TestPlan(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.prefix = Prefix.objects.create(prefix='10.0.0.0/24')
+        Prefix.objects.create(prefix='10.0.0.0/26')
+
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+
+    def plan(self, **data):
+        url = reverse('plugins-api:netbox_scripthelper-api:prefix-plan', kwargs={'pk': self.prefix.pk})
+        return self.client.post(url, data, content_type='application/json')
+
+    def test(self):
+        cases = [
+            ("object", {'prefixes': {'26': 1, '28': 2, '30': 1}}, ['10.0.0.64/26', '10.0.0.128/28', '10.0.0.144/28', '10.0.0.160/30']),
+            ("list", {'prefixes': [30, 27, 30]}, ['10.0.0.64/27', '10.0.0.96/30', '10.0.0.100/30']),
+            ("empty", {'prefixes': {}}, []),
+        ]
+        for case in cases:
+            response = self.plan(**case[1])
+            self.assertEqual(response.status_code, status.HTTP_200_OK, case[0])
+            self.assertListEqual([r['id'] for r in response.data['results']], case[-1], case[0])
+            self.assertIsNone(response.data['reserved_until'], case[0])
+
+    def test_errors(self):
+        response = self.plan(prefixes={'25': 2})
+        self.assertEqual(response.status_code, status.HTTP_409_CONFLICT)
+        self.assertEqual(response.data['detail'], 'Not enough free space.')
+        cases = [
+            ("invalid length", {'prefixes': {'33': 1}}, 'invalid prefix length: 33'),
+            ("not a number", {'prefixes': {'x': 1}}, 'prefixes must map prefix lengths to numbers of prefixes.'),
+            ("too many", {'prefixes': {'30': 100000}}, 'A plan may contain at most 65536 prefixes.'),
+            ("missing", {}, 'prefixes must be an object or a list.'),
+        ]
+        for case in cases:
+            response = self.plan(**case[1])
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST, case[0])
+            self.assertEqual(response.data[0], case[-1], case[0])
+
+    def test_reserve(self):
+        self.assertEqual(self.plan(prefixes={'26': 1}, reserve=True).status_code, status.HTTP_403_FORBIDDEN)
+        self.add_permissions('ipam.add_prefix')
+        first = self.plan(prefixes={'26': 1}, reserve=True)
+        self.assertIsNotNone(first.data['reserved_until'])
+        second = self.plan(prefixes={'26': 1})
+        self.assertListEqual([r['id'] for r in first.data['results']], ['10.0.0.64/26'])
+        self.assertListEqual([r['id'] for r in second.data['results']], ['10.0.0.128/26'])
+
+
+@override_settings(EXEMPT_VIEW_PERMISSIONS=['*'], LOGIN_REQUIRED=False)
+class TestPrefetchChoices(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.prefix = Prefix.objects.create(prefix='10.0.0.0/29')
+        IPAddress.objects.create(address='10.0.0.2/29')
+
+    def create_request(self):
+        request = RequestFactory().get('/')
+        request.user = self.user
+        return request
+
+    def test(self):
+        url = reverse('plugins-api:netbox_scripthelper-api:prefix-available-ips', kwargs={'pk': self.prefix.pk})
+        request = self.create_request()
+        choices = get_choices(request, f'{url}?limit=2', {})
+        self.assertListEqual(choices, [('10.0.0.1/29', '10.0.0.1/29'), ('10.0.0.3/29', '10.0.0.3/29')])
+        # the free space of the parent is calculated once per request
+        with self.assertNumQueries(0):
+            choices = get_choices(request, url, {'limit': 1, 'with_mask': 'false'})
+        self.assertListEqual(choices, [('10.0.0.1', '10.0.0.1')])
+
+        self.assertIsNone(get_choices(request, '/api/ipam/prefixes/', {}))
+        missing = reverse('plugins-api:netbox_scripthelper-api:prefix-available-ips', kwargs={'pk': 0})
+        self.assertListEqual(get_choices(request, missing, {}), [])
+
+    def test_field(self):
+        url = reverse('plugins-api:netbox_scripthelper-api:prefix-available-prefixes', kwargs={'pk': self.prefix.pk})
+        field = DynamicChoiceVar(api_url=url, query_params={'prefixlen': 30}, prefetch=True).as_field()
+        self.assertEqual(field.widget.attrs['data-url'], url)
+        # the browser does not load the rendered page again
+        self.assertIsInstance(field.widget, PrefetchedAPISelect)
+        self.assertEqual(field.widget.attrs['data-prefetched'], 'true')
+        self.assertIn('data-prefetched="true"', field.widget.render('prefix', None))
+        self.assertNotIn('<script', field.widget.render('prefix', None))
+        self.assertIn('netbox_scripthelper/prefetched-select.js', str(field.widget.media))
+        token = current_request.set(self.create_request())
+        try:
+            self.assertListEqual(list(field.choices), [('10.0.0.0/30', '10.0.0.0/30'), ('10.0.0.4/30', '10.0.0.4/30')])
+        finally:
+            current_request.reset(token)
+
+        # URLs referring to other fields are resolved by the browser
+        field = DynamicChoiceVar(api_url='/api/plugins/scripthelper/prefixes/{{prefix}}/available-ips/',
+                                 prefetch=True).as_field()
+        self.assertListEqual(list(field.choices), [])
+        self.assertNotIn('data-prefetched', field.widget.attrs)
+        field = DynamicChoiceVar(api_url=url, query_params={'prefixlen': '$prefixlen'}, prefetch=True).as_field()
+        self.assertListEqual(list(field.choices), [])
+        self.assertNotIn('data-prefetched', field.widget.attrs)
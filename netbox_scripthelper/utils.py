@@ -1,28 +1,990 @@
-from typing import List, Any
-from netaddr import IPSet, IPNetwork, IPAddress, IPRange
+from bisect import bisect_left, bisect_right
+from collections import Counter
+from heapq import heappop, heappush
+from itertools import islice
+from typing import Dict, Iterable, Iterator, List, Any, Mapping, NamedTuple, Tuple, Union
+from netaddr import AddrFormatError, IPSet, IPNetwork, IPAddress
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# Width in bits of an address for each IP version.
+ADDRESS_WIDTH = {4: 32, 6: 128}
+
+# Values below this bound (IPv4 addresses, VIDs) are stored in NumPy arrays.
+NUMPY_MAX_VALUE = 2 ** 62
+
+
+def merge_ranges(ranges: Iterable[Tuple[int, int]]) -> List[Tuple[int, int]]:
+    """
+    Returns sorted ranges with overlapping and adjacent ones merged together.
+    """
+
+    merged = []
+    for first, last in sorted(ranges):
+        if merged and first <= merged[-1][1] + 1:
+            if last > merged[-1][1]:
+                merged[-1] = (merged[-1][0], last)
+            continue
+        merged.append((first, last))
+    return merged
+
+
+class Interval(NamedTuple):
+    """
+    A range of consecutive integers, printed as "first-last".
+    """
+    first: int
+    last: int
+
+    def __str__(self) -> str:
+        return f'{self.first}-{self.last}'
+
+    @property
+    def size(self) -> int:
+        return self.last - self.first + 1
+
+
+class IntervalSet:
+    """
+    A set of integers stored as sorted arrays of the first and the last values
+    of disjoint ranges. The arrays are NumPy-backed if NumPy is installed and
+    the values fit into int64, otherwise plain lists are used (e.g. for IPv6).
+    """
+
+    def __init__(self, starts: Iterable[int] = (), ends: Iterable[int] = ()):
+        """
+        `starts` and `ends` must describe sorted, disjoint and non-adjacent ranges,
+        use `from_ranges` to build a set from arbitrary ranges.
+        """
+        starts, ends = list(starts), list(ends)
+        self.numpy = np is not None and (len(ends) == 0 or ends[-1] < NUMPY_MAX_VALUE)
+        if self.numpy:
+            self.starts = np.asarray(starts, dtype=np.int64)
+            self.ends = np.asarray(ends, dtype=np.int64)
+        else:
+            self.starts = starts
+            self.ends = ends
+        self._before = None
+
+    @classmethod
+    def from_ranges(cls, ranges: Iterable[Tuple[int, int]]) -> 'IntervalSet':
+        merged = merge_ranges(ranges)
+        return cls([first for first, _ in merged], [last for _, last in merged])
+
+    @classmethod
+    def from_ipset(cls, ipset: IPSet, version: int) -> 'IntervalSet':
+        """
+        Returns addresses of the IP `version` from `ipset`.
+        """
+        return cls.from_ranges((r.first, r.last) for r in ipset.iter_ipranges() if r.version == version)
+
+    def __iter__(self) -> Iterator[Tuple[int, int]]:
+        for first, last in zip(self.starts, self.ends):
+            yield int(first), int(last)
+
+    def __bool__(self) -> bool:
+        return len(self.starts) > 0
+
+    def __eq__(self, other) -> bool:
+        return isinstance(other, IntervalSet) and list(self) == list(other)
+
+    def __repr__(self) -> str:
+        return f'IntervalSet({list(self)})'
+
+    def _sizes(self):
+        if self.numpy:
+            return self.ends - self.starts + 1
+        return [last - first + 1 for first, last in zip(self.starts, self.ends)]
+
+    def _get_before(self):
+        """
+        Returns the number of values that precede each range.
+        """
+        if self._before is None:
+            if self.numpy:
+                sizes = self._sizes()
+                self._before = np.cumsum(sizes) - sizes
+            else:
+                self._before = []
+                total = 0
+                for size in self._sizes():
+                    self._before.append(total)
+                    total += size
+        return self._before
+
+    @property
+    def size(self) -> int:
+        """
+        The number of values in the set.
+        """
+        if len(self.starts) == 0:
+            return 0
+        return int(self._get_before()[-1]) + int(self.ends[-1]) - int(self.starts[-1]) + 1
+
+    def largest(self) -> Union[Interval, None]:
+        """
+        Returns the first of the longest ranges or None if the set is empty.
+        """
+        if not self:
+            return None
+        sizes = self._sizes()
+        index = int(np.argmax(sizes)) if self.numpy else sizes.index(max(sizes))
+        return Interval(int(self.starts[index]), int(self.ends[index]))
+
+    def union(self, other: 'IntervalSet') -> 'IntervalSet':
+        if not self or not other:
+            return self if self else other
+        if self.numpy and other.numpy:
+            starts = np.concatenate((self.starts, other.starts))
+            ends = np.concatenate((self.ends, other.ends))
+            order = np.argsort(starts, kind='stable')
+            starts, ends = starts[order], ends[order]
+            reach = np.maximum.accumulate(ends)
+            breaks = starts[1:] > reach[:-1] + 1
+            return IntervalSet(starts[np.r_[True, breaks]].tolist(), reach[np.r_[breaks, True]].tolist())
+        return IntervalSet.from_ranges(list(self) + list(other))
+
+    def intersection(self, other: 'IntervalSet') -> 'IntervalSet':
+        if self.numpy and other.numpy:
+            # Pair every range with the ranges of the other set it overlaps
+            low = np.searchsorted(other.ends, self.starts, side='left')
+            high = np.searchsorted(other.starts, self.ends, side='right')
+            counts = np.maximum(high - low, 0)
+            left = np.repeat(np.arange(len(self.starts)), counts)
+            right = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts) + np.repeat(low, counts)
+            starts = np.maximum(self.starts[left], other.starts[right])
+            ends = np.minimum(self.ends[left], other.ends[right])
+            return IntervalSet(starts.tolist(), ends.tolist())
+        left, right = list(self), list(other)
+        starts, ends = [], []
+        i = j = 0
+        while i < len(left) and j < len(right):
+            first = max(left[i][0], right[j][0])
+            last = min(left[i][1], right[j][1])
+            if first <= last:
+                starts.append(first)
+                ends.append(last)
+            if left[i][1] < right[j][1]:
+                i += 1
+            else:
+                j += 1
+        return IntervalSet(starts, ends)
+
+    def complement(self, first: int, last: int) -> 'IntervalSet':
+        """
+        Returns values between `first` and `last` that are not in the set.
+        """
+        ranges = []
+        for start, end in self:
+            if start > first:
+                ranges.append((first, min(start - 1, last)))
+            first = max(first, end + 1)
+        ranges.append((first, last))
+        return IntervalSet.from_ranges((s, e) for s, e in ranges if s <= e)
+
+    def difference(self, other: 'IntervalSet') -> 'IntervalSet':
+        if not self or not other:
+            return self
+        return self.intersection(other.complement(int(self.starts[0]), int(self.ends[-1])))
+
+    def after(self, value: int) -> 'IntervalSet':
+        """
+        Returns values greater than `value`.
+        """
+        index = bisect_right(self.ends, value) if not self.numpy else int(np.searchsorted(self.ends, value, side='right'))
+        starts, ends = list(self.starts[index:]), list(self.ends[index:])
+        if starts and starts[0] <= value:
+            starts[0] = value + 1
+        return IntervalSet([int(x) for x in starts], [int(x) for x in ends])
+
+    def range_from(self, value: int) -> Union[Tuple[int, int], None]:
+        """
+        Returns the first range of values not less than `value` as (first, last),
+        or None if there are no such values.
+        """
+        index = bisect_left(self.ends, value) if not self.numpy else int(np.searchsorted(self.ends, value, side='left'))
+        if index == len(self.starts):
+            return None
+        return max(int(self.starts[index]), value), int(self.ends[index])
+
+    def rank(self, value: int) -> int:
+        """
+        Returns the number of values less than `value`.
+        """
+        if self.numpy:
+            index = int(np.searchsorted(self.ends, value, side='left'))
+        else:
+            index = bisect_left(self.ends, value)
+        if index == len(self.starts):
+            return self.size
+        return int(self._get_before()[index]) + max(0, value - int(self.starts[index]))
+
+    def nth(self, indices: Union[int, Iterable[int]]) -> Union[int, List[int]]:
+        """
+        Returns the value at position `indices` in ascending order. A batch of
+        positions can be passed at once. Raises IndexError if a position is out of the set.
+        """
+        if isinstance(indices, int):
+            return self.nth([indices])[0]
+        before = self._get_before()
+        size = self.size
+        if self.numpy:
+            indices = np.asarray(indices, dtype=np.int64)
+            if indices.size and (indices.min() < 0 or indices.max() >= size):
+                raise IndexError('index out of range')
+            positions = np.searchsorted(before, indices, side='right') - 1
+            return (self.starts[positions] + indices - before[positions]).tolist()
+        values = []
+        for index in indices:
+            if not 0 <= index < size:
+                raise IndexError('index out of range')
+            position = bisect_right(before, index) - 1
+            values.append(self.starts[position] + index - before[position])
+        return values
+
+    def first(self, count: int, base: int = 0) -> List[int]:
+        """
+        Returns `count` first values starting with `base`.
+        Raises IndexError if there are not enough values.
+        """
+        rank = self.rank(base)
+        if count < 0 or rank + count > self.size:
+            raise IndexError('not enough values')
+        if self.numpy:
+            return self.nth(np.arange(rank, rank + count, dtype=np.int64))
+        return self.nth(range(rank, rank + count))
+
+    def iter_values(self) -> Iterator[int]:
+        """
+        Lazily yields values of the set in ascending order.
+        """
+        for first, last in self:
+            yield from range(first, last + 1)
+
+    def find_run(self, count: int, base: int = 0, alignment: int = 1) -> Union[int, None]:
+        """
+        Returns the first value of `count` consecutive values of the set that
+        is not less than `base` and is a multiple of `alignment`, or None if
+        there is no such run.
+        """
+        if count > self.size:
+            return None
+        intervals = self.after(base - 1)
+        if intervals.numpy and alignment < NUMPY_MAX_VALUE:
+            firsts = -(-intervals.starts // alignment) * alignment
+            found = np.flatnonzero(firsts + count - 1 <= intervals.ends)
+            return int(firsts[found[0]]) if len(found) else None
+        for first, last in intervals:
+            first = -(-first // alignment) * alignment
+            if first + count - 1 <= last:
+                return first
+        return None
+
+    def iter_blocks(self, size: int, step: int) -> Iterator[int]:
+        """
+        Lazily yields the first values of blocks of `size` values within the set.
+        The blocks start at multiples of `step`.
+        """
+        for first, last in self:
+            first = -(-first // step) * step
+            while first + size - 1 <= last:
+                yield first
+                first += step
+
+    def aligned(self, size: int) -> Tuple[List[int], List[int]]:
+        """
+        Returns the first block of `size` values aligned to `size` in each range
+        and the number of such blocks that fit into the range.
+        """
+        if self.numpy and size < NUMPY_MAX_VALUE:
+            firsts = -(-self.starts // size) * size
+            return firsts, np.maximum((self.ends + 1 - firsts) // size, 0)
+        firsts, counts = [], []
+        for first, last in self:
+            firsts.append(-(-first // size) * size)
+            counts.append(max(0, (last + 1 - firsts[-1]) // size))
+        return firsts, counts
 
 
 class IPSplitter:
     """
     Split prefixes into subnets with fixed prefix length.
+    Subnet boundaries are calculated arithmetically from the free ranges, so
+    subnets are never built beyond the ones that are actually returned.
     """
 
     def __init__(self, prefixes: IPSet):
         self.prefixes = prefixes
+        self.intervals = {version: IntervalSet.from_ipset(prefixes, version) for version in ADDRESS_WIDTH}
+
+    @classmethod
+    def from_intervals(cls, intervals: Dict[int, IntervalSet]) -> 'IPSplitter':
+        """
+        Returns a splitter of free space given as integer addresses per IP version
+        without building an IPSet.
+        """
+        splitter = cls(IPSet())
+        splitter.prefixes = None
+        splitter.intervals.update(intervals)
+        return splitter
+
+    def _iter_intervals(self, after: IPNetwork = None) -> Iterator[Tuple[int, IntervalSet]]:
+        """
+        Yields free space per IP version starting behind `after`.
+        """
+        for version, intervals in self.intervals.items():
+            if after is not None and version < after.version:
+                continue
+            if after is not None and version == after.version:
+                intervals = intervals.after(after.last)
+            yield version, intervals
+
+    def iter_subnets(self, prefix_len: int, offset: int = 0, after: IPNetwork = None,
+                     q: str = '') -> Iterator[IPNetwork]:
+        """
+        Lazily yields subnets in ascending order, skipping the first `offset` ones.
+        If `after` is specified, subnets start right behind this network.
+        If `q` is specified, only subnets whose string representation starts with `q`
+        are returned. Aligned blocks are intersected with the ranges `q` can match,
+        so subnets that cannot match are never built.
+        If `prefix_len` is 0, the free space is returned as the minimal list of CIDRs.
+        """
+        q = str(q or '')
+        for version, intervals in self._iter_intervals(after):
+            width = ADDRESS_WIDTH[version]
+            if prefix_len == 0:
+                for first, last in intervals:
+                    cidrs = self._get_cidrs(version, first, last)
+                    if q:
+                        cidrs = [cidr for cidr in cidrs if str(cidr).startswith(q)]
+                    if offset < len(cidrs):
+                        yield from cidrs[offset:]
+                    offset = max(0, offset - len(cidrs))
+                continue
+            if prefix_len > width:
+                continue
+            size = 1 << (width - prefix_len)
+            for start, count in self._get_blocks(intervals, version, prefix_len, q):
+                start, count = int(start), int(count)
+                for index in range(offset, count):
+                    yield IPNetwork((start + index * size, prefix_len), version)
+                offset = max(0, offset - count)
+
+    @staticmethod
+    def _get_blocks(intervals: IntervalSet, version: int, prefix_len: int,
+                    q: str) -> Iterable[Tuple[int, int]]:
+        """
+        Returns (start, count) of free aligned blocks of subnets.
+        Without `q` all blocks are returned, otherwise only the subnets whose
+        string representation starts with `q`.
+        """
+        size = 1 << (ADDRESS_WIDTH[version] - prefix_len)
+        blocks = zip(*intervals.aligned(size))
+        if not q:
+            return blocks
+        ranges, exact = get_network_ranges(q, version, prefix_len)
+        free = IntervalSet.from_ranges(
+            (int(start) // size, int(start) // size + int(count) - 1) for start, count in blocks if count > 0
+        )
+        if not exact:
+            # An IPv6 address without the prefix length
+            runs = AddressMatcher(q, version, prefix_len).iter_runs(free, size)
+            return ((first * size, last - first + 1) for first, last in runs)
+        matched = IntervalSet.from_ranges(
+            (-(-first // size), last // size) for first, last in ranges if -(-first // size) <= last // size
+        )
+        return [(first * size, last - first + 1) for first, last in free.intersection(matched)]
+
+    @staticmethod
+    def _get_cidrs(version: int, first: int, last: int) -> List[IPNetwork]:
+        """
+        Returns the minimal list of CIDRs covering the range.
+        """
+        width = ADDRESS_WIDTH[version]
+        cidrs = []
+        while first <= last:
+            bits = (first & -first).bit_length() - 1 if first else width
+            while first + (1 << bits) - 1 > last:
+                bits -= 1
+            cidrs.append(IPNetwork((first, width - bits), version))
+            first += 1 << bits
+        return cidrs
+
+    def largest(self) -> Union[IPNetwork, None]:
+        """
+        Returns the largest free subnet (the first one if there are several of the
+        same size) or None if there is no free space.
+        """
+        best = None
+        for version, intervals in self.intervals.items():
+            width = ADDRESS_WIDTH[version]
+            for first, last in intervals:
+                bits = (last - first + 1).bit_length() - 1
+                if best is not None and bits <= width - best.prefixlen:
+                    continue
+                # A range of 2^bits addresses holds an aligned block of at least 2^(bits - 1)
+                for size_bits in (bits, bits - 1):
+                    start = -(-first >> size_bits) << size_bits
+                    if start + (1 << size_bits) - 1 <= last:
+                        break
+                if best is None or size_bits > width - best.prefixlen:
+                    best = IPNetwork((start, width - size_bits), version)
+        return best
+
+    def split(self, prefix_len: int, limit: int = None, offset: int = 0) -> List[IPNetwork]:
+        return list(islice(self.iter_subnets(prefix_len, offset), limit or None))
+
+    def count(self, prefix_len: int) -> int:
+        """
+        Returns the number of subnets with `prefix_len` that fit into the free space.
+        """
+        count = 0
+        for version, intervals in self.intervals.items():
+            width = ADDRESS_WIDTH[version]
+            if prefix_len == 0:
+                count += sum(len(self._get_cidrs(version, first, last)) for first, last in intervals)
+            elif prefix_len <= width:
+                count += int(sum(intervals.aligned(1 << (width - prefix_len))[1]))
+        return count
+
+
+class SubnetPlanner:
+    """
+    Carves subnets of mixed sizes out of free space in one pass with a buddy allocator.
+    The free space is kept as lists of aligned blocks per size. Subnets are assigned
+    from the largest to the smallest, each from the smallest free block it fits in
+    (the one with the lowest address), and a larger block is halved until it has
+    the requested size. So small subnets fill the leftovers of large ones and the
+    rest of the free space stays in as few large blocks as possible.
+    """
+
+    def __init__(self, prefixes: IPSet):
+        self.intervals = IPSplitter(prefixes).intervals
+
+    @classmethod
+    def from_intervals(cls, intervals: Dict[int, IntervalSet]) -> 'SubnetPlanner':
+        """
+        Returns a planner of free space given as integer addresses per IP version.
+        """
+        planner = cls(IPSet())
+        planner.intervals.update(intervals)
+        return planner
+
+    def _get_version(self, version: int = None) -> int:
+        if version is not None:
+            if version not in ADDRESS_WIDTH:
+                raise ValueError("invalid IP version")
+            return version
+        versions = [v for v, intervals in self.intervals.items() if intervals]
+        if len(versions) > 1:
+            raise ValueError("the IP version must be specified")
+        return versions[0] if versions else 4
+
+    @staticmethod
+    def _get_requests(requests: Union[Mapping[int, int], Iterable[int]], width: int) -> Mapping[int, int]:
+        if not isinstance(requests, Mapping):
+            requests = Counter(requests)
+        for prefix_len, count in requests.items():
+            if not isinstance(prefix_len, int) or not 0 <= prefix_len <= width:
+                raise ValueError(f"invalid prefix length: {prefix_len}")
+            if not isinstance(count, int) or count < 0:
+                raise ValueError(f"invalid number of /{prefix_len} subnets: {count}")
+        return requests
+
+    @staticmethod
+    def _take(free: List[List[int]], bits: int) -> int:
+        """
+        Takes a block of 2**bits addresses from the smallest free block it fits in.
+        """
+        size_bits = next((b for b in range(bits, len(free)) if free[b]), None)
+        if size_bits is None:
+            raise IndexError("not enough free space")
+        start = heappop(free[size_bits])
+        # Keep the lower half and free the upper one (its buddy)
+        while size_bits > bits:
+            size_bits -= 1
+            heappush(free[size_bits], start + (1 << size_bits))
+        return start
+
+    def plan(self, requests: Union[Mapping[int, int], Iterable[int]], version: int = None,
+             exclude: IPSet = None) -> Dict[int, List[IPNetwork]]:
+        """
+        Returns subnets for `requests`, either {prefix_len: count} or a list of prefix
+        lengths, as {prefix_len: [subnets in ascending order]}. Addresses in `exclude`
+        are not assigned. Either all the subnets are assigned or IndexError is raised.
+        """
+        version = self._get_version(version)
+        width = ADDRESS_WIDTH[version]
+        requests = self._get_requests(requests, width)
+        intervals = self.intervals[version]
+        if exclude:
+            intervals = intervals.difference(IntervalSet.from_ipset(exclude, version))
+        # Heaps of the first addresses of free blocks per block size in bits
+        free = [[] for _ in range(width + 1)]
+        for first, last in intervals:
+            for cidr in IPSplitter._get_cidrs(version, first, last):
+                heappush(free[width - cidr.prefixlen], cidr.first)
+
+        plan = {}
+        for prefix_len in sorted(requests):
+            bits = width - prefix_len
+            subnets = []
+            for _ in range(requests[prefix_len]):
+                subnets.append(IPNetwork((self._take(free, bits), prefix_len), version))
+            plan[prefix_len] = sorted(subnets)
+        return plan
+
+
+def _match_group_ranges(part: str, base: int, max_value: int) -> List[Tuple[int, int]]:
+    """
+    Returns ranges of group (octet or hextet) values whose string representation
+    in the numeral system `base` starts with `part`. Groups are never printed with
+    leading zeros, so "0" matches only zero and "01" matches nothing.
+    """
+
+    if part == '':
+        return [(0, max_value)]
+    if any(c not in '0123456789abcdef'[:base] for c in part):
+        return []
+    if part[0] == '0':
+        return [(0, 0)] if part == '0' else []
+    value = int(part, base)
+    ranges = []
+    scale = 1
+    while value * scale <= max_value:
+        ranges.append((value * scale, min(value * scale + scale - 1, max_value)))
+        scale *= base
+    return ranges
+
+
+def _group_prefix_ranges(groups: List[int], partial: List[Tuple[int, int]], group_bits: int,
+                         width: int) -> List[Tuple[int, int]]:
+    """
+    Converts leading groups with fixed values followed by a group limited to
+    `partial` ranges into ranges of integer addresses.
+    """
+
+    value = 0
+    for group in groups:
+        value = (value << group_bits) | group
+    shift = width - group_bits * (len(groups) + 1)
+    ranges = []
+    for first, last in partial:
+        ranges.append((
+            ((value << group_bits) | first) << shift,
+            (((value << group_bits) | last) << shift) | ((1 << shift) - 1),
+        ))
+    return ranges
+
+
+def _exact_groups(parts: List[str], base: int, max_value: int) -> List[int]:
+    """
+    Returns values of fully specified groups or None if any of them can not be
+    printed that way.
+    """
+
+    groups = []
+    for part in parts:
+        ranges = _match_group_ranges(part, base, max_value)
+        if part == '' or len(ranges) == 0:
+            return None
+        groups.append(ranges[0][0])
+    return groups
+
+
+def get_address_ranges(q: str, version: int) -> Tuple[List[Tuple[int, int]], bool]:
+    """
+    Returns sorted ranges of integer addresses whose string representation may
+    start with `q`, and a flag that indicates whether every address in the ranges
+    matches for sure. The ranges are a superset of matching IPv6 addresses,
+    because zero compression makes the textual form ambiguous, so such
+    candidates have to be checked against `q` one by one. Use `AddressMatcher`
+    to search free space.
+    """
 
-    def split(self, prefix_len: int, limit: int = None) -> List[IPNetwork]:
-        subnets = []
-        if prefix_len == 0:
-            return list(self.prefixes.iter_cidrs())
-        for free_net in self.prefixes.iter_cidrs():
-            if free_net.prefixlen > prefix_len:
+    width = ADDRESS_WIDTH[version]
+    if not q:
+        return [(0, (1 << width) - 1)], True
+    if version == 4:
+        return _get_ipv4_ranges(q), True
+    if q != q.lower():
+        return [], True
+    head, compressed, tail = q.partition('::')
+    if not compressed and head.startswith(':'):
+        # A leading colon is always the beginning of "::".
+        head, compressed, tail = '', '::', ''
+    if compressed:
+        return _get_compressed_ipv6_ranges(head, tail), False
+
+    parts = head.split(':')
+    groups = _exact_groups(parts[:-1], 16, 0xffff)
+    # An embedded IPv4 address is printed only after "::".
+    if groups is None or len(parts) > 8 or '.' in q:
+        return [], True
+    return _group_prefix_ranges(groups, _match_group_ranges(parts[-1], 16, 0xffff), 16, width), False
+
+
+def get_network_ranges(q: str, version: int, prefix_len: int = None) -> Tuple[List[Tuple[int, int]], bool]:
+    """
+    Same as `get_address_ranges` for networks printed as "address/prefixlen".
+    If `q` contains the prefix length, the address must be printed in full. The prefix
+    length is checked against `prefix_len` unless it is None.
+    """
+
+    address, slash, length = q.partition('/')
+    if not slash:
+        return get_address_ranges(q, version)
+    if prefix_len is not None and not str(prefix_len).startswith(length):
+        return [], True
+    try:
+        ip = IPAddress(address, version)
+    except (AddrFormatError, ValueError, TypeError):
+        return [], True
+    if str(ip) != address:
+        return [], True
+    return [(ip.value, ip.value)], prefix_len is not None
+
+
+def get_number_ranges(q: str, max_value: int) -> List[Tuple[int, int]]:
+    """
+    Returns sorted ranges of integers from 0 to `max_value` whose decimal
+    representation starts with `q` (e.g. VIDs).
+    """
+
+    return _match_group_ranges(str(q or ''), 10, max_value)
+
+
+def ranges_to_cidrs(ranges: Iterable[Tuple[int, int]], version: int) -> List[IPNetwork]:
+    """
+    Returns the minimal list of CIDRs covering `ranges`.
+    """
+
+    return [cidr for first, last in ranges for cidr in IPSplitter._get_cidrs(version, first, last)]
+
+
+def _get_ipv4_ranges(q: str) -> List[Tuple[int, int]]:
+    parts = q.split('.')
+    groups = _exact_groups(parts[:-1], 10, 255)
+    if groups is None or len(parts) > 4:
+        return []
+    return _group_prefix_ranges(groups, _match_group_ranges(parts[-1], 10, 255), 8, 32)
+
+
+def _get_compressed_ipv6_ranges(head: str, tail: str) -> List[Tuple[int, int]]:
+    # "::" replaces at least two zero hextets, and the hextets behind it
+    # may be placed at any position up to the end of the address.
+    groups = _exact_groups(head.split(':') if head else [], 16, 0xffff)
+    if groups is None or len(groups) > 6:
+        return []
+    if not tail:
+        return _group_prefix_ranges(groups + [0], [(0, 0)], 16, 128)
+    # IPv4-compatible and IPv4-mapped addresses are printed as "::a.b.c.d"
+    # and "::ffff:a.b.c.d".
+    ranges = []
+    if not head:
+        for prefix, base in (('ffff:', 0xffff << 32), ('', 0)):
+            if tail.startswith(prefix):
+                ranges.extend((base + first, base + last) for first, last in _get_ipv4_ranges(tail[len(prefix):]))
+            elif prefix.startswith(tail):
+                ranges.append((base, base + 0xffffffff))
+    tail_parts = tail.split(':')
+    tail_groups = _exact_groups(tail_parts[:-1], 16, 0xffff)
+    partial = _match_group_ranges(tail_parts[-1], 16, 0xffff)
+    if tail_groups is None or len(partial) == 0:
+        return merge_ranges(ranges)
+    for size in range(len(tail_parts), 7 - len(groups)):
+        zeros = [0] * (8 - len(groups) - size)
+        ranges.extend(_group_prefix_ranges(groups + zeros + tail_groups, partial, 16, 128))
+    return merge_ranges(ranges)
+
+
+# Fields of printed IPv6 addresses as (bits, base)
+HEXTET = (16, 16)
+OCTET = (8, 10)
+
+
+class _Layout(NamedTuple):
+    """
+    One way inet_ntop prints IPv6 addresses: `tokens` are the printed fields
+    (indices of `fields`) and separators, `fixed` limits values of fields and
+    `max_zeros` limits runs of zero hextets outside "::" (None if not counted).
+    """
+    fields: Tuple[Tuple[int, int], ...]
+    tokens: Tuple[Union[int, str], ...]
+    fixed: Dict[int, List[Tuple[int, int]]]
+    max_zeros: Tuple[Union[int, None], ...]
+
+
+def _join_fields(indices: Iterable[int], separator: str) -> List[Union[int, str]]:
+    tokens = []
+    for index in indices:
+        if tokens:
+            tokens.append(separator)
+        tokens.append(index)
+    return tokens
+
+
+def _get_ipv6_layouts() -> List[_Layout]:
+    # "::" replaces the longest run of at least two zero hextets, the leftmost one
+    # if there are several. The last 32 bits are printed as an IPv4 address after
+    # six zero hextets ("::a.b.c.d") or after five zero hextets and 0xffff
+    # ("::ffff:a.b.c.d").
+    layouts = [_Layout((HEXTET,) * 8, tuple(_join_fields(range(8), ':')), {}, (1,) * 8)]
+    for length in range(2, 9):
+        for start in range(0, 9 - length):
+            end = start + length
+            if (start, length) == (0, 6):
+                continue
+            fixed = {index: [(0, 0)] for index in range(start, end)}
+            if start > 0:
+                fixed[start - 1] = [(1, 0xffff)]
+            if end < 8:
+                fixed[end] = [(1, 0xfffe)] if (start, length) == (0, 5) else [(1, 0xffff)]
+            layouts.append(_Layout(
+                (HEXTET,) * 8,
+                tuple(_join_fields(range(start), ':') + ['::'] + _join_fields(range(end, 8), ':')),
+                fixed,
+                tuple(length - 1 if index < start else length if index >= end else None for index in range(8)),
+            ))
+    ipv4_fields = (HEXTET,) * 6 + (OCTET,) * 4
+    ipv4_tokens = tuple(_join_fields(range(6, 10), '.'))
+    zeros = {index: [(0, 0)] for index in range(6)}
+    for fixed in ({6: [(1, 255)]}, {6: [(0, 0)], 7: [(1, 255)]}):
+        layouts.append(_Layout(ipv4_fields, ('::',) + ipv4_tokens, {**zeros, **fixed}, (None,) * 10))
+    layouts.append(_Layout(ipv4_fields, ('::ffff:',) + ipv4_tokens, {**zeros, 5: [(0xffff, 0xffff)]}, (None,) * 10))
+    return layouts
+
+
+_IPV6_LAYOUTS = _get_ipv6_layouts()
+
+
+def _intersect_ranges(ranges: List[Tuple[int, int]], other: List[Tuple[int, int]]) -> List[Tuple[int, int]]:
+    return sorted(
+        (max(first, start), min(last, end))
+        for first, last in ranges for start, end in other if max(first, start) <= min(last, end)
+    )
+
+
+def _match_layout(q: str, layout: _Layout) -> Union[Dict[int, List[Tuple[int, int]]], None]:
+    """
+    Returns ranges of values of the fields `q` covers if addresses printed in
+    `layout` can start with `q`, otherwise None.
+    """
+
+    allowed = {}
+    pos = 0
+    for token in layout.tokens:
+        if pos == len(q):
+            break
+        rest = q[pos:]
+        if isinstance(token, str):
+            if not rest.startswith(token) and not token.startswith(rest):
+                return None
+            pos = min(len(q), pos + len(token))
+            continue
+        bits, base = layout.fields[token]
+        end = min((index for index in (rest.find(':'), rest.find('.')) if index >= 0), default=len(rest))
+        ranges = _match_group_ranges(rest[:end], base, (1 << bits) - 1)
+        if end < len(rest):
+            # The field is followed by a separator, so it is printed in full
+            ranges = ranges[:1] if end else []
+        if not ranges:
+            return None
+        allowed[token] = ranges
+        pos += end
+    return allowed if pos == len(q) else None
+
+
+class _FieldPattern:
+    """
+    Addresses printed in one layout with every field limited to ranges of values
+    (multiples of `steps`). The smallest matching address is searched field by
+    field like the next number with given digits.
+    """
+
+    def __init__(self, widths: List[int], allowed: List[List[Tuple[int, int]]], steps: List[int],
+                 max_zeros: Tuple[Union[int, None], ...]):
+        self.widths = widths
+        self.shifts = [sum(widths[index + 1:]) for index in range(len(widths))]
+        self.allowed = allowed
+        self.steps = steps
+        self.max_zeros = max_zeros
+        # (field, zeros) => the smallest values of the remaining fields
+        self._least = {}
+
+    @classmethod
+    def from_layout(cls, layout: _Layout, q: str, host_bits: int) -> Union['_FieldPattern', None]:
+        """
+        Returns the pattern of addresses printed in `layout` that start with `q`
+        and have `host_bits` zero low bits, or None if there are no such addresses.
+        """
+        allowed = _match_layout(q, layout)
+        if allowed is None:
+            return None
+        widths = [bits for bits, _ in layout.fields]
+        pattern = cls(widths, [], [], layout.max_zeros)
+        for index, bits in enumerate(widths):
+            ranges = [(0, (1 << bits) - 1)]
+            for limit in (layout.fixed.get(index), allowed.get(index)):
+                if limit is not None:
+                    ranges = _intersect_ranges(ranges, limit)
+            shift = pattern.shifts[index]
+            step = 1
+            if host_bits >= shift + bits:
+                ranges = _intersect_ranges(ranges, [(0, 0)])
+            elif host_bits > shift:
+                step = 1 << (host_bits - shift)
+            pattern.allowed.append(ranges)
+            pattern.steps.append(step)
+            if pattern._value(index, 0) is None:
+                return None
+        return pattern
+
+    def _value(self, index: int, low: int) -> Union[int, None]:
+        """
+        Returns the smallest allowed value of the field not less than `low`.
+        """
+        step = self.steps[index]
+        for first, last in self.allowed[index]:
+            value = -(-max(first, low) // step) * step
+            if value <= last:
+                return value
+        return None
+
+    def _search(self, index: int, digits: List[int], tight: bool, zeros: int) -> Union[List[int], None]:
+        if index == len(self.widths):
+            return []
+        if not tight and (index, zeros) in self._least:
+            return self._least[(index, zeros)]
+        found = None
+        max_zeros = self.max_zeros[index]
+        value = self._value(index, digits[index] if tight else 0)
+        while value is not None:
+            run = zeros + 1 if max_zeros is not None and value == 0 else 0
+            if max_zeros is not None and run > max_zeros:
+                value = self._value(index, 1)
                 continue
-            subnets.extend(list(free_net.subnet(prefix_len)))
-            if limit and len(subnets) > limit:
-                subnets = subnets[:limit]
+            exact = tight and value == digits[index]
+            rest = self._search(index + 1, digits, exact, run)
+            if rest is not None:
+                found = [value] + rest
+                break
+            # Greater nonzero values leave the same choice for the remaining fields
+            if value and not exact:
                 break
+            value = self._value(index, value + 1)
+        if not tight:
+            self._least[(index, zeros)] = found
+        return found
+
+    def next(self, value: int) -> Union[Tuple[int, int], None]:
+        """
+        Returns (first, last) of the first run of matching addresses not less
+        than `value`, or None. The last field of the run takes all the allowed
+        values starting with the one of the first address.
+        """
+        digits = [(value >> shift) & ((1 << width) - 1) for width, shift in zip(self.widths, self.shifts)]
+        fields = self._search(0, digits, True, 0)
+        if fields is None:
+            return None
+        first = sum(field << shift for field, shift in zip(fields, self.shifts))
+        end = next(last for start, last in self.allowed[-1] if start <= fields[-1] <= last)
+        return first, first + end - fields[-1]
+
+
+class AddressMatcher:
+    """
+    Finds addresses whose string representation starts with `q`. IPv4 queries
+    are converted to ranges of integers. The textual form of IPv6 addresses
+    depends on zero compression, so each way of printing them is matched field
+    by field instead. Either way the cost depends on the number of matches
+    rather than on the number of addresses that are skipped.
+    If `prefix_len` is specified, only the first addresses of subnets of this
+    length are matched.
+    """
+
+    def __init__(self, q: str, version: int, prefix_len: int = None):
+        host_bits = ADDRESS_WIDTH[version] - prefix_len if prefix_len is not None else 0
+        self.step = 1 << host_bits
+        ranges, exact = get_address_ranges(str(q or ''), version)
+        self.ranges = ranges if exact else None
+        self.lasts = [last for _, last in ranges] if exact else []
+        self.patterns = []
+        if not exact:
+            self.patterns = [
+                pattern for pattern in (_FieldPattern.from_layout(layout, q, host_bits) for layout in _IPV6_LAYOUTS)
+                if pattern is not None
+            ]
+        # pattern index => (value, the run found for it)
+        self._found = {}
+
+    def _next_range(self, value: int) -> Union[Tuple[int, int], None]:
+        for index in range(bisect_left(self.lasts, value), len(self.ranges)):
+            first, last = self.ranges[index]
+            first = -(-max(first, value) // self.step) * self.step
+            if first <= last:
+                return first, last
+        return None
+
+    def _next_pattern(self, index: int, value: int) -> Union[Tuple[int, int], None]:
+        if index in self._found:
+            found_for, run = self._found[index]
+            if found_for <= value and (run is None or value <= run[0]):
+                return run
+        run = self.patterns[index].next(value)
+        self._found[index] = (value, run)
+        return run
+
+    def next(self, value: int) -> Union[Tuple[int, int], None]:
+        """
+        Returns (first, last) of the first run of matching addresses not less
+        than `value`, or None. If `prefix_len` is specified, the multiples of the
+        subnet size in the run match.
+        """
+        if self.ranges is not None:
+            return self._next_range(value)
+        runs = [run for run in (self._next_pattern(index, value) for index in range(len(self.patterns))) if run]
+        return min(runs, default=None)
+
+    def iter_runs(self, intervals: IntervalSet, scale: int = 1) -> Iterator[Tuple[int, int]]:
+        """
+        Lazily yields ranges of matching values of `intervals` in ascending order.
+        Values are counted in units of `scale` addresses, e.g. subnets.
+        """
+        free = intervals.range_from(0) if intervals else None
+        while free is not None:
+            run = self.next(free[0] * scale)
+            if run is None:
+                return
+            first, last = -(-run[0] // scale), min(run[1] // scale, free[1])
+            if first <= last:
+                yield first, last
+            # Jump to the free range the next match may be in
+            free = intervals.range_from(max(first, last + 1))
+
+
+def iter_available_ips(ipset: IPSet, q: str = '', after: IPAddress = None) -> Iterator[IPAddress]:
+    """
+    Lazily yields addresses from `ipset` in ascending order.
+    If `q` is specified, only addresses starting with `q` are returned. The free
+    ranges are walked together with the addresses `q` can match (see
+    `AddressMatcher`), so the addresses that cannot match are skipped without
+    being generated.
+    If `after` is specified, the walk resumes right behind this address.
+    """
 
-        return subnets
+    for version in ADDRESS_WIDTH:
+        if after is not None and version < after.version:
+            continue
+        intervals = IntervalSet.from_ipset(ipset, version)
+        if after is not None and version == after.version:
+            intervals = intervals.after(after.value)
+        for first, last in AddressMatcher(q, version).iter_runs(intervals):
+            for value in range(first, last + 1):
+                yield IPAddress(value, version)
 
 
 def get_available_ips_list(ipset: IPSet, base_addr: str, size: int) -> List[IPAddress]:
@@ -32,19 +994,78 @@ def get_available_ips_list(ipset: IPSet, base_addr: str, size: int) -> List[IPAd
     Raises IndexError if there are not enough free addresses.
     """
 
-    base_addr = base_addr.split('/')[0]
-    all = IPSet(['0.0.0.0/0'])
-    excluded = IPSet([IPRange('0.0.0.0', IPAddress(base_addr) - 1),])
-
-    availables = (all ^ excluded) & ipset
-    addresses = []
-    for ip in availables:
-        if len(addresses) >= size:
-            break
-        addresses.append(ip)
-    if len(addresses) != size:
+    base_addr = IPAddress(base_addr.split('/')[0])
+    availables = IntervalSet.from_ipset(ipset, base_addr.version)
+    try:
+        values = availables.first(size, base_addr.value)
+    except IndexError:
         raise IndexError("not enough free addresses")
-    return addresses
+    return [IPAddress(value, base_addr.version) for value in values]
+
+
+def _find_blocks(intervals: IntervalSet, count: int, start: int, size: int, step: int,
+                 contiguous: bool) -> List[int]:
+    """
+    Returns the first values of up to `count` free blocks of `size` values.
+    """
+
+    # Also keeps huge counts out of the int64 arithmetic of NumPy
+    if count * size > intervals.size:
+        return []
+    if contiguous:
+        first = intervals.find_run(count * size, start, step)
+        return [] if first is None else [first + index * size for index in range(count)]
+    if step == 1:
+        return intervals.first(count, start) if intervals.size - intervals.rank(start) >= count else []
+    return list(islice(intervals.after(start - 1).iter_blocks(size, step), count))
+
+
+def allocate(ipset: IPSet, count: int, base: str = None, prefix_len: int = None, alignment: int = 1,
+             contiguous: bool = False, exclude: IPSet = None) -> List[Union[IPAddress, IPNetwork]]:
+    """
+    Returns the first `count` free addresses from `ipset`, or subnets if `prefix_len`
+    is specified, starting with `base`. Every returned object starts at a multiple
+    of `alignment` addresses. If `contiguous` is set, the objects form a single
+    block without gaps and only the first object is aligned. Addresses in
+    `exclude` are not allocated.
+    Raises IndexError if there is not enough free space.
+    """
+
+    if count <= 0:
+        raise ValueError("count must be positive")
+    if alignment <= 0 or alignment & (alignment - 1):
+        raise ValueError("alignment must be a power of two")
+    if base:
+        start = IPAddress(base.split('/')[0])
+        version, start = start.version, start.value
+    else:
+        version = next((cidr.version for cidr in ipset.iter_cidrs()), 4)
+        start = 0
+    width = ADDRESS_WIDTH[version]
+    if prefix_len is not None and not 0 < prefix_len <= width:
+        raise ValueError("invalid prefix length")
+
+    intervals = IntervalSet.from_ipset(ipset, version)
+    if exclude:
+        intervals = intervals.difference(IntervalSet.from_ipset(exclude, version))
+    size = 1 if prefix_len is None else 1 << (width - prefix_len)
+    values = _find_blocks(intervals, count, start, size, max(size, alignment), contiguous)
+    if len(values) < count:
+        raise IndexError("not enough free space")
+    if prefix_len is None:
+        return [IPAddress(value, version) for value in values]
+    return [IPNetwork((value, prefix_len), version) for value in values]
+
+
+def plan_subnets(ipset: IPSet, requests: Union[Mapping[int, int], Iterable[int]], version: int = None,
+                 exclude: IPSet = None) -> Dict[int, List[IPNetwork]]:
+    """
+    Assigns subnets of mixed sizes from `ipset` in one pass, see `SubnetPlanner`.
+    `requests` is {prefix_len: count} or a list of prefix lengths. Returns
+    {prefix_len: [subnets]}. Raises IndexError if there is not enough free space.
+    """
+
+    return SubnetPlanner(ipset).plan(requests, version, exclude)
 
 
 def make_link(obj: Any) -> str:
@@ -13,8 +13,12 @@ setup(
     install_requires=[
         'netaddr'
     ],
+    extras_require={
+        'numpy': ['numpy'],
+        'test': ['fakeredis'],
+    },
     packages=find_packages(exclude=["*tests.*", "*tests"]),
-    package_data={},
+    package_data={'netbox_scripthelper': ['static/netbox_scripthelper/*.js']},
     include_package_data=True,
     zip_safe=False,
 )